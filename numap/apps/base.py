@@ -6,6 +6,7 @@ import os
 import importlib
 import logging
 import inspect
+import asyncio
 try:
     import docopt
 except ImportError:  # pragma: no cover - handled in __init__
@@ -13,7 +14,9 @@ except ImportError:  # pragma: no cover - handled in __init__
 
 # TODO: replace FaceDancerPhy with just FaceDancerApp
 FacedancerUSBApp = None
-from numap.utils.ulogger import set_default_handler_level
+from numap.utils.ulogger import set_default_handler_level, start_background_logging
+from numap.utils.ulogger import DEFAULT_LOG_QUEUE_SIZE
+from numap.utils.completion import TestCompletion
 
 
 def _import_greatfet():  # pragma: no cover - simple import helper
@@ -27,7 +30,10 @@ def _import_greatfet():  # pragma: no cover - simple import helper
 class NumapApp(object):
 
     def __init__(self, docstring=None):
-        if docstring is not None:
+        if isinstance(docstring, dict):
+            # options that were already parsed (scan worker processes)
+            self.options = dict(docstring)
+        elif docstring is not None:
             if docopt is None:
                 raise ImportError(
                     'docopt is required when providing a CLI docstring to NumapApp'
@@ -52,7 +58,10 @@ class NumapApp(object):
         self.logger = self.get_logger()
         self.num_processed = 0
         self.fuzzer = None
+        # resolved by numap.fuzz.helpers.fuzzing_active
+        self.fuzz_path_enabled = None
         self.setup_packet_received = False
+        self.test_completion = TestCompletion()
 
     def get_logger(self):
         levels = {
@@ -69,6 +78,13 @@ class NumapApp(object):
             set_default_handler_level(logging.VERBOSE)
         if self.options.get('--quiet', False):
             set_default_handler_level(logging.WARNING)
+        log_queue = self.options.get('--log-queue')
+        log_file = self.options.get('--log-file')
+        if log_queue or log_file:
+            start_background_logging(
+                max_records=int(log_queue) if log_queue else DEFAULT_LOG_QUEUE_SIZE,
+                log_file=log_file
+            )
         return logger
 
     def load_phy(self, phy_string):
@@ -81,6 +97,12 @@ class NumapApp(object):
                 return phy
             return self._create_legacy_facedancer_phy(phy_string)
 
+        if phy_selector.startswith('vhost'):
+            from numap.phy.vhost import VirtualHostPhy
+            host_os = phy_selector.split(':', 1)[1].strip() if ':' in phy_selector else 'linux'
+            self.logger.info('Using virtual host PHY (%s)', host_os)
+            return VirtualHostPhy(self, host_os=host_os)
+
         if phy_selector.startswith('greatfet'):
             serial = None
             if ':' in phy_string:
@@ -236,6 +258,19 @@ class NumapApp(object):
         Signal that we received a setup packet from the host (host is alive)
         '''
         self.setup_packet_received = True
+        self.test_completion.setup_received()
+
+    def signal_device_configured(self):
+        '''
+        Signal that the host set the device configuration
+        '''
+        self.test_completion.configured()
+
+    def signal_host_gone(self):
+        '''
+        Signal that the host went away (called by PHYs that can tell)
+        '''
+        self.test_completion.host_gone()
 
     def should_stop_phy(self):
         '''
@@ -243,6 +278,29 @@ class NumapApp(object):
         '''
         return False
 
+    async def wait_test_completion(self, device_run):
+        '''
+        Run the device until the current test completes
+        (see numap.utils.completion), or until the device stops.
+
+        :param device_run: awaitable returned by the device run method
+        :return: completion reason, None if the device stopped first
+        '''
+        device_task = asyncio.ensure_future(device_run)
+        completion = asyncio.ensure_future(self.test_completion.wait_async())
+        try:
+            await asyncio.wait([device_task, completion], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (device_task, completion):
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(device_task, completion, return_exceptions=True)
+        if completion.cancelled():
+            # the device stopped, raise its error, if any
+            device_task.result()
+            return None
+        return completion.result()
+
     def usb_function_supported(self, reason=None):
         '''
         Callback from a USB device, notifying that the current USB device
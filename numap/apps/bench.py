@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+'''
+Benchmark nümap request handling against a simulated host
+
+Usage:
+    numapbench [-C=DEVICE_CLASS ...] [-n=COUNT] [-e=COUNT] [-b=BYTES] [-o=FILE] [--host=OS] [-q] [-v ...]
+
+Options:
+    -C --class DEVICE_CLASS     class to benchmark, can be repeated (default: all classes)
+    -n --requests COUNT         number of control requests to time per class [default: 2000]
+    -e --enumerations COUNT     number of enumerations to time per class [default: 20]
+    -b --bulk-bytes BYTES       number of bytes to transfer on bulk endpoints [default: 1048576]
+    -o --output FILE            write the results to FILE (default: stdout)
+    --host OS                   enumeration style of the simulated host: linux, windows [default: linux]
+    -v --verbose                verbosity level
+    -q --quiet                  quiet mode. only print warning/error messages
+
+Results are printed as JSON, with these numbers per class:
+    control_requests_per_sec    standard control requests handled per second
+    enumeration_ms              mean time of a full enumeration
+    bulk_out_bytes_per_sec      bytes per second received on the first bulk OUT endpoint
+    bulk_in_bytes_per_sec       bytes per second sent by mass storage on SCSI READ(10)
+
+Example:
+    numapbench -q -C mass_storage -C keyboard -o bench.json
+'''
+import json
+import os
+import platform
+import shutil
+import struct
+import tempfile
+import time
+import traceback
+from numap.apps.base import NumapApp
+from numap.core.usb import DescriptorType
+from numap.core.usb_class import USBClass
+from numap.core.usb_endpoint import USBEndpoint
+from numap.phy.vhost import VirtualHostPhy
+
+BENCH_DISK_BLOCKS = 0x800
+
+
+class NumapBenchApp(NumapApp):
+
+    def __init__(self, options):
+        super(NumapBenchApp, self).__init__(options)
+        self.num_requests = int(self.options.get('--requests') or 2000)
+        self.num_enumerations = int(self.options.get('--enumerations') or 20)
+        self.bulk_bytes = int(self.options.get('--bulk-bytes') or 0x100000)
+        self.host_os = self.options.get('--host') or 'linux'
+        self.workdir = None
+
+    def run(self):
+        classes = self.options.get('--class') or self.umap_classes
+        self.workdir = tempfile.mkdtemp(prefix='numapbench')
+        cwd = os.getcwd()
+        # some devices (printer) write the received data to the current directory
+        os.chdir(self.workdir)
+        try:
+            results = {}
+            for device_name in classes:
+                self.logger.info('Benchmarking: %s', device_name)
+                try:
+                    results[device_name] = self.bench_class(device_name)
+                except Exception as ex:
+                    self.logger.warning('Failed to benchmark %s: %s', device_name, ex)
+                    self.logger.debug(traceback.format_exc())
+                    results[device_name] = {'error': str(ex)}
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        report = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'host_os': self.host_os,
+            'classes': results,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if self.options.get('--output'):
+            with open(self.options['--output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            print(output)
+        return report
+
+    def load_bench_device(self, device_name, phy):
+        if device_name == 'mass_storage':
+            from numap.dev.mass_storage import USBMassStorageDevice
+            image = os.path.join(self.workdir, 'stick.img')
+            if not os.path.exists(image):
+                with open(image, 'wb') as f:
+                    f.truncate(BENCH_DISK_BLOCKS * 0x200)
+            return USBMassStorageDevice(self, phy, disk_image_filename=image)
+        return self.load_device(device_name, phy)
+
+    def bench_class(self, device_name):
+        phy = VirtualHostPhy(self, host_os=self.host_os)
+        dev = self.load_bench_device(device_name, phy)
+        try:
+            dev.connect()
+            result = {
+                'enumeration_ms': self.bench_enumeration(phy, dev),
+                'control_requests_per_sec': self.bench_control_requests(phy),
+            }
+            result.update(self.bench_bulk(phy, dev))
+            result['stalls'] = phy.stats['stalls']
+            return result
+        finally:
+            dev.disconnect()
+            scsi_device = getattr(dev, 'scsi_device', None)
+            if scsi_device is not None:
+                scsi_device.stop()
+
+    def bench_enumeration(self, phy, dev):
+        '''
+        :return: mean time of an enumeration, in milliseconds
+        '''
+        enumerate_host = phy.enumerate_windows if self.host_os == 'windows' else phy.enumerate_linux
+        total = 0.0
+        for _ in range(self.num_enumerations):
+            phy.connect(dev)
+            start = time.perf_counter()
+            for _ in enumerate_host():
+                pass
+            total += time.perf_counter() - start
+        return total * 1000 / self.num_enumerations
+
+    def bench_control_requests(self, phy):
+        '''
+        :return: number of control requests handled per second
+        '''
+        requests = [
+            (0x80, 0x06, DescriptorType.device << 8, 0, 18),
+            (0x80, 0x06, DescriptorType.configuration << 8, 0, 0xff),
+            (0x80, 0x06, (DescriptorType.string << 8) | 1, 0x0409, 0xff),
+            (0x80, 0x00, 0, 0, 2),
+            (0x80, 0x08, 0, 0, 1),
+        ]
+        count = 0
+        start = time.perf_counter()
+        while count < self.num_requests:
+            for request in requests:
+                phy.control_transfer(*request)
+            count += len(requests)
+        return count / (time.perf_counter() - start)
+
+    def bench_bulk(self, phy, dev):
+        '''
+        :return: dictionary with bulk throughput numbers, None if the class has no such endpoint
+        '''
+        result = {'bulk_out_bytes_per_sec': None, 'bulk_in_bytes_per_sec': None}
+        interfaces = phy.active_interfaces()
+        for interface in interfaces:
+            if interface.iclass == USBClass.MassStorage:
+                result['bulk_in_bytes_per_sec'] = self.bench_scsi_read(phy, interface)
+                return result
+        for interface in interfaces:
+            ep = phy.find_endpoint(interface, USBEndpoint.direction_out, USBEndpoint.transfer_type_bulk)
+            if ep is not None:
+                result['bulk_out_bytes_per_sec'] = self.bench_bulk_out(phy, interface, ep)
+                return result
+        return result
+
+    def bench_bulk_out(self, phy, interface, ep):
+        if interface.iclass == USBClass.SmartCard:
+            # GetSlotStatus, so the packets are handled as valid CCID messages
+            packet = struct.pack('<BIBB3s', 0x65, 0, 0, 0, b'\x00\x00\x00')
+        else:
+            packet = b'\x00' * ep.max_packet_size
+        sent = 0
+        start = time.perf_counter()
+        while sent < self.bulk_bytes:
+            phy.bulk_out(ep.number, packet)
+            sent += len(packet)
+        return sent / (time.perf_counter() - start)
+
+    def bench_scsi_read(self, phy, interface):
+        ep_out = phy.find_endpoint(interface, USBEndpoint.direction_out, USBEndpoint.transfer_type_bulk)
+        ep_in = phy.find_endpoint(interface, USBEndpoint.direction_in, USBEndpoint.transfer_type_bulk)
+        blocks = 64
+        received = phy.stats['bytes_in']
+        start = time.perf_counter()
+        lba = 0
+        while phy.stats['bytes_in'] - received < self.bulk_bytes:
+            cb = struct.pack('>BBIBHB', 0x28, 0, lba, 0, blocks, 0)
+            for _ in phy.scsi_command(ep_out.number, ep_in.number, cb, blocks * 0x200):
+                pass
+            if phy.stats['timeouts']:
+                raise Exception('timed out waiting for SCSI READ(10) response')
+            lba = (lba + blocks) % (BENCH_DISK_BLOCKS - blocks)
+        return (phy.stats['bytes_in'] - received) / (time.perf_counter() - start)
+
+
+def main():
+    app = NumapBenchApp(__doc__)
+    app.run()
+
+
+if __name__ == '__main__':
+    main()
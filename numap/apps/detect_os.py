@@ -14,6 +14,7 @@ Physical layer:
     greatfet[:serial]       use a GreatFET board (auto-detects when serial omitted)
     facedancer              use legacy FaceDancer hardware
     gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    vhost[:linux|windows]   simulated host, drives enumeration without hardware
 
 Example:
     numapdetect -P greatfet -q
@@ -3,7 +3,7 @@
 Emulate a USB device
 
 Usage:
-    numapemulate -C=DEVICE_CLASS [-P=PHY_INFO] [-q] [--vid=VID] [--pid=PID] [-v ...]
+    numapemulate -C=DEVICE_CLASS [-P=PHY_INFO] [-q] [--vid=VID] [--pid=PID] [--log-file=FILE] [--log-queue=SIZE] [-v ...]
 
 Options:
     -P --phy PHY_INFO           physical layer info, see list below [default: auto]
@@ -12,11 +12,15 @@ Options:
     -q --quiet                  quiet mode. only print warning/error messages
     --vid VID                   override vendor ID
     --pid PID                   override product ID
+    --log-file FILE             also write the log to FILE (rotated at 10MB), implies --log-queue
+    --log-queue SIZE            write the log from a background thread, dropping records
+                                when more than SIZE are pending (default: 10000)
 
 Physical layer:
     greatfet[:serial]       use a GreatFET board (auto-detects when serial omitted)
     facedancer              use legacy FaceDancer hardware
     gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    vhost[:linux|windows]   simulated host, drives enumeration without hardware
     auto                    automatically detect how we should connect
 
 Examples:
@@ -40,6 +44,15 @@ class NumapEmulationApp(NumapApp):
         self.fuzzer = self.get_fuzzer()
         self.phy = self.load_phy(self.options['--phy'])
         self.dev = self.load_device(self.options['--class'], self.phy)
+        self.run_device()
+
+    def run_device(self):
+        '''
+        Connect the device, run it until the PHY stops, and disconnect it
+
+        :return: False if the user terminated the run
+        '''
+        interrupted = False
         try:
             self.dev.connect()
             result = self.dev.run()
@@ -47,10 +60,12 @@ class NumapEmulationApp(NumapApp):
                 asyncio.run(result)
         except KeyboardInterrupt:
             self.logger.info('user terminated the run')
+            interrupted = True
         except:
             self.logger.error('Got exception while connecting/running device')
             self.logger.error(traceback.format_exc())
         self.dev.disconnect()
+        return not interrupted
 
     def get_fuzzer(self):
         return None
@@ -3,7 +3,7 @@
 Emulate a USB device to be used for fuzzing
 
 Usage:
-    numapfuzz-C=DEVICE_CLASS [-P=PHY_INFO]  [-q] [--vid=VID] [--pid=PID] [-i=FUZZER_IP] [-p FUZZER_PORT] [-v ...]
+    numapfuzz-C=DEVICE_CLASS [-P=PHY_INFO]  [-q] [--vid=VID] [--pid=PID] [-i=FUZZER_IP] [-p FUZZER_PORT] [--control=SOCKET] [--log-file=FILE] [--log-queue=SIZE] [-v ...]
 
 Options:
     -P --phy PHY_INFO           physical layer info, see list below
@@ -11,23 +11,34 @@ Options:
     -v --verbose                verbosity level
     -i --fuzzer-ip HOST         hostname or IP of the fuzzer [default: 127.0.0.1]
     -p --fuzzer-port PORT       port of the fuzzer [default: 26007]
+    --control SOCKET            control socket of the fuzzer [default: /tmp/umap_kitty/control.sock]
     -q --quiet                  quiet mode. only print warning/error messages
     --vid VID                   override vendor ID
     --pid PID                   override product ID
+    --log-file FILE             also write the log to FILE (rotated at 10MB), implies --log-queue
+    --log-queue SIZE            write the log from a background thread, dropping records
+                                when more than SIZE are pending (default: 10000)
 
 Physical layer:
     greatfet[:serial]       use a GreatFET board (auto-detects when serial omitted)
     facedancer              use legacy FaceDancer hardware
     gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    vhost[:linux|windows]   simulated host, drives enumeration without hardware
 
 Examples:
     emulate disk-on-key:
         numapfuzz -P greatfet -C mass_storage
 '''
-import os
 import time
 from kitty.remote.rpc import RpcClient
 from numap.apps.emulate import NumapEmulationApp
+from numap.fuzz.channel import CONNECT, DISCONNECT, DEFAULT_SOCKET_PATH, ControlClient
+from numap.fuzz.stages import StagePlan
+
+# seconds between heartbeats
+HEARTBEAT_INTERVAL = 0.05
+# seconds between attempts to reconnect the control channel while the device is connected
+RECONNECT_INTERVAL = 1.0
 
 
 class NumapFuzzApp(NumapEmulationApp):
@@ -35,6 +46,11 @@ class NumapFuzzApp(NumapEmulationApp):
     def __init__(self, options):
         super(NumapFuzzApp, self).__init__(options)
         self.count = 0
+        self.channel = None
+        self.last_heartbeat = 0
+        self.next_reconnect = 0
+        self.stage_plan = StagePlan()
+        self.stage_plan_supported = True
 
     def get_fuzzer(self):
         fuzzer = RpcClient(
@@ -42,6 +58,8 @@ class NumapFuzzApp(NumapEmulationApp):
             port=int(self.options['--fuzzer-port'])
         )
         fuzzer.start()
+        self.channel = ControlClient(self.options.get('--control') or DEFAULT_SOCKET_PATH)
+        self.channel.connect()
         return fuzzer
 
     def should_stop_phy(self):
@@ -52,55 +70,94 @@ class NumapFuzzApp(NumapEmulationApp):
         return False
 
     def send_heartbeat(self):
-        heartbeat_file = '/tmp/umap_kitty/heartbeat'
-        if os.path.isdir(os.path.dirname(heartbeat_file)):
-            with open(heartbeat_file, 'a'):
-                os.utime(heartbeat_file, None)
+        now = time.monotonic()
+        if self.channel is not None and now - self.last_heartbeat >= HEARTBEAT_INTERVAL:
+            self.last_heartbeat = now
+            self.channel.heartbeat()
 
     def check_connection_commands(self):
         '''
         :return: whether performed reconnection
         '''
-        if self._should_disconnect():
-            self.phy.disconnect()
-            self._clear_disconnect_trigger()
-            # wait for reconnection request; no point in returning to service_irqs loop while not connected!
-            while not self._should_reconnect():
-                self._clear_disconnect_trigger()  # be robust to additional disconnect requests
-                time.sleep(0.1)
-        # now that we received a reconnect request, flow into the handling of it...
-        # be robust to reconnection requests, whether received after a disconnect request, or standalone
-        # (not sure this is right, might be better to *not* be robust in the face of possible misuse?)
-        if self._should_reconnect():
-            self.phy.connect(self.dev)
-            self._clear_reconnect_trigger()
-            return True
-        return False
-
-    def _should_reconnect(self):
-        if self.fuzzer:
-            if os.path.isfile('/tmp/umap_kitty/trigger_reconnect'):
-                return True
-        return False
-
-    def _clear_reconnect_trigger(self):
-        trigger = '/tmp/umap_kitty/trigger_reconnect'
-        if os.path.isfile(trigger):
-            os.remove(trigger)
+        if self.channel is None:
+            return False
+        reconnected = False
+        command = self.channel.poll()
+        if command is None and self.channel.closed:
+            command = self.reconnect_channel()
+        while command is not None:
+            name, seq = command
+            if name == DISCONNECT:
+                self.phy.disconnect()
+                self.stage_plan = StagePlan()
+                self.channel.ack(seq)
+                # no point in returning to service_irqs loop while not connected,
+                # wait for the next command (be robust to additional disconnect requests)
+                command = self.wait_command()
+                continue
+            if name == CONNECT:
+                # the device is still disconnected, so the round trip does not delay the host
+                self.update_stage_plan()
+                self.phy.connect(self.dev)
+                self.channel.ack(seq)
+                reconnected = True
+            command = self.channel.poll()
+        return reconnected
+
+    def reconnect_channel(self):
+        '''
+        The fuzzer exited or restarted while the device is connected,
+        try to reconnect without blocking the device, at most every RECONNECT_INTERVAL
 
-    def _should_disconnect(self):
-        if self.fuzzer:
-            if os.path.isfile('/tmp/umap_kitty/trigger_disconnect'):
-                return True
-        return False
+        :return: the next command, None if there is none (yet)
+        '''
+        now = time.monotonic()
+        if now < self.next_reconnect:
+            return None
+        if not self.next_reconnect:
+            self.logger.warning('fuzzer control channel closed, reconnecting')
+        self.next_reconnect = now + RECONNECT_INTERVAL
+        if not self.channel.reconnect(timeout=0):
+            return None
+        self.logger.info('fuzzer control channel reconnected')
+        self.next_reconnect = 0
+        return self.channel.poll()
+
+    def wait_command(self):
+        '''
+        Wait for the next command while the device is disconnected,
+        reconnecting (and waiting for the fuzzer) if it exited or restarted
 
-    def _clear_disconnect_trigger(self):
-        trigger = '/tmp/umap_kitty/trigger_disconnect'
-        if os.path.isfile(trigger):
-            os.remove(trigger)
+        :return: the next command
+        '''
+        command = self.channel.wait_command()
+        while command is None:
+            self.logger.warning('fuzzer control channel closed, waiting for the fuzzer')
+            self.channel.reconnect()
+            self.next_reconnect = 0
+            command = self.channel.wait_command()
+        return command
+
+    def update_stage_plan(self):
+        '''
+        Get the stages that the fuzzer may mutate in the next test,
+        get_mutation does not query the fuzzer about the other stages.
+        '''
+        self.stage_plan = StagePlan()
+        if not self.fuzzer or not self.stage_plan_supported:
+            return
+        try:
+            stages = self.fuzzer.get_stage_plan()
+        except Exception:
+            self.logger.warning('fuzzer does not provide a stage plan, querying it for every stage')
+            self.stage_plan_supported = False
+            return
+        self.stage_plan = StagePlan(stages)
 
     def get_mutation(self, stage, data=None):
         if self.fuzzer:
+            if not self.stage_plan.may_mutate(stage):
+                return None
             data = {} if data is None else data
             return self.fuzzer.get_mutation(stage=stage, data=data)
         return None
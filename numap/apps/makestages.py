@@ -3,44 +3,107 @@
 Prepare stages for USB fuzzing
 
 Usage:
-    numapstages -C=DEVICE_CLASS [-P=PHY_INFO] -s=FILE [-q] [--vid=VID] [--pid=PID] [-v ...]
+    numapstages -C=DEVICE_CLASS [-P=PHY_INFO] -s=FILE [-t=SECONDS] [-i=MS] [-n=N] [-q] [--vid=VID] [--pid=PID] [--log-file=FILE] [--log-queue=SIZE] [-v ...]
 
 Options:
     -P --phy PHY_INFO       physical layer info, see list below
     -C --class DEVICE_CLASS class of the device or path to python file with device class
     -s --stage-file FILE    file to store list of stages in
+    -t --timeout SECONDS    maximum recording time of each cycle [default: 30]
+    -i --idle MS            end a cycle when no stage was reached for MS milliseconds
+                            [default: 1000]
+    -n --cycles N           number of attach cycles. with more than one, the stages of all
+                            cycles are recorded in FILE.trace, and FILE holds the highest
+                            count of each stage in a single cycle (run-length encoded)
+                            [default: 1]
     -q --quiet              quiet mode. only print warning/error messages
     -v --verbose            verbosity level
     --vid VID               override vendor ID
     --pid PID               override product ID
+    --log-file FILE         also write the log to FILE (rotated at 10MB), implies --log-queue
+    --log-queue SIZE        write the log from a background thread, dropping records
+                            when more than SIZE are pending (default: 10000)
 
 Physical layer:
     greatfet[:serial]       use a GreatFET board (auto-detects when serial omitted)
     facedancer              use legacy FaceDancer hardware
     gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    vhost[:linux|windows]   simulated host, drives enumeration without hardware
 '''
 import time
 from numap.apps.emulate import NumapEmulationApp
 from numap.fuzz.helpers import StageLogger, set_stage_logger
+from numap.fuzz.stages import StageRun, write_stage_runs
+from numap.utils.settle import Settle
+
+# seconds to wait between attach cycles
+SETTLE_DELAY = 2
 
 
 class NumapMakeStagesApp(NumapEmulationApp):
 
-    def load_device(self, dev_name, phy):
-        self.start_time = time.time()
+    def __init__(self, options):
+        super(NumapMakeStagesApp, self).__init__(options)
+        try:
+            self.timeout_seconds = float(self.options.get('--timeout') or 30)
+            self.idle_seconds = float(self.options.get('--idle') or 1000) / 1000
+            self.cycles = int(self.options.get('--cycles') or 1)
+        except ValueError as exc:
+            raise ValueError('Timeout, idle time and cycles must be numeric values') from exc
         self.stage_file_name = self.options['--stage-file']
-        stage_logger = StageLogger(self.stage_file_name)
-        stage_logger.start()
-        set_stage_logger(stage_logger)
+        self.stage_logger = None
+        self.start_time = None
+
+    def run(self):
+        self.fuzzer = self.get_fuzzer()
+        self.phy = self.load_phy(self.options['--phy'])
+        trace_file = self.stage_file_name
+        if self.cycles > 1:
+            trace_file += '.trace'
+        self.stage_logger = StageLogger(trace_file)
+        self.stage_logger.start()
+        set_stage_logger(self.stage_logger)
+        # stage -> highest count in a single cycle, in first seen order
+        merged = {}
+        settle = Settle(SETTLE_DELAY)
+        try:
+            for cycle in range(self.cycles):
+                if cycle:
+                    settle.wait()
+                self.logger.always('Recording stages, cycle %d/%d' % (cycle + 1, self.cycles))
+                self.stage_logger.new_cycle('cycle %d' % (cycle + 1))
+                self.dev = self.load_device(self.options['--class'], self.phy)
+                completed = self.run_device()
+                settle.disconnected()
+                counts = self.stage_logger.new_cycle('end of cycle %d' % (cycle + 1))
+                self.logger.always('Cycle %d: %d stages' % (cycle + 1, len(counts)))
+                for stage, count in counts.items():
+                    merged[stage] = max(merged.get(stage, 0), count)
+                if not completed:
+                    break
+        finally:
+            # write the buffered stages
+            self.stage_logger.stop()
+        if self.cycles > 1:
+            with open(self.stage_file_name, 'w') as f:
+                write_stage_runs(f, (StageRun(stage, count, None, None) for stage, count in merged.items()))
+            self.logger.always('Merged %d stages into %s' % (len(merged), self.stage_file_name))
+
+    def load_device(self, dev_name, phy):
+        self.start_time = time.monotonic()
         return super(NumapMakeStagesApp, self).load_device(dev_name, phy)
 
     def should_stop_phy(self):
-        stop_phy = False
-        passed = int(time.time() - self.start_time)
-        if passed > 5:
+        now = time.monotonic()
+        passed = now - self.start_time
+        if passed > self.timeout_seconds:
             self.logger.info('have been waiting long enough (over %d secs.), disconnect' % (passed))
-            stop_phy = True
-        return stop_phy
+            return True
+        last_stage_time = self.stage_logger.last_stage_time
+        if last_stage_time is not None and now - last_stage_time > self.idle_seconds:
+            self.logger.info('no stage for %.1f secs., disconnect' % (now - last_stage_time))
+            return True
+        return False
 
 
 def main():
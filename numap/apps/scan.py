@@ -2,27 +2,56 @@
 Scan device support in USB host
 
 Usage:
-    numapscan [-P=PHY_INFO] [-t SECONDS] [-q] [-v ...]
+    numapscan [-P=PHY_INFO ...] [-t SECONDS] [-i MS] [--adaptive] [--host-id=NAME] [--probe [--max-endpoint=N]] [-q] [--log-file=FILE] [--log-queue=SIZE] [-v ...]
 
 Options:
-    -P --phy PHY_INFO           physical layer info, see list below
+    -P --phy PHY_INFO           physical layer info, see list below. can be repeated,
+                                to test the classes in parallel, one worker process per PHY
     -t --timeout SECONDS        maximum time to wait for a host response [default: 5]
+    -i --idle MS                move to the next device when the host sends no request
+                                for MS milliseconds after configuring the device [default: 1000]
+    --adaptive                  learn how long the host needs between tests, instead of
+                                always waiting 2 seconds
+    --host-id NAME              name of the host, to keep what --adaptive learned about it
+                                (default: default)
+    --probe                     test the classes that can be combined in composite devices
+                                (one or two enumerations), and the others one by one
+    --max-endpoint N            highest endpoint number of a composite device, lower it for
+                                PHYs with fewer endpoints [default: 15]
     -v --verbose                verbosity level
     -q --quiet                  quiet mode. only print warning/error messages
+    --log-file FILE             also write the log to FILE (rotated at 10MB), implies --log-queue.
+                                with several PHYs, each worker writes FILE.<PHY_INFO>
+    --log-queue SIZE            write the log from a background thread, dropping records
+                                when more than SIZE are pending (default: 10000)
 
 Physical layer:
     greatfet[:serial]       use a GreatFET board (auto-detects when serial omitted)
     facedancer              use legacy FaceDancer hardware
     gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    vhost[:linux|windows]   simulated host, drives enumeration without hardware
+
+A test ends as soon as the device is supported, the host is idle (see --idle),
+or the host did not respond at all before the timeout.
+
+With --probe, support is attributed to each class of a composite device by the
+class requests and endpoint data that its interfaces receive. If the host does
+not configure a composite device, its classes are tested one by one.
 
 Example:
     numapscan -P greatfet -q
 '''
 import asyncio
-import inspect
-import time
 import traceback
 from numap.apps.base import NumapApp
+from numap.apps.scan_runner import ScanRunner
+from numap.apps.scan_workers import WorkerPool, phy_list
+from numap.dev.composite import MAX_ENDPOINT, USBProbeDevice, probe_groups
+from numap.utils.completion import Reason
+from numap.utils.settle import Settle, AdaptiveSettle
+
+# seconds to wait between tests
+SETTLE_DELAY = 2
 
 
 class NumapScanApp(NumapApp):
@@ -30,12 +59,27 @@ class NumapScanApp(NumapApp):
     def __init__(self, options):
         super(NumapScanApp, self).__init__(options)
         self.current_usb_function_supported = False
-        self.start_time = 0
+        self.stop_signal_received = False
         timeout_opt = self.options.get('--timeout', 5)
         try:
             self.timeout_seconds = float(timeout_opt)
         except (TypeError, ValueError) as exc:
             raise ValueError('Timeout must be a numeric value in seconds') from exc
+        idle_opt = self.options.get('--idle', 1000)
+        try:
+            self.test_completion.idle_timeout = float(idle_opt) / 1000
+        except (TypeError, ValueError) as exc:
+            raise ValueError('Idle time must be a numeric value in milliseconds') from exc
+        try:
+            self.max_endpoint = int(self.options.get('--max-endpoint') or MAX_ENDPOINT)
+        except ValueError as exc:
+            raise ValueError('Maximum endpoint must be an integer') from exc
+        if self.options.get('--adaptive'):
+            self.settle = AdaptiveSettle(
+                SETTLE_DELAY, host_id=self.options.get('--host-id') or 'default', completion=self.test_completion
+            )
+        else:
+            self.settle = Settle(SETTLE_DELAY)
 
     def usb_function_supported(self, reason=None):
         '''
@@ -45,58 +89,198 @@ class NumapScanApp(NumapApp):
         :param reason: reason why we decided it is supported (default: None)
         '''
         self.current_usb_function_supported = True
+        self.test_completion.function_supported()
 
     def run(self):
         self.logger.always('Scanning host for supported devices')
-        phy = self.load_phy(self.options['--phy'])
-        supported = []
-        for device_name in self.umap_classes:
-            self.logger.always('Testing support: %s' % (device_name))
-            device = None
-            try:
-                self.start_time = time.time()
-                device = self.load_device(device_name, phy)
-                device.connect()
-                result = device.run()
-                if inspect.isawaitable(result):
-                    try:
-                        asyncio.run(asyncio.wait_for(result, timeout=self.timeout_seconds))
-                    except asyncio.TimeoutError:
-                        self.logger.error(
-                            'Timed out waiting %.1f seconds for %s to finish. Disconnecting.',
-                            self.timeout_seconds,
-                            device_name,
-                        )
-            except Exception:
-                self.logger.error(traceback.format_exc())
-            finally:
-                if device is not None:
-                    try:
-                        device.disconnect()
-                    except Exception:
-                        self.logger.error(traceback.format_exc())
-            phy.disconnect()
-            if self.current_usb_function_supported:
-                self.logger.always('Device is SUPPORTED')
-                supported.append(device_name)
-            self.current_usb_function_supported = False
-            time.sleep(2)
+        phys = phy_list(self.options.get('--phy'))
+        if len(set(phys)) != len(phys):
+            self.logger.error('each PHY (-P) can only be used once')
+            return
+        try:
+            if len(phys) > 1:
+                supported = self.scan_classes_parallel(phys)
+            else:
+                runner = ScanRunner(self)
+                try:
+                    supported = self.scan_classes(runner, self.load_phy(phys[0]))
+                finally:
+                    runner.close()
+        finally:
+            self.settle.save()
         if len(supported):
             self.logger.always('---------------------------------')
             self.logger.always('Found %s supported device(s):' % (len(supported)))
             for i, device_name in enumerate(supported):
                 self.logger.always('%d. %s' % (i + 1, device_name))
 
+    def scan_items(self):
+        '''
+        :return: list of the items to test, each is a class name,
+            or a tuple of class names to test in a composite device (--probe)
+        '''
+        if not self.options.get('--probe'):
+            return list(self.umap_classes)
+        groups, single = probe_groups(self.umap_classes, self.max_endpoint)
+        return groups + single
+
+    def item_results(self, item, result):
+        '''
+        :param item: tested item (see scan_items)
+        :param result: result of the test
+        :return: tuple of (supported classes, items to test one by one)
+        '''
+        if not isinstance(item, tuple):
+            return ([item] if result.get('supported') else []), []
+        if not result.get('configured'):
+            self.logger.always('Composite device was not configured, testing its classes one by one')
+            return [], list(item)
+        functions = result['functions']
+        return [name for name in item if functions.get(name)], list(result['failed'])
+
+    def scan_classes(self, runner, phy):
+        '''
+        :return: list of the supported device classes
+        '''
+        supported = set()
+        items = self.scan_items()
+        while items:
+            item = items.pop(0)
+            found, retry = self.item_results(item, self.test_item(runner, phy, item))
+            supported.update(found)
+            items.extend(retry)
+        return [device_name for device_name in self.umap_classes if device_name in supported]
+
+    def scan_classes_parallel(self, phys):
+        '''
+        Test the classes with one worker process per PHY
+
+        :return: list of the supported device classes, with the PHY they were tested on
+        '''
+        self.logger.always('Scanning with %d PHYs: %s' % (len(phys), ', '.join(phys)))
+        pool = WorkerPool(type(self), self.options, phys)
+        pool.start()
+        pending = set()
+        for item in self.scan_items():
+            pool.submit(item)
+            pending.add(item)
+        # supported class -> PHY it was tested on
+        supported = {}
+        try:
+            while pending and pool.alive:
+                message = pool.get()
+                if message is None:
+                    continue
+                phy_info, item, result = message
+                if item is None:
+                    if result:
+                        self.logger.error('Worker of %s failed: %s' % (phy_info, result['error']))
+                elif result is not None:
+                    pending.discard(item)
+                    found, retry = self.item_results(item, result)
+                    for device_name in found:
+                        supported[device_name] = phy_info
+                    for retry_item in retry:
+                        pool.submit(retry_item)
+                        pending.add(retry_item)
+        finally:
+            pool.stop()
+        return [
+            '%s (%s)' % (device_name, supported[device_name])
+            for device_name in self.umap_classes
+            if device_name in supported
+        ]
+
+    def prepare_worker(self):
+        pass
+
+    def test_item(self, runner, phy, item):
+        '''
+        Test support of a single device class, or of a composite device.
+        If the host did not respond after a shortened settle delay,
+        the item is tested again after the maximum delay.
+
+        :param item: class name, or tuple of class names (see scan_items)
+        :return: result dictionary
+        '''
+        result = self.test_item_once(runner, phy, item)
+        if not result['responded'] and self.settle.shortened():
+            self.logger.warning('No response after a shortened settle delay, testing again')
+            self.settle.missed()
+            result = self.test_item_once(runner, phy, item)
+        return result
+
+    def test_item_once(self, runner, phy, item):
+        if isinstance(item, tuple):
+            device_name = 'composite (%s)' % ', '.join(item)
+        else:
+            device_name = item
+        self.settle.wait()
+        self.logger.always('Testing support: %s' % (device_name))
+        device = None
+        self.current_usb_function_supported = False
+        self.test_completion.timeout = self.timeout_seconds
+        self.test_completion.start()
+        try:
+            if isinstance(item, tuple):
+                device = USBProbeDevice(self, phy, item, max_endpoint=self.max_endpoint)
+            else:
+                device = self.load_device(item, phy)
+            reason = runner.run_test(device, self.timeout_seconds + 1)
+            if reason in (Reason.TIMEOUT, Reason.HOST_GONE):
+                self.log_timeout(device_name, reason)
+            elif reason:
+                self.logger.info('Test of %s completed: %s', device_name, reason)
+        except asyncio.TimeoutError:
+            self.log_timeout(device_name, Reason.TIMEOUT)
+        except Exception:
+            self.logger.error(traceback.format_exc())
+        finally:
+            if device is not None:
+                try:
+                    device.disconnect()
+                except Exception:
+                    self.logger.error(traceback.format_exc())
+        phy.disconnect()
+        self.settle.disconnected()
+        self.settle.test_done(self.test_completion.response_latency())
+        result = {
+            'supported': self.current_usb_function_supported,
+            'responded': self.test_completion.response_latency() is not None,
+        }
+        if isinstance(item, tuple):
+            result.update(self.probe_result(device))
+        elif self.current_usb_function_supported:
+            self.logger.always('Device is SUPPORTED')
+        return result
+
+    def probe_result(self, device):
+        '''
+        :param device: the tested composite device, None if it could not be created
+        :return: dictionary of the results of its functions
+        '''
+        if device is None:
+            return {'configured': False, 'functions': {}, 'failed': []}
+        functions = device.supported_functions()
+        for name, reason in sorted(functions.items()):
+            if reason:
+                self.logger.always('%s is SUPPORTED (%s)' % (name, reason))
+        return {
+            'configured': device.was_configured,
+            'functions': functions,
+            'failed': list(device.failed_classes),
+        }
+
+    def log_timeout(self, device_name, reason):
+        self.logger.error(
+            'Timed out waiting %.1f seconds for %s to finish (%s). Disconnecting.',
+            self.timeout_seconds,
+            device_name,
+            reason,
+        )
+
     def should_stop_phy(self):
-        # if self.current_usb_function_supported:
-        #     self.logger.debug('Current USB device is supported, stopping phy')
-        #     return True
-        stop_phy = False
-        passed = int(time.time() - self.start_time)
-        if passed > self.timeout_seconds:
-            self.logger.info('have been waiting long enough (over %d secs.), disconnect' % (passed))
-            stop_phy = True
-        return stop_phy
+        return self.test_completion.check()
 
 
 def main():
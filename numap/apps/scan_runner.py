@@ -0,0 +1,89 @@
+'''
+Run the tests of a scan on a single event loop.
+
+Each test is a task: the device is connected and run, until the test
+completion signal of the application is set (see numap.utils.completion),
+the device stops, or the test timeout expires. Devices with a synchronous
+run() (PHYs that poll should_stop_phy) are run in an executor thread.
+'''
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+# seconds to wait for a synchronous run() to return after it was told to stop
+STOP_TIMEOUT = 2
+
+
+async def run_with_timeout(awaitable, timeout):
+    '''
+    :param awaitable: awaitable to run
+    :param timeout: seconds before it is cancelled, None for no timeout
+    :raises asyncio.TimeoutError: if the timeout expired
+    :return: result of the awaitable
+    '''
+    if timeout is None:
+        return await awaitable
+    if hasattr(asyncio, 'timeout'):
+        async with asyncio.timeout(timeout):
+            return await awaitable
+    return await asyncio.wait_for(awaitable, timeout)
+
+
+class ScanRunner(object):
+
+    def __init__(self, app):
+        '''
+        :param app: the scan application, its test_completion is reset for each test
+        '''
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        # a single thread, devices are tested one at a time
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='numap-device')
+
+    def run_test(self, device, timeout=None):
+        '''
+        Connect a device and run it until the test completes
+
+        :param device: device to test, not connected yet
+        :param timeout: seconds before the test is aborted (default: None)
+        :raises asyncio.TimeoutError: if the timeout expired
+        :return: completion reason, None if the device stopped by itself
+        '''
+        return self.loop.run_until_complete(self._run_test(device, timeout))
+
+    async def _run_test(self, device, timeout):
+        try:
+            return await run_with_timeout(self._connect_and_run(device), timeout)
+        finally:
+            # release whatever is still waiting for the test to complete
+            self.app.test_completion.cancel()
+
+    async def _connect_and_run(self, device):
+        await self._in_executor(device.connect)
+        return await self.app.wait_test_completion(self._device_run(device))
+
+    async def _device_run(self, device):
+        if inspect.iscoroutinefunction(device.run):
+            return await device.run()
+        result = await self._in_executor(device.run)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def _in_executor(self, func):
+        future = self.loop.run_in_executor(self.executor, func)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # do not leave the call running while the device is disconnected
+            self.app.test_completion.cancel()
+            await asyncio.wait([future], timeout=STOP_TIMEOUT)
+            raise
+
+    def close(self):
+        try:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        finally:
+            self.executor.shutdown(wait=False)
+            self.loop.close()
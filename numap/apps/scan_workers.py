@@ -0,0 +1,144 @@
+'''
+Run the tests of a scan on several PHYs, one worker process per PHY.
+
+Each GreatFET board is selected by environment variables, and facedancer
+keeps global backend state, so every board gets its own process.
+The parent process owns the scan session: it puts the items to test in
+a shared task queue, and merges the results that the workers send back.
+
+The scan application class provides the worker side:
+
+- prepare_worker(): called once in the worker, after the app is created
+  from the worker options
+- test_item(runner, phy, item): test a single item, return a (picklable)
+  result dictionary. If the result has a true 'host_dead' value, the
+  worker stops.
+- stop_signal_received and settle attributes, as in the scan apps
+'''
+import multiprocessing
+import queue
+import traceback
+from numap.apps.scan_runner import ScanRunner
+
+
+def phy_list(phy_option):
+    '''
+    :param phy_option: value of the -P option (string, list of strings or None)
+    :return: list of PHY info strings
+    '''
+    if not phy_option:
+        return [None]
+    if isinstance(phy_option, str):
+        return [phy_option]
+    return list(phy_option)
+
+
+def worker_options(options, phy_info):
+    '''
+    :param options: options dictionary of the scan
+    :param phy_info: PHY info string of the worker
+    :return: options dictionary of the worker
+    '''
+    options = dict(options)
+    options['--phy'] = phy_info
+    if options.get('--host-id'):
+        # each board has its own settle profile
+        options['--host-id'] = '%s@%s' % (options['--host-id'], phy_info)
+    if options.get('--log-file'):
+        # a rotating log file can only have one writer
+        options['--log-file'] = '%s.%s' % (options['--log-file'], str(phy_info).replace(':', '_'))
+    return options
+
+
+def _worker_main(app_class, options, phy_info, tasks, results):
+    app = app_class(options)
+    runner = ScanRunner(app)
+    error = None
+    try:
+        app.prepare_worker()
+        phy = app.load_phy(phy_info)
+        while not app.stop_signal_received:
+            item = tasks.get()
+            if item is None:
+                break
+            results.put((phy_info, item, None))
+            try:
+                result = app.test_item(runner, phy, item)
+            except Exception:
+                result = {'error': traceback.format_exc()}
+            results.put((phy_info, item, result))
+            if result.get('host_dead'):
+                break
+    except Exception:
+        error = {'error': traceback.format_exc()}
+    finally:
+        # the parent waits for the final message, send it even if the cleanup fails
+        for cleanup in (runner.close, app.settle.save):
+            try:
+                cleanup()
+            except Exception:
+                if error is None:
+                    error = {'error': traceback.format_exc()}
+        results.put((phy_info, None, error))
+
+
+class WorkerPool(object):
+
+    def __init__(self, app_class, options, phys):
+        '''
+        :param app_class: scan application class, created in each worker with the options
+        :param options: options dictionary of the scan, see worker_options
+        :param phys: list of PHY info strings, one worker per PHY
+        '''
+        ctx = multiprocessing.get_context('spawn')
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.workers = {}
+        for phy_info in phys:
+            self.workers[phy_info] = ctx.Process(
+                target=_worker_main,
+                args=(app_class, worker_options(options, phy_info), phy_info, self.tasks, self.results),
+                name='numap-%s' % phy_info,
+                daemon=True,
+            )
+        self.alive = set()
+
+    def start(self):
+        for phy_info, worker in self.workers.items():
+            worker.start()
+            self.alive.add(phy_info)
+
+    def submit(self, item):
+        self.tasks.put(item)
+
+    def get(self, timeout=1.0):
+        '''
+        :return: tuple of (phy info, item, result), None if nothing arrived before the timeout.
+            result is None when the worker took the item.
+            item is None when the worker exited, result is then None or an error dictionary.
+        '''
+        try:
+            message = self.results.get(timeout=timeout)
+        except queue.Empty:
+            for phy_info in list(self.alive):
+                if not self.workers[phy_info].is_alive():
+                    # died without saying so
+                    self.alive.discard(phy_info)
+                    return (phy_info, None, None)
+            return None
+        phy_info, item, result = message
+        if item is None:
+            if phy_info not in self.alive:
+                # already reported when it was found dead
+                return None
+            self.alive.discard(phy_info)
+        return message
+
+    def stop(self, timeout=5.0):
+        for _ in self.alive:
+            self.tasks.put(None)
+        for worker in self.workers.values():
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self.alive.clear()
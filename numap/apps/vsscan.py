@@ -2,12 +2,13 @@
 Scan USB host for vendor specific device support
 
 Usage:
-    numapvsscan [-P=PHY_INFO] [-q] [-d=DB_FILE] [-s=VID:PID] [-t=TIMEOUT]
-                [-T=TEST_TIMEOUT] [-z|-b=DELAY] [-r=RESUME_FILE] [-o=OS]  [-e]
-                [-v ...]
+    numapvsscan [-P=PHY_INFO ...] [-q] [-d=DB_FILE] [-s=VID:PID] [-t=TIMEOUT]
+                [-T=TEST_TIMEOUT] [-i=MS] [-z|-b=DELAY] [--adaptive] [--host-id=NAME] [-r=RESUME_FILE] [-o=OS]  [-e]
+                [--stride=N] [--sample=N] [--schedule [--hits=FILE]] [--log-file=FILE] [--log-queue=SIZE] [-v ...]
 
 Options:
-    -P --phy PHY_INFO           physical layer info, see list below
+    -P --phy PHY_INFO           physical layer info, see list below. can be repeated,
+                                to scan with one worker process per PHY
     -v --verbose                verbosity level
     -q --quiet                  quiet mode. only print warning/error messages
     -d --db DB_FILE             vid, pid database file (see DB_FILE below)
@@ -16,26 +17,46 @@ Options:
     -T --test_timeout TEST_TIMEOUT
                                 seconds to wait before aborting a test and moving to
                                 the next one (default: 30)
+    -i --idle MS                move to the next device when the host sends no request
+                                for MS milliseconds after configuring the device (default: 1000)
     -r --resume RESUME_FILE     filename to store/load scan session data
     -z --single_step            wait for keypress between each test
     -b --between DELAY          delay in seconds to wait between tests
+    --adaptive                  learn how long the host needs between tests,
+                                up to the --between delay (default: 5)
+    --host-id NAME              name of the host, to keep what --adaptive learned about it
+                                (default: default)
     -o --os OS                  specify the host OS (default: Linux)
     -e --exhaustive             go over each (vid, pid) combination - do not skip device if its driver is in the supported list
+    --stride N                  only test every N-th VID:PID combination (default: 1)
+    --sample N                  only test N of the VID:PID combinations, spread over the ranges
+    --schedule                  test one db entry per driver first, so supported drivers
+                                are found (and their other entries skipped) early
+    --hits FILE                 hit table (JSON) of previous scans: drivers that were supported
+                                more often are tested first. updated at the end of the scan
+    --log-file FILE             also write the log to FILE (rotated at 10MB), implies --log-queue.
+                                with several PHYs, each worker writes FILE.<PHY_INFO>
+    --log-queue SIZE            write the log from a background thread, dropping records
+                                when more than SIZE are pending (default: 10000)
 
 Physical layer:
     greatfet[:serial]       use a GreatFET board (auto-detects when serial omitted)
     facedancer              use legacy FaceDancer hardware
     gadgetfs                use gadgetfs (requires mounting of gadgetfs beforehand)
+    vhost[:linux|windows]   simulated host, drives enumeration without hardware
 
 DB_FILE:
     a python file with a db member which is a list of DBEntry() objects.
     a sample can be found at: numap/data/vid_pid_db.py
+    or a compiled db, created with numapmkdb (faster to load for big dbs)
 
 OS:
     Linux, Windows, OSX, QNX
 
 VID:PID
-    can be of the form 1234:5678 or 1234-1236:1235-1555
+    can be of the form 1234:5678 or 1234-1236:1235-1555 (range end is excluded),
+    or a comma separated list of those, e.g. 1234-1236:1235-1555,2058:1005
+    the combinations are generated during the scan, so big ranges take no memory
 
 Examples:
     scan using a db file with 5 seconds timeout and 2 seconds delay between tries
@@ -44,60 +65,17 @@ Examples:
     $ numapvsscan -P facedancer -s 2058:1005 -t 5
 '''
 import asyncio
-import inspect
-import time
 import traceback
 import os
 import signal
-import sys
-import contextlib
-import six
-from six.moves import cPickle
 from numap.apps.base import NumapApp
+from numap.apps.scan_runner import ScanRunner
+from numap.apps.scan_workers import WorkerPool, phy_list
 from numap.dev.vendor_specific import USBVendorSpecificDevice
-
-
-class OS(object):
-    LINUX = 'Linux'
-    WINDOWS = 'Windows'
-    OSX = 'OSX'
-    QNX = 'QNX'
-
-
-class DBEntry(object):
-    '''
-    DBEnrty describes a vid, pid.
-    '''
-
-    def __init__(self, vid, pid, vendor_name='', product_name='', drivers={}, constraints=[], info={}):
-        self.vid = vid
-        self.pid = pid
-        self.vendor_name = vendor_name
-        self.product_name = product_name
-        self.drivers = drivers
-        self.constraints = constraints
-        self.info = info
-        self.os = None
-
-    def __str__(self):
-        s = 'vid:pid %04x:%04x' % (self.vid, self.pid)
-        if self.vendor_name:
-            s += ', vendor: %s' % self.vendor_name
-        if self.product_name:
-            s += ', product: %s' % self.product_name
-        if self.drivers:
-            if self.os and self.os in self.drivers:
-                s += ', driver: %s' % self.drivers[self.os]
-            else:
-                s += ', drivers: %s' % self.drivers
-        if self.constraints:
-            s += ', constraints: %s' % self.constraints
-        if self.info:
-            s += ', info: %s' % self.info
-        return s
-
-    def vidpid(self):
-        return '%04x:%04x' % (self.vid, self.pid)
+from numap.utils.settle import Settle, AdaptiveSettle
+from numap.utils.scan_journal import ScanJournal, JournalError
+from numap.utils.scan_schedule import ScheduledDB, driver_schedule, load_hits, update_hits
+from numap.utils.vid_pid_db import DBEntry, OS, CompiledDB, VidPidSweep, is_compiled_db, load_python_db
 
 
 class _ScanSession(object):
@@ -107,11 +85,58 @@ class _ScanSession(object):
         self.db = []
         self.supported = []
         self.unsupported = []
-        self.supported_drivers = []
+        self.supported_drivers = set()
         # key: device that got no response
         # value: previous device (if any)
         self.no_response = {}
+        # key: device that got no response, value: PHY it was tested on
+        # (only when scanning with several PHYs)
+        self.no_response_phys = {}
         self.current = 0
+        # db indexes of the supported entries
+        self.supported_indexes = []
+        # journal records of the supported entries, db entries may be
+        # created on demand (sweep, compiled db) so they are not kept
+        self.supported_records = []
+
+    def apply(self, record):
+        '''
+        Update the session with a journal record
+
+        :param record: journal record (dictionary)
+        '''
+        kind = record['type']
+        if kind == 'entry':
+            index = record['index']
+            if record['result'] == 'supported':
+                db_entry = self.db[index]
+                if 'info' in record:
+                    db_entry = db_entry.with_info(record['info'])
+                self.supported.append(db_entry)
+                self.supported_indexes.append(index)
+                self.supported_records.append(record)
+                if record.get('driver'):
+                    self.supported_drivers.add(record['driver'])
+            self.current = max(self.current, index + 1)
+        elif kind == 'no_response':
+            self.no_response.setdefault(record['index'], record['prev'])
+            if record.get('phy'):
+                self.no_response_phys.setdefault(record['index'], record['phy'])
+        elif kind == 'progress':
+            self.current = max(self.current, record['current'])
+
+    def snapshot(self):
+        '''
+        :return: list of journal records that reproduce the session when applied
+        '''
+        records = [{'type': 'progress', 'current': self.current}]
+        records.extend(self.supported_records)
+        for index in sorted(self.no_response):
+            record = {'type': 'no_response', 'index': index, 'prev': self.no_response[index]}
+            if index in self.no_response_phys:
+                record['phy'] = self.no_response_phys[index]
+            records.append(record)
+        return records
 
 
 class NumapVSScanApp(NumapApp):
@@ -120,7 +145,6 @@ class NumapVSScanApp(NumapApp):
         super(NumapVSScanApp, self).__init__(options)
         self.current_usb_function_supported = False
         self.scan_session = _ScanSession()
-        self.start_time = 0
         self.stop_signal_received = False
         self.between_delay = 5
         self.current_test_timed_out = False
@@ -128,6 +152,9 @@ class NumapVSScanApp(NumapApp):
         timeout = self.options['--timeout']
         if timeout:
             self.scan_session.timeout = int(timeout)
+        idle = self.options.get('--idle')
+        if idle:
+            self.test_completion.idle_timeout = float(idle) / 1000
         test_timeout = self.options.get('--test_timeout')
         if test_timeout:
             self.test_timeout = int(test_timeout)
@@ -136,8 +163,16 @@ class NumapVSScanApp(NumapApp):
         self.single_step = False
         if self.options['--single_step']:
             self.single_step = True
+            self.between_delay = 0
         elif self.options['--between']:
             self.between_delay = int(self.options['--between'])
+        if self.options.get('--adaptive'):
+            self.settle = AdaptiveSettle(
+                self.between_delay, host_id=self.options.get('--host-id') or 'default',
+                completion=self.test_completion
+            )
+        else:
+            self.settle = Settle(self.between_delay)
         self.os = self.options['--os']
         if not self.os:
             self.os = OS.LINUX
@@ -159,63 +194,110 @@ class NumapVSScanApp(NumapApp):
 
     def load_db_from_file(self, db_file):
         self.logger.info('loading vid_pid db file: %s' % db_file)
-        dirpath, filename = os.path.split(db_file)
-        modulename = filename[:-3]
-        if dirpath in sys.path:
-            sys.path.remove(dirpath)
-        sys.path.insert(0, dirpath)
-        module = __import__(modulename, globals(), locals(), [], 0)
-        self.scan_session.db = module.db
+        if is_compiled_db(db_file):
+            self.scan_session.db = CompiledDB(db_file)
+        else:
+            self.scan_session.db = load_python_db(db_file)
         self.logger.always('loaded %d entries' % len(self.scan_session.db))
 
-    def build_db_from_vid_pid(self, vid_pid):
-        vid, pid = vid_pid.split(':')
-        if '-' in vid:
-            vid_start = int(vid.split('-')[0], 16)
-            vid_end = int(vid.split('-')[1], 16)
-            self.logger.debug('vid start=%04x, vid_end=%04x' % (vid_start, vid_end))
-            vid = six.moves.range(vid_start, vid_end)
-        else:
-            vid = [int(vid, 16)]
-        if '-' in pid:
-            pid_start = int(pid.split('-')[0], 16)
-            pid_end = int(pid.split('-')[1], 16)
-            self.logger.debug('pid start=%04x, pid_end=%x' % (pid_start, pid_end))
-            pid = six.moves.range(pid_start, pid_end)
-        else:
-            pid = [int(pid, 16)]
-        for v in vid:
-            for p in pid:
-                self.scan_session.db.append(DBEntry(v, p))
+    def build_db_from_vid_pid(self, vid_pid, stride=1, sample=None):
+        try:
+            self.scan_session.db = VidPidSweep(vid_pid, stride=stride, sample=sample)
+        except ValueError as ex:
+            self.logger.error(str(ex))
+            return False
+        self.logger.debug('vid:pid sweep %s, %d combinations' % (vid_pid, self.scan_session.db.combinations))
+        return True
 
     def build_scan_session(self):
         self.resume_file = self.options['--resume']
-        if self.resume_file and os.path.exists(self.resume_file):
-                self.logger.always('Resume file found. Loading scan data')
-                with open(self.resume_file, 'rb') as rf:
-                    self.scan_session = cPickle.load(rf)
+        self.journal = ScanJournal(self.resume_file) if self.resume_file else None
+        if self.journal and self.journal.exists():
+            self.logger.always('Resume file found. Loading scan data')
+            try:
+                header, records = self.journal.load()
+            except (JournalError, UnicodeDecodeError):
+                self.logger.error('%s is not a scan journal (resume files from older versions are not supported)' % self.resume_file)
+                return False
+            self.scan_session.timeout = header['timeout']
+            if not self.build_db(
+                header['db'], header['vid_pid'], header.get('stride', 1), header.get('sample'), header.get('schedule')
+            ):
+                return False
+            if len(self.scan_session.db) != header['entries']:
+                self.logger.warning('db has %d entries, expected %d' % (len(self.scan_session.db), header['entries']))
+            for record in records:
+                self.scan_session.apply(record)
+            self.logger.always('Resuming from entry %d' % self.scan_session.current)
         else:
             db_file = self.options['--db']
             vid_pid = self.options['--vid_pid']
             self.logger.always('Resume file not found. Creating new one')
             if db_file and vid_pid:
                 self.logger.warning('not expecting both db file and specific vid:pid. we will use vid:pid')
-            if vid_pid:
-                self.build_db_from_vid_pid(vid_pid)
-            elif db_file:
-                self.load_db_from_file(db_file)
-            else:
-                self.logger.error('Must select a scan option - db (-d) or specific vid:pid (-p)')
-                return
+                db_file = None
+            if db_file:
+                db_file = os.path.abspath(db_file)
+            stride = int(self.options.get('--stride') or 1)
+            sample = self.options.get('--sample')
+            sample = int(sample) if sample else None
+            schedule = load_hits(self.options.get('--hits')) if self.options.get('--schedule') else None
+            if not self.build_db(db_file, vid_pid, stride, sample, schedule):
+                return False
+            if self.journal:
+                self.journal.create({
+                    'db': db_file,
+                    'vid_pid': vid_pid,
+                    'stride': stride,
+                    'sample': sample,
+                    'schedule': schedule,
+                    'timeout': self.scan_session.timeout,
+                    'entries': len(self.scan_session.db),
+                })
+        return True
+
+    def build_db(self, db_file, vid_pid, stride=1, sample=None, schedule=None):
+        '''
+        :param schedule: hit table of the driver-aware order, None for db order (default: None)
+        '''
+        # kept so worker processes can build the same db
+        self.db_source = {
+            '--db': db_file, '--vid_pid': vid_pid, '--stride': stride, '--sample': sample, '--schedule': schedule
+        }
+        if vid_pid:
+            return self.build_db_from_vid_pid(vid_pid, stride, sample)
+        elif db_file:
+            self.load_db_from_file(db_file)
+            if schedule is not None:
+                order = driver_schedule(self.scan_session.db, self.os, schedule)
+                self.scan_session.db = ScheduledDB(self.scan_session.db, order)
+                self.logger.always('testing one entry per driver first')
+        else:
+            self.logger.error('Must select a scan option - db (-d) or specific vid:pid (-p)')
+            return False
+        return True
 
-    def sync_and_increment_session(self):
-        self.scan_session.current += 1
-        self.sync_session()
+    def record_entry(self, result, db_entry):
+        '''
+        Record the result of the current entry and move to the next one
 
-    def sync_session(self):
-        if self.resume_file:
-            with open(self.resume_file, 'wb') as rf:
-                cPickle.dump(self.scan_session, rf, 2)
+        :param result: 'supported', 'unsupported' or 'skipped'
+        :param db_entry: the current entry
+        '''
+        record = {'type': 'entry', 'index': self.scan_session.current, 'result': result}
+        if result == 'supported':
+            record['info'] = db_entry.info
+            driver = db_entry.drivers.get(self.os, None)
+            if driver:
+                record['driver'] = driver
+        self.scan_session.apply(record)
+        self.sync_session(record)
+
+    def sync_session(self, record):
+        if self.journal:
+            self.journal.append(record)
+            if self.journal.should_compact():
+                self.journal.compact(self.scan_session.snapshot())
 
     def print_results(self):
         num_supported = len(self.scan_session.supported)
@@ -223,104 +305,264 @@ class NumapVSScanApp(NumapApp):
         self.logger.always('----------------------------------------')
         self.logger.always('Found %s supported device(s) (out of %s):' % (num_supported, self.scan_session.current))
         for i, db_entry in enumerate(self.scan_session.supported):
-            self.logger.always('%d. %s' % (i, db_entry))
+            self.logger.always('%d. %s' % (i, db_entry.describe(self.os)))
         self.logger.always('----------------------------------------')
         self.logger.always('Devices with no response (previous):')
         for i in sorted(self.scan_session.no_response.keys()):
-            if self.scan_session.no_response[i]:
-                prev = self.scan_session.no_response[i]
-                pvp = self.scan_session.db[prev].vidpid()
+            prev = self.scan_session.no_response[i]
+            pvp = self.scan_session.db[prev].vidpid() if prev is not None else None
+            phy_info = self.scan_session.no_response_phys.get(i)
+            if phy_info:
+                self.logger.always('%s (%s) on %s' % (self.scan_session.db[i].describe(self.os), pvp, phy_info))
             else:
-                pvp = None
-            self.logger.always('%s (%s)' % (self.scan_session.db[i], pvp))
+                self.logger.always('%s (%s)' % (self.scan_session.db[i].describe(self.os), pvp))
 
     def run(self):
-        self.build_scan_session()
+        if not self.build_scan_session():
+            return
         self.logger.always('Scanning host for supported vendor specific devices')
-        phy = self.load_phy(self.options['--phy'])
-        self.prev_index = None
+        phys = phy_list(self.options.get('--phy'))
+        if len(set(phys)) != len(phys):
+            self.logger.error('each PHY (-P) can only be used once')
+            return
+        try:
+            if len(phys) > 1:
+                self.scan_entries_parallel(phys)
+            else:
+                runner = ScanRunner(self)
+                try:
+                    self.scan_entries(runner, self.load_phy(phys[0]))
+                finally:
+                    runner.close()
+        finally:
+            if self.journal:
+                self.journal.close()
+            self.settle.save()
+        if self.options.get('--hits') and self.scan_session.current >= len(self.scan_session.db):
+            # only count finished scans, so a resumed scan is counted once
+            update_hits(self.options['--hits'], self.scan_session.supported_drivers)
+        self.print_results()
+
+    def should_skip(self, db_entry):
+        if self.options.get('--exhaustive'):
+            return False
+        driver = db_entry.drivers.get(self.os, None)
+        return bool(driver) and driver in self.scan_session.supported_drivers
+
+    def scan_entries(self, runner, phy):
+        prev_index = None
         while self.scan_session.current < (len(self.scan_session.db)):
             if self.stop_signal_received:
                 break
-            db_entry = self.scan_session.db[self.scan_session.current]
-            db_entry.os = self.os
-            vid = db_entry.vid
-            pid = db_entry.pid
-            if not self.options['--exhaustive']:
-                driver = db_entry.drivers.get(self.os, None)
-                if driver and driver in self.scan_session.supported_drivers:
-                    self.logger.always('skipping entry: %s' % db_entry)
-                    self.sync_and_increment_session()
-                    continue
-            self.logger.always('Testing support for %s' % db_entry)
-            self.setup_packet_received = False
-            self.current_usb_function_supported = False
-            self.current_test_timed_out = False
-            self.start_time = time.time()
-            device = USBVendorSpecificDevice(self, phy, vid, pid)
-            try:
-                with self._test_timeout_guard() as timeout_guard:
-                    device.connect()
-                    result = device.run()
-                if inspect.isawaitable(result):
-                    remaining = getattr(timeout_guard, 'remaining', None)
-                    try:
-                        if remaining and remaining > 0:
-                            asyncio.run(asyncio.wait_for(result, timeout=remaining))
-                        else:
-                            if remaining == 0:
-                                raise _TestTimeoutExpired
-                            asyncio.run(result)
-                    except asyncio.TimeoutError:
-                        raise _TestTimeoutExpired
-            except _TestTimeoutExpired:
-                self.current_test_timed_out = True
-                self.logger.warning('Test exceeded %d seconds, moving to the next device',
-                                    self.test_timeout)
-            except:
-                self.logger.error(traceback.format_exc())
-            finally:
-                try:
-                    device.disconnect()
-                except Exception:
-                    self.logger.debug('Failed to disconnect device cleanly after test',
-                                      exc_info=True)
-            if not self.is_host_alive():
+            index = self.scan_session.current
+            db_entry = self.scan_session.db[index]
+            if self.should_skip(db_entry):
+                self.logger.always('skipping entry: %s', db_entry.describe(self.os))
+                self.record_entry('skipped', db_entry)
+                continue
+            result = self.test_item(runner, phy, index)
+            if not self.check_host_alive(index, result, prev_index):
                 break
-            if self.current_usb_function_supported:
-                db_entry.info = self.get_device_info(device)
-                self.scan_session.supported.append(db_entry)
-                driver = db_entry.drivers.get(self.os, None)
-                if driver:
-                    self.scan_session.supported_drivers.append(db_entry.drivers[self.os])
-            # else:
-            #     db_entry.info = self.get_device_info(device)
-            #     self.scan_session.unsupported.append(db_entry)
-            self.prev_index = self.scan_session.current
-            self.sync_and_increment_session()
+            prev_index = index
+            self.record_result(db_entry, result)
             if self.single_step:
                 raw_input('press any key to continue')
+
+    def scan_entries_parallel(self, phys):
+        '''
+        Scan with one worker process per PHY.
+        Results are recorded in db order, so the journal is the same
+        as the one of a serial scan.
+        '''
+        self.logger.always('Scanning with %d PHYs: %s' % (len(phys), ', '.join(phys)))
+        options = dict(self.options, **self.db_source)
+        options['--resume'] = None
+        pool = WorkerPool(type(self), options, phys)
+        pool.start()
+        # results that wait for the results of the entries before them
+        done = {}
+        # entries to test again, their board died while testing them
+        retry = []
+        # PHY -> entry it is testing
+        testing = {}
+        # PHY -> previous entry it tested
+        prev_index = {}
+        next_index = self.scan_session.current
+        queued = 0
+        try:
+            while True:
+                while queued + len(testing) < len(pool.alive) and not self.stop_signal_received:
+                    if retry:
+                        index = retry.pop(0)
+                    elif next_index < len(self.scan_session.db):
+                        index = next_index
+                        next_index += 1
+                        db_entry = self.scan_session.db[index]
+                        if self.should_skip(db_entry):
+                            self.logger.always('skipping entry: %s', db_entry.describe(self.os))
+                            done[index] = None
+                            continue
+                    else:
+                        break
+                    pool.submit(index)
+                    queued += 1
+                self.record_done(done)
+                if not queued and not testing:
+                    if self.stop_signal_received or (not retry and next_index >= len(self.scan_session.db)):
+                        break
+                if not pool.alive:
+                    self.logger.error('All PHYs stopped, ending the scan')
+                    break
+                message = pool.get()
+                if message is None:
+                    continue
+                phy_info, index, result = message
+                if index is None:
+                    if result:
+                        self.logger.error('Worker of %s failed: %s' % (phy_info, result['error']))
+                    self.logger.info('Worker of %s stopped' % phy_info)
+                    if phy_info in testing:
+                        retry.append(testing.pop(phy_info))
+                    continue
+                if result is None:
+                    testing[phy_info] = index
+                    queued -= 1
+                    continue
+                del testing[phy_info]
+                if 'error' in result:
+                    self.logger.error('Test of entry %d on %s failed: %s' % (index, phy_info, result['error']))
+                if not self.check_host_alive(index, result, prev_index.get(phy_info), phy_info):
+                    # another board gets the entry, unless it already killed one
+                    if index in self.scan_session.no_response and self.scan_session.no_response_phys.get(index) != phy_info:
+                        done[index] = result
+                    else:
+                        retry.append(index)
+                    continue
+                prev_index[phy_info] = index
+                done[index] = result
+        finally:
+            pool.stop()
+            self.record_done(done)
+
+    def record_done(self, done):
+        '''
+        Record the results that are next in db order
+
+        :param done: dictionary of db index to test result, None for skipped entries
+        '''
+        while self.scan_session.current in done:
+            result = done.pop(self.scan_session.current)
+            db_entry = self.scan_session.db[self.scan_session.current]
+            if result is None:
+                self.record_entry('skipped', db_entry)
             else:
-                time.sleep(self.between_delay)
-        self.print_results()
+                self.record_result(db_entry, result)
+
+    def record_result(self, db_entry, result):
+        if result.get('supported'):
+            self.record_entry('supported', db_entry.with_info(result['info']))
+        else:
+            self.record_entry('unsupported', db_entry)
+
+    def prepare_worker(self):
+        '''
+        Build the db in a worker process (see numap.apps.scan_workers)
+        '''
+        stride = self.options.get('--stride')
+        sample = self.options.get('--sample')
+        self.build_db(
+            self.options.get('--db'), self.options.get('--vid_pid'),
+            int(stride) if stride else 1, int(sample) if sample else None,
+            self.options.get('--schedule')
+        )
+
+    def test_item(self, runner, phy, index):
+        '''
+        Test a single db entry.
+        If the host did not respond after a shortened settle delay,
+        the entry is tested again after the maximum delay, only then
+        a missing response means that the host may be dead.
+
+        :param runner: ScanRunner
+        :param phy: the PHY to test on
+        :param index: db index of the entry
+        :return: result dictionary
+        '''
+        result = self.test_entry(runner, phy, index)
+        if not result['setup_packet_received'] and self.settle.shortened():
+            self.logger.warning('No response after a shortened settle delay, testing again')
+            self.settle.missed()
+            result = self.test_entry(runner, phy, index)
+        result['host_dead'] = not (result['setup_packet_received'] or result['timed_out'])
+        return result
+
+    def test_entry(self, runner, phy, index):
+        '''
+        :return: result dictionary of a single attempt
+        '''
+        db_entry = self.scan_session.db[index]
+        self.settle.wait()
+        self.logger.always('Testing support for %s', db_entry.describe(self.os))
+        self.setup_packet_received = False
+        self.current_usb_function_supported = False
+        self.current_test_timed_out = False
+        self.test_completion.timeout = self.scan_session.timeout
+        self.test_completion.start()
+        device = USBVendorSpecificDevice(self, phy, db_entry.vid, db_entry.pid)
+        try:
+            runner.run_test(device, self.test_timeout if self.test_timeout > 0 else None)
+        except asyncio.TimeoutError:
+            self.current_test_timed_out = True
+            self.logger.warning('Test exceeded %d seconds, moving to the next device',
+                                self.test_timeout)
+        except:
+            self.logger.error(traceback.format_exc())
+        finally:
+            try:
+                device.disconnect()
+            except Exception:
+                self.logger.debug('Failed to disconnect device cleanly after test',
+                                  exc_info=True)
+            self.settle.disconnected()
+            self.settle.test_done(self.test_completion.response_latency())
+        result = {
+            'supported': self.current_usb_function_supported,
+            'setup_packet_received': self.setup_packet_received,
+            'timed_out': self.current_test_timed_out,
+        }
+        if self.current_usb_function_supported:
+            result['info'] = self.get_device_info(device)
+        return result
 
-    def is_host_alive(self):
-        if not self.setup_packet_received:
-            if self.current_test_timed_out:
-                self.logger.warning('Device did not respond before the timeout expired; '
-                                    'continuing with the next entry')
-                self.current_test_timed_out = False
-                self._record_no_response()
-                return True
+    def check_host_alive(self, index, result, prev_index, phy_info=None):
+        '''
+        :param index: db index of the tested entry
+        :param result: test result
+        :param prev_index: db index of the entry that was tested before, on the same PHY
+        :param phy_info: PHY of the test, when scanning with several PHYs (default: None)
+        :return: False if the host seems dead
+        '''
+        if result['setup_packet_received']:
+            return True
+        if result['timed_out']:
+            self.logger.warning('Device did not respond before the timeout expired; '
+                                'continuing with the next entry')
+            self._record_no_response(index, prev_index, phy_info)
+            return True
+        if phy_info:
+            self.logger.error('Host on %s appears to have died or is simply ignoring us :(' % phy_info)
+        else:
             self.logger.error('Host appears to have died or is simply ignoring us :(')
-            self._record_no_response()
-        return self.setup_packet_received
+        self._record_no_response(index, prev_index, phy_info)
+        return False
 
-    def _record_no_response(self):
-        current_index = self.scan_session.current
-        if current_index not in self.scan_session.no_response:
-            self.scan_session.no_response[current_index] = self.prev_index
-        self.sync_session()
+    def _record_no_response(self, index, prev_index, phy_info=None):
+        if index not in self.scan_session.no_response:
+            record = {'type': 'no_response', 'index': index, 'prev': prev_index}
+            if phy_info:
+                record['phy'] = phy_info
+            self.scan_session.apply(record)
+            self.sync_session(record)
 
     def usb_function_supported(self, reason=None):
         '''
@@ -330,66 +572,13 @@ class NumapVSScanApp(NumapApp):
         :param reason: reason why we decided it is supported (default: None)
         '''
         self.current_usb_function_supported = True
+        self.test_completion.function_supported()
 
     def signal_handler(self, signal, frame):
         self.stop_signal_received = True
 
     def should_stop_phy(self):
-        stop_phy = False
-        time_elapsed = int(time.time() - self.start_time)
-        if self.current_usb_function_supported:
-            stop_phy = True
-        elif time_elapsed >= self.scan_session.timeout:
-            self.logger.info('have been waiting long enough (over %d secs.), disconnect' % (time_elapsed))
-            stop_phy = True
-        return stop_phy
-
-    @contextlib.contextmanager
-    def _test_timeout_guard(self):
-        if not self.test_timeout or self.test_timeout <= 0:
-            yield _TestTimeoutInfo(None)
-            return
-
-        timeout_info = _TestTimeoutInfo(self.test_timeout)
-
-        def _handle_timeout(signum, frame):
-            raise _TestTimeoutExpired
-
-        previous_handler = signal.signal(signal.SIGALRM, _handle_timeout)
-        timeout_info.start()
-        signal.alarm(self.test_timeout)
-        try:
-            yield timeout_info
-        finally:
-            signal.alarm(0)
-            timeout_info.stop()
-            signal.signal(signal.SIGALRM, previous_handler)
-
-
-class _TestTimeoutExpired(Exception):
-    pass
-
-
-class _TestTimeoutInfo(object):
-
-    def __init__(self, timeout):
-        self.timeout = timeout
-        self.remaining = timeout
-        self._start = None
-
-    def start(self):
-        if self.timeout is None:
-            return
-        self._start = time.monotonic()
-
-    def stop(self):
-        if self.timeout is None or self._start is None:
-            self.remaining = self.timeout
-            return
-        elapsed = time.monotonic() - self._start
-        remaining = self.timeout - elapsed
-        self.remaining = remaining if remaining > 0 else 0
-        self._start = None
+        return self.test_completion.check()
 
 
 def main():
@@ -20,6 +20,7 @@ class DescriptorType(object):
     device_qualifier = 0x06
     other_speed_configuration = 0x07
     interface_power = 0x08
+    interface_association = 0x0b
     bos = 0x0f
     device_capability = 0x10
     hid = 0x21
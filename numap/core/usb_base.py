@@ -3,14 +3,31 @@ Common functionality for all USB actors (interface, class, etc.)
 '''
 import time
 import logging
+from numap.utils.ulogger import VERBOSE, ALWAYS
 
 start_time = time.time()
 
+# maps actor name to the prefix of its log messages
+_log_prefixes = {}
+
+
+def _invalidating_setattr(self, name, value):
+    object.__setattr__(self, name, value)
+    if name in self.descriptor_attributes:
+        self.invalidate_descriptors()
+
 
 class USBBaseActor(object):
 
     name = 'Actor'
 
+    #: attributes that are encoded in the descriptors built by this actor,
+    #: assigning one of them drops the cached descriptors (see :class:`USBDevice`).
+    #: classes that set it get an invalidating __setattr__
+    descriptor_attributes = frozenset()
+    #: name of the attribute that holds the parent actor in the descriptor tree
+    descriptor_parent = None
+
     def __init__(self, app, phy):
         '''
         :param app: nümap application
@@ -22,6 +39,25 @@ class USBBaseActor(object):
         self.str_dict = {}
         self.logger = logging.getLogger('numap')
 
+    def __init_subclass__(cls, **kwargs):
+        super(USBBaseActor, cls).__init_subclass__(**kwargs)
+        # only actors with descriptor attributes pay for the hook,
+        # the others (e.g. SCSI state on the bulk path) keep the plain assignment
+        if cls.descriptor_attributes and '__setattr__' not in cls.__dict__:
+            cls.__setattr__ = _invalidating_setattr
+
+    def invalidate_descriptors(self):
+        '''
+        Drop cached descriptors that contain data of this actor.
+        This is done automatically when one of the descriptor_attributes
+        is assigned, but should be called explicitly after modifying
+        one of them in place (e.g. appending to a list of endpoints).
+        '''
+        if self.descriptor_parent:
+            parent = getattr(self, self.descriptor_parent, None)
+            if parent is not None and hasattr(parent, 'invalidate_descriptors'):
+                parent.invalidate_descriptors()
+
     def get_mutation(self, stage, data=None):
         '''
         :param stage: stage name
@@ -76,28 +112,36 @@ class USBBaseActor(object):
         :param str_id: string id
         :return: the string, or None if id does not exist
         '''
-        self.debug('Getting string by id %#x' % (str_id))
+        self.debug('Getting string by id %#x', str_id)
         if str_id in self.str_dict:
             return self.str_dict[str_id]
         return None
 
+    def _log(self, level, msg, args, kwargs):
+        logger = self.logger
+        if logger.isEnabledFor(level):
+            prefix = _log_prefixes.get(self.name)
+            if prefix is None:
+                prefix = _log_prefixes[self.name] = '[%s] ' % self.name
+            logger._log(level, '%s%s' % (prefix, msg), args, **kwargs)
+
     def verbose(self, msg, *args, **kwargs):
-        self.logger.verbose('[%s] %s' % (self.name, msg), *args, **kwargs)
+        self._log(VERBOSE, msg, args, kwargs)
 
     def debug(self, msg, *args, **kwargs):
-        self.logger.debug('[%s] %s' % (self.name, msg), *args, **kwargs)
+        self._log(logging.DEBUG, msg, args, kwargs)
 
     def info(self, msg, *args, **kwargs):
-        self.logger.info('[%s] %s' % (self.name, msg), *args, **kwargs)
+        self._log(logging.INFO, msg, args, kwargs)
 
     def warning(self, msg, *args, **kwargs):
-        self.logger.warning('[%s] %s' % (self.name, msg), *args, **kwargs)
+        self._log(logging.WARNING, msg, args, kwargs)
 
     def error(self, msg, *args, **kwargs):
-        self.logger.error('[%s] %s' % (self.name, msg), *args, **kwargs)
+        self._log(logging.ERROR, msg, args, kwargs)
 
     def critical(self, msg, *args, **kwargs):
-        self.logger.critical('[%s] %s' % (self.name, msg), *args, **kwargs)
+        self._log(logging.CRITICAL, msg, args, kwargs)
 
     def always(self, msg, *args, **kwargs):
-        self.logger.always('[%s] %s' % (self.name, msg), *args, **kwargs)
+        self._log(ALWAYS, msg, args, kwargs)
@@ -24,6 +24,12 @@ class USBConfiguration(USBBaseActor, BaseUSBConfiguration):
 
     name = 'Configuration'
 
+    descriptor_attributes = frozenset([
+        'index', 'configuration_string_index', 'interfaces',
+        'attributes', '_fallback_attributes', 'max_power',
+    ])
+    descriptor_parent = 'device'
+
     # Those attributes can be ORed
     # At least one should be selected
     ATTR_BASE = 0x80
@@ -11,6 +11,9 @@ class USBCSEndpoint(USBBaseActor):
 
     name = 'CSEndpoint'
 
+    descriptor_attributes = frozenset(['cs_config'])
+    descriptor_parent = 'interface'
+
     def __init__(self, name, app, phy, cs_config):
         '''
         :param name: Name of the endpoint
@@ -32,7 +35,7 @@ class USBCSEndpoint(USBBaseActor):
 
     def default_handler(self, req):
         self.interface.phy.send_on_endpoint(0, b'')
-        self.debug('Received an unknown CSEndpoint request: %s, returned an empty response' % req)
+        self.debug('Received an unknown CSEndpoint request: %s, returned an empty response', req)
 
     def set_interface(self, interface):
         self.interface = interface
@@ -9,6 +9,9 @@ from numap.core.usb_base import USBBaseActor
 class USBCSInterface(USBBaseActor):
     name = 'CSInterface'
 
+    descriptor_attributes = frozenset(['cs_config'])
+    descriptor_parent = 'interface'
+
     def __init__(self, name, app, phy, cs_config):
         '''
         :param app: numap application
@@ -17,6 +20,7 @@ class USBCSInterface(USBBaseActor):
         '''
         super(USBCSInterface, self).__init__(app, phy)
         self.name = name
+        self.interface = None
         self.cs_config = cs_config
         self.descriptors = {}
         self.descriptors[DescriptorType.cs_interface] = self.get_descriptor
@@ -35,9 +39,10 @@ class USBCSInterface(USBBaseActor):
 
         response = None
 
-        self.info((
-            'Received GET_DESCRIPTOR req %d, index %d, language 0x%04x, length %d'
-        ) % (dtype, dindex, lang, n))
+        self.info(
+            'Received GET_DESCRIPTOR req %d, index %d, language 0x%04x, length %d',
+            dtype, dindex, lang, n
+        )
 
         # TODO: handle KeyError
         response = self.descriptors[dtype]
@@ -47,7 +52,7 @@ class USBCSInterface(USBBaseActor):
         if response:
             n = min(n, len(response))
             self.phy.send_on_endpoint(0, response[:n])
-            self.log_verbose('sent %d bytes in response' % (n))
+            self.verbose('sent %d bytes in response', n)
 
     def handle_set_interface_request(self, req):
         self.phy.stall_ep0()
@@ -55,7 +60,7 @@ class USBCSInterface(USBBaseActor):
 
     def default_handler(self, req):
         self.phy.send_on_endpoint(0, b'')
-        self.debug('Received an unknown USBCSInterface request: %s, returned an empty response' % req)
+        self.debug('Received an unknown USBCSInterface request: %s, returned an empty response', req)
 
     def get_descriptor(self, usb_type='fullspeed', valid=False):
         descriptor_type = DescriptorType.cs_interface
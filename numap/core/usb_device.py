@@ -4,6 +4,7 @@
 
 # TODO: replace with FaceDancer
 
+import collections
 import importlib
 import inspect
 import struct
@@ -11,7 +12,8 @@ import sys
 import traceback
 from numap.core.usb import DescriptorType, Request, State
 from numap.core.usb_base import USBBaseActor
-from numap.fuzz.helpers import mutable
+from numap.core.usb_string import USBStringTable, build_string_descriptor
+from numap.fuzz.helpers import mutable, fuzzing_active, set_stage_request
 
 try:
     from facedancer import USBDevice as BaseUSBDevice
@@ -56,51 +58,45 @@ def _restore_facedancer_factories(patched):
         setattr(module, 'FacedancerUSBApp', factory)
 
 
-def _normalize_string_descriptor_value(value):
-    """Convert *value* into a Unicode string suitable for string descriptors."""
+def _dispatch_index(request_type, index):
+    '''
+    :param request_type: bmRequestType of the request
+    :param index: wIndex of the request
+    :return: the part of wIndex that selects the handler: the interface
+        number or endpoint address, 0 for the other recipients
+    '''
+    recipient = request_type & 0x1f
+    if recipient == Request.recipient_interface:
+        return index & 0xff
+    if recipient == Request.recipient_endpoint:
+        return index & 0x8f
+    return 0
 
-    if value is None:
-        return ''
 
-    if isinstance(value, str):
-        return value
+def _ignore_endpoint_data(*args):
+    pass
 
-    if isinstance(value, bytes):
-        payload = value
-        if len(payload) >= 2:
-            length = payload[0]
-            dtype = payload[1]
-            if dtype == DescriptorType.string and 2 < length <= len(payload):
-                payload = payload[2:length]
-        for encoding in ('utf-8', 'utf-16-le', 'latin-1'):
-            try:
-                return payload.decode(encoding)
-            except UnicodeDecodeError:
-                continue
-        return payload.decode('utf-8', errors='replace')
-
-    return str(value)
-
-
-def _encode_string_descriptor_payload(value):
-    """Return the UTF-16LE payload (without BOM) for *value*."""
-
-    if value is None:
-        return b''
-
-    if isinstance(value, bytes):
-        payload = value
-    else:
-        payload = str(value).encode('utf-16')
-
-    if len(payload) >= 2 and payload[:2] in (b'\xff\xfe', b'\xfe\xff'):
-        payload = payload[2:]
-
-    return payload
 
 class USBDevice(USBBaseActor, BaseUSBDevice):
     name = 'Device'
 
+    descriptor_attributes = frozenset([
+        'usb_spec_version', '_device_class', 'device_subclass', 'protocol_rel_num',
+        'max_packet_size_ep0', 'vendor_id', 'product_id', 'device_rev',
+        'manufacturer_string_id', 'product_string_id', 'serial_number_string_id',
+        'strings', 'string_table', 'descriptors', 'configurations', 'configuration', 'bos',
+    ])
+
+    # responses for those descriptor types are built once and served from
+    # the descriptor cache until one of the descriptor attributes changes
+    cached_descriptor_types = frozenset([
+        DescriptorType.device,
+        DescriptorType.configuration,
+        DescriptorType.other_speed_configuration,
+        DescriptorType.string,
+        DescriptorType.bos,
+    ])
+
     def __init__(
             self, app, phy, device_class, device_subclass,
             protocol_rel_num, max_packet_size_ep0, vendor_id, product_id,
@@ -133,6 +129,8 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
             descriptors = {}
 
         USBBaseActor.__init__(self, app, phy)
+        # maps (descriptor type, descriptor index, wIndex) to immutable bytes
+        self._descriptor_cache = {}
 
         # facedancer >= 2024.7 changed the USBDevice.__init__ signature to only accept
         # ``self``.  Older releases still expect the entire descriptor payload.  Detect
@@ -173,7 +171,9 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
         self.supported_device_class_trigger = False
         self.supported_device_class_count = 0
 
-        self.strings = []
+        self.string_table = USBStringTable()
+        # kept for compatibility, same list as string_table.strings
+        self.strings = self.string_table.strings
 
         self.usb_spec_version = 0x0002
         self._device_class = device_class
@@ -241,8 +241,20 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
 
         self.address = 0
         self.endpoints = {}
+        # endpoint handlers of the current configuration,
+        # indexed by endpoint number | (direction << 4)
+        self._endpoint_handlers = [None] * 32
+        # interface number -> alternate setting selected by SET_INTERFACE
+        self.alternate_settings = {}
+        self._function_supported_notified = False
         self.setup_request_handlers()
 
+        # maps (bmRequestType, bRequest, wIndex) to (handler, handled)
+        self._request_dispatch = {}
+        # counts requests that fell back to a default handler,
+        # keyed by (bmRequestType, bRequest)
+        self.unhandled_requests = collections.Counter()
+
     def _get_interface_by_number(self, interface_number):
         configs = []
         if self.configuration is not None:
@@ -255,57 +267,168 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
         return None
 
     def handle_request(self, data):
+        self.app.signal_setup_packet_received()
         req = USBDeviceRequest(data)
-        recipient = req.get_recipient()
-        request_type = req.get_type()
+        # keyed by the handler selector only, so the table is bounded whatever wIndex the host sends
+        key = (req.request_type, req.request, _dispatch_index(req.request_type, req.index))
+        entry = self._request_dispatch.get(key)
+        if entry is None:
+            entry = self._resolve_request_handler(*key)
+            self._request_dispatch[key] = entry
+        handler, handled = entry
+
+        if handler is None:
+            self.phy.stall_ep0()
+            return
+
+        if not handled:
+            self.unhandled_requests[key[:2]] += 1
+        # recorded with the stages of the response
+        set_stage_request(req)
+        try:
+            handler(req)
+        finally:
+            set_stage_request(None)
+
+    def _resolve_request_handler(self, request_type, request, index):
+        '''
+        Find the handler of a control request.
+
+        :param request_type: bmRequestType of the request
+        :param request: bRequest of the request
+        :param index: wIndex of the request, only the part that selects the
+            target is used (see _dispatch_index)
+        :return: tuple (handler, handled). handler is None if the request
+            should be stalled, handled is False if the request falls back
+            to a default handler.
+        '''
+        recipient = request_type & 0x1f
+        req_type = (request_type >> 5) & 0x03
 
         if recipient == Request.recipient_device:
             target = self
         elif recipient == Request.recipient_interface:
-            target = self._get_interface_by_number(req.get_index())
+            # the high byte holds class specific data (e.g. audio entity ID)
+            target = self._get_interface_by_number(index & 0xff)
         elif recipient == Request.recipient_endpoint:
-            target = self.endpoints.get(req.get_index())
+            target = self.endpoints.get(index & 0x0f)
         else:
             target = self
 
         if target is None:
-            self.phy.stall_ep0()
-            return
+            return None, False
 
         handler = None
-        if request_type == Request.type_standard:
-            handler = getattr(target, 'request_handlers', {}).get(req.request)
+        handled = False
+        if req_type == Request.type_standard:
+            handler = getattr(target, 'request_handlers', {}).get(request)
             if handler is None:
                 handler = getattr(target, 'default_handler', None)
-        elif request_type == Request.type_class:
+            else:
+                handled = True
+        elif req_type == Request.type_class:
             usb_class = getattr(target, 'usb_class', None) or self.usb_class
             if usb_class is not None:
-                handler = usb_class.request_handlers.get(req.request)
+                handler = usb_class.request_handlers.get(request)
                 if handler is None:
                     handler = usb_class.default_handler
-        elif request_type == Request.type_vendor:
+                else:
+                    handled = True
+        elif req_type == Request.type_vendor:
             usb_vendor = getattr(target, 'usb_vendor', None) or self.usb_vendor
             if usb_vendor is not None:
-                handler = usb_vendor.request_handlers.get(req.request)
+                handler = usb_vendor.request_handlers.get(request)
                 if handler is None:
                     handler = usb_vendor.default_handler
+                else:
+                    handled = True
 
         if handler is None:
-            target.default_handler(req)
-            return
+            handler = target.default_handler
+        return handler, handled
 
-        handler(req)
+    def build_request_dispatch(self):
+        '''
+        (Re)build the control request dispatch table.
+
+        Requests with a dedicated handler on the device, on the interfaces
+        (of the current configuration, or all configurations if not
+        configured yet) and on the collated endpoints are resolved here,
+        any other request is resolved once, when it is first received.
+        '''
+        self._request_dispatch = {}
+        targets = [(Request.recipient_device, 0, self)]
+        if self.configuration is not None:
+            configs = [self.configuration]
+        else:
+            configs = self.configurations
+        for config in configs:
+            for interface in getattr(config, 'interfaces', []):
+                targets.append((Request.recipient_interface, interface.number, interface))
+        for endpoint in self.endpoints.values():
+            targets.append((Request.recipient_endpoint, endpoint.address, endpoint))
+
+        for recipient, index, target in targets:
+            requests = [(Request.type_standard, getattr(target, 'request_handlers', {}))]
+            for req_type, attr in ((Request.type_class, 'usb_class'), (Request.type_vendor, 'usb_vendor')):
+                actor = getattr(target, attr, None) or getattr(self, attr, None)
+                if actor is not None:
+                    requests.append((req_type, actor.request_handlers))
+            for req_type, handlers in requests:
+                for request in handlers:
+                    for direction in (Request.direction_host_to_device, Request.direction_device_to_host):
+                        request_type = (direction << 7) | (req_type << 5) | recipient
+                        key = (request_type, request, index)
+                        if key not in self._request_dispatch:
+                            self._request_dispatch[key] = self._resolve_request_handler(*key)
+
+    def build_endpoint_table(self):
+        '''
+        Bind the endpoint handlers of the current configuration into the
+        endpoint table, so data from the phy is dispatched without lookups.
+        Called on SET_CONFIGURATION and SET_INTERFACE.
+        '''
+        table = [None] * 32
+        endpoints = {}
+        if self.configuration is not None:
+            interfaces = self.configuration.interfaces
+            # endpoints of explicitly selected alternate settings take precedence
+            selected = [i for i in interfaces if self.alternate_settings.get(i.number) == i.alternate]
+            for i in interfaces + selected:
+                for e in i.endpoints:
+                    endpoints[e.number] = e
+                    handler = e.handler if callable(e.handler) else _ignore_endpoint_data
+                    table[(e.number & 0x0f) | (e.direction << 4)] = handler
+        self.endpoints = endpoints
+        self._endpoint_handlers = table
 
     def get_string_id(self, s):
-        s = _normalize_string_descriptor_value(s)
-        try:
-            i = self.strings.index(s)
-        except ValueError:
-            # string descriptors start at index 1
-            self.strings.append(s)
-            i = len(self.strings)
+        count = len(self.string_table)
+        i = self.string_table.get_id(s)
+        if len(self.string_table) != count:
+            self.invalidate_descriptors()
         return i
 
+    def set_string_translation(self, str_id, langid, s):
+        '''
+        Add a translation of a device string, the language ID is added to
+        the list of supported languages (string descriptor zero).
+
+        :param str_id: id of the string (from get_string_id)
+        :param langid: language ID
+        :param s: the translated string
+        '''
+        self.string_table.set_translation(str_id, langid, s)
+        self.invalidate_descriptors()
+
+    def invalidate_descriptors(self):
+        '''
+        Drop all cached descriptors of the device
+        '''
+        cache = self.__dict__.get('_descriptor_cache')
+        if cache:
+            cache.clear()
+
     def setup_request_handlers(self):
         # see table 9-4 of USB 2.0 spec, page 279
         self.request_handlers = {
@@ -329,15 +452,15 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
         self.phy.send_on_endpoint(0, b'\x01\x00')
 
     def handle_clear_feature_request(self, req):
-        self.debug('Received CLEAR_FEATURE request %#x' % req.value)
+        self.debug('Received CLEAR_FEATURE request %#x', req.value)
         self.phy.send_on_endpoint(0, b'')
 
     def handle_set_feature_request(self, req):
-        self.debug('Received SET_FEATURE request %#x' % req.value)
+        self.debug('Received SET_FEATURE request %#x', req.value)
         self.phy.send_on_endpoint(0, b'')
 
     def handle_set_address_request(self, req):
-        self.debug('Received SET_ADDRESS request %#x' % req.value)
+        self.debug('Received SET_ADDRESS request %#x', req.value)
         self.address = req.value & 0x7f
         self.ack_status_stage()
 
@@ -372,6 +495,8 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
             _restore_facedancer_factories(patched_factories)
         # skipping USB.state_attached may not be strictly correct (9.1.1.{1,2})
         self.state = State.powered
+        self._function_supported_notified = False
+        self.build_request_dispatch()
 
     def disconnect(self):
         self.phy.disconnect()
@@ -390,6 +515,7 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
         else:
             self._base_connected = False
         self.state = State.detached
+        self._endpoint_handlers = [None] * 32
 
     def ack_status_stage(self):
         self.phy.ack_status_stage()
@@ -446,25 +572,26 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
         Called when there is no handler for the request
         """
         self.phy.send_on_endpoint(0, b'')
-        self.debug('Received an unknown device request: %s, returned an empty response' % req)
+        self.debug('Received an unknown device request: %s, returned an empty response', req)
 
     def handle_data_available(self, ep_num, data):
-        if self.state == State.configured and ep_num in self.endpoints:
-            self.usb_function_supported('data received on endpoint %#x' % (ep_num))
-            endpoint = self.endpoints[ep_num]
-            if callable(endpoint.handler):
-                endpoint.handler(data)
+        # the table is only populated while configured
+        handler = self._endpoint_handlers[ep_num & 0x0f]
+        if handler is not None:
+            if not self._function_supported_notified:
+                self._function_supported_notified = True
+                self.usb_function_supported('data received on endpoint %#x' % (ep_num))
+            handler(data)
 
     def handle_buffer_available(self, ep_num):
-        if self.state == State.configured and ep_num in self.endpoints:
-            endpoint = self.endpoints[ep_num]
-            if callable(endpoint.handler):
-                try:
-                    endpoint.handler()
-                except:
-                    self.error(traceback.format_exc())
-                    self.error(''.join(traceback.format_stack()))
-                    raise
+        handler = self._endpoint_handlers[(ep_num & 0x0f) | 0x10]
+        if handler is not None:
+            try:
+                handler()
+            except:
+                self.error(traceback.format_exc())
+                self.error(''.join(traceback.format_stack()))
+                raise
 
     # standard request handlers
 
@@ -493,51 +620,50 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
 
     @mutable('string_descriptor_zero')
     def get_string0_descriptor(self):
-        d = struct.pack(
-            '<BBBB',
-            4,      # length of descriptor in bytes
-            3,      # descriptor type 3 == string
-            9,      # language code 0, byte 0
-            4       # language code 0, byte 1
-        )
-        return d
+        return self.string_table.get_string0_descriptor()
 
     @mutable('string_descriptor')
-    def get_string_descriptor(self, num):
-        self.debug('get_string_descriptor: %#x (%#x)' % (num, len(self.strings)))
-        s = None
-        if num <= len(self.strings):
-            s = _encode_string_descriptor_payload(self.strings[num - 1])
-        else:
+    def get_string_descriptor(self, num, langid=None):
+        self.debug('get_string_descriptor: %#x (%#x)', num, len(self.string_table))
+        d = self.string_table.get_descriptor(num, langid)
+        if d is None:
+            s = None
             if self.configuration:
-                s = _encode_string_descriptor_payload(
-                    self.configuration.get_string_by_id(num)
-                )
-        if not s and self.strings:
-            s = _encode_string_descriptor_payload(self.strings[0])
-        elif not s:
-            s = b''
-
-        d = struct.pack(
-            '<BB',
-            len(s) + 2,  # length of descriptor in bytes
-            3            # descriptor type 3 == string
-        )
-        return d + s
+                s = self.configuration.get_string_by_id(num)
+            if s:
+                d = build_string_descriptor(s)
+            else:
+                d = self.string_table.get_descriptor(1) or build_string_descriptor(b'')
+        return d
 
-    def handle_get_string_descriptor_request(self, num):
+    def handle_get_string_descriptor_request(self, num, langid=None):
         if num == 0:
             return self.get_string0_descriptor()
         else:
-            return self.get_string_descriptor(num)
+            return self.get_string_descriptor(num, langid)
 
     def handle_get_descriptor_request(self, req):
         dtype = (req.value >> 8) & 0xff
         dindex = req.value & 0xff
-        self.debug('Received GET_DESCRIPTOR req type=%#x index=%#x len=%d' % (dtype, dindex, req.length))
-        response = self.descriptors.get(dtype)
-        if callable(response):
-            response = response(dindex)
+        self.debug('Received GET_DESCRIPTOR req type=%#x index=%#x len=%d', dtype, dindex, req.length)
+        response = None
+        # mutated (or recorded) descriptors must be rebuilt on each request
+        cacheable = dtype in self.cached_descriptor_types and not fuzzing_active(self.app)
+        if cacheable:
+            # wIndex is the language ID of string descriptors, it does not select the others
+            key = (dtype, dindex, req.index if dtype == DescriptorType.string else 0)
+            response = self._descriptor_cache.get(key)
+        if response is None:
+            response = self.descriptors.get(dtype)
+            if callable(response):
+                if dtype == DescriptorType.string:
+                    # wIndex holds the language ID
+                    response = response(dindex, req.index)
+                else:
+                    response = response(dindex)
+            if cacheable and response:
+                response = bytes(response)
+                self._descriptor_cache[key] = response
         if not response:
             self.phy.stall_ep0()
             return
@@ -588,18 +714,19 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
 
         # configs are one-based
         if (req.value) > len(self.configurations):
-            self.error('Host tries to set invalid configuration: %#x' % (req.value - 1))
+            self.error('Host tries to set invalid configuration: %#x', req.value - 1)
             self.config_num = 0
         else:
             self.config_num = req.value - 1
-        self.info('Setting configuration: %#x' % self.config_num)
+        self.info('Setting configuration: %#x', self.config_num)
         self.configuration = self.configurations[self.config_num]
         self.state = State.configured
+        self.alternate_settings = {}
+        self._function_supported_notified = False
 
-        # collate endpoint numbers
-        for i in self.configuration.interfaces:
-            for e in i.endpoints:
-                self.endpoints[e.number] = e
+        self.build_endpoint_table()
+        self.build_request_dispatch()
+        self.app.signal_device_configured()
 
         # HACK: blindly acknowledge request
         self.ack_status_stage()
@@ -617,6 +744,9 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
     def handle_set_interface_request(self, req):
         self.phy.send_on_endpoint(0, b'')
         self.debug('Received SET_INTERFACE request')
+        self.alternate_settings[req.index] = req.value
+        self.build_endpoint_table()
+        self.build_request_dispatch()
 
     # USB 2.0 specification, section 9.4.11 (p 288 of pdf)
     def handle_synch_frame_request(self, req):
@@ -635,6 +765,18 @@ class USBDevice(USBBaseActor, BaseUSBDevice):
 
 
 class USBDeviceRequest(object):
+    '''
+    A single control request.
+
+    The setup packet is parsed once, the data stage is only copied
+    (or formatted, for logging) when it is accessed.
+    A buffer that the PHY may reuse (bytearray, memoryview) is copied to
+    bytes first, so the request, and views of it, can outlive the handler.
+    '''
+
+    __slots__ = ('request_type', 'request', 'value', 'index', 'length', '_raw', '_data')
+
+    setup_struct = struct.Struct('<BBHHH')
 
     setup_request_types = {
         Request.type_standard: 'standard',
@@ -649,24 +791,45 @@ class USBDeviceRequest(object):
     }
 
     def __init__(self, obj):
-        """Expects raw 8-byte setup data request packet"""
-
-        if isinstance(obj, bytes):
-            raw_bytes = obj
+        """Expects raw 8-byte setup data request packet (or a parsed request object)"""
+
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            if not isinstance(obj, bytes):
+                obj = bytes(obj)
+            (
+                self.request_type, self.request, self.value, self.index, self.length
+            ) = self.setup_struct.unpack_from(obj)
+            self._raw = obj
+            self._data = None
         else:
-            raw_bytes = struct.pack('<BBHHH',
-                obj.request_type,
-                obj.request,
-                obj.value,
-                obj.index,
-                obj.length
-            )
-            raw_bytes += obj.data
-
-        header = raw_bytes[:8]
-        self.request_type, self.request, self.value, self.index, self.length = struct.unpack('<BBHHH', header)
-        self.data = raw_bytes[8:]
-        self.raw_bytes = raw_bytes
+            self.request_type = obj.request_type
+            self.request = obj.request
+            self.value = obj.value
+            self.index = obj.index
+            self.length = obj.length
+            self._raw = None
+            self._data = bytes(obj.data)
+
+    @property
+    def raw_bytes(self):
+        '''setup packet followed by the data stage (bytes)'''
+        if self._raw is None:
+            self._raw = self.raw() + self._data
+        return self._raw
+
+    @property
+    def data_view(self):
+        '''read-only memoryview of the data stage, does not copy the data'''
+        if self._raw is None:
+            return memoryview(self._data)
+        return memoryview(self._raw)[8:]
+
+    @property
+    def data(self):
+        '''data stage as bytes (copied once, on first access)'''
+        if self._data is None:
+            self._data = bytes(self.data_view)
+        return self._data
 
     def __str__(self):
         s = 'dir=%#x (%s), type=%#x (%s), rec=%#x (%s), req=%#x, val=%#x, idx=%#x, len=%#x' % (
@@ -685,8 +848,7 @@ class USBDeviceRequest(object):
 
     def raw(self):
         '''returns request as bytes'''
-        b = struct.pack(
-            '<BBHHH',
+        b = self.setup_struct.pack(
             self.request_type,
             self.request,
             self.value,
@@ -25,6 +25,12 @@ class USBEndpoint(USBBaseActor):
     usage_type_feedback = 0x01
     usage_type_implicit_feedback = 0x02
 
+    descriptor_attributes = frozenset([
+        'number', 'direction', 'transfer_type', 'sync_type', 'usage_type',
+        'max_packet_size', 'interval', 'cs_endpoints', 'address',
+    ])
+    descriptor_parent = 'interface'
+
     def __init__(
             self, app, phy, number, direction, transfer_type, sync_type,
             usage_type, max_packet_size, interval, handler, cs_endpoints=None,
@@ -73,12 +79,12 @@ class USBEndpoint(USBBaseActor):
         self.interface.phy.send_on_endpoint(0, b'')
 
     def handle_get_status(self, req):
-        self.info('in GET_STATUS of endpoint %d' % self.number)
+        self.info('in GET_STATUS of endpoint %d', self.number)
         self.phy.send_on_endpoint(0, b'\x00\x00')
 
     def default_handler(self, req):
         self.phy.send_on_endpoint(0, b'')
-        self.debug('Received an unknown USBEndpoint request: %s, returned an empty response' % req)
+        self.debug('Received an unknown USBEndpoint request: %s, returned an empty response', req)
 
     def send(self, data):
         self.phy.send_on_endpoint(self.number, data)
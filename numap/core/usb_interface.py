@@ -12,6 +12,12 @@ from numap.fuzz.helpers import mutable
 class USBInterface(USBBaseActor):
     name = 'Interface'
 
+    descriptor_attributes = frozenset([
+        'number', 'alternate', 'iclass', 'subclass', 'protocol', 'string_index',
+        'endpoints', 'descriptors', 'cs_interfaces',
+    ])
+    descriptor_parent = 'configuration'
+
     def __init__(
         self, app, phy, interface_number, interface_alternate, interface_class,
         interface_subclass, interface_protocol, interface_string_index,
@@ -64,6 +70,9 @@ class USBInterface(USBBaseActor):
             if self.usb_vendor is None:
                 self.usb_vendor = e.usb_vendor
 
+        for cs in self.cs_interfaces:
+            cs.interface = self
+
         if self.usb_class:
             self.usb_class.interface = self
         if self.usb_vendor:
@@ -80,7 +89,7 @@ class USBInterface(USBBaseActor):
         lang = req.index
         n = req.length
 
-        self.debug(('Received GET_DESCRIPTOR req %d, index %d, language 0x%04x, length %d' % (dtype, dindex, lang, n)))
+        self.debug('Received GET_DESCRIPTOR req %d, index %d, language 0x%04x, length %d', dtype, dindex, lang, n)
         response = self.descriptors[dtype]
         if callable(response):
             response = response(dindex)
@@ -95,7 +104,7 @@ class USBInterface(USBBaseActor):
 
     def default_handler(self, req):
         self.phy.send_on_endpoint(0, b'')
-        self.debug('Received an unknown USBInterface request: %s, returned an empty response' % req)
+        self.debug('Received an unknown USBInterface request: %s, returned an empty response', req)
 
     # Table 9-12 of USB 2.0 spec (pdf page 296)
     @mutable('interface_descriptor')
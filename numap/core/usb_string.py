@@ -0,0 +1,159 @@
+'''
+String descriptor table, see section 9.6.7 of the USB 2.0 specification
+
+Strings are interned by value, and each string descriptor is stored
+encoded and ready to be sent, per language ID.
+'''
+import struct
+from numap.core.usb import DescriptorType
+
+LANGID_EN_US = 0x0409
+
+
+def _normalize_string_descriptor_value(value):
+    """Convert *value* into a Unicode string suitable for string descriptors."""
+
+    if value is None:
+        return ''
+
+    if isinstance(value, str):
+        return value
+
+    if isinstance(value, bytes):
+        payload = value
+        if len(payload) >= 2:
+            length = payload[0]
+            dtype = payload[1]
+            if dtype == DescriptorType.string and 2 < length <= len(payload):
+                payload = payload[2:length]
+        for encoding in ('utf-8', 'utf-16-le', 'latin-1'):
+            try:
+                return payload.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+        return payload.decode('utf-8', errors='replace')
+
+    return str(value)
+
+
+def _encode_string_descriptor_payload(value):
+    """Return the UTF-16LE payload (without BOM) for *value*."""
+
+    if value is None:
+        return b''
+
+    if isinstance(value, bytes):
+        payload = value
+    else:
+        payload = str(value).encode('utf-16')
+
+    if len(payload) >= 2 and payload[:2] in (b'\xff\xfe', b'\xfe\xff'):
+        payload = payload[2:]
+
+    return payload
+
+
+def build_string_descriptor(value):
+    '''
+    :param value: string (or already encoded payload)
+    :return: the string descriptor of value
+    '''
+    payload = _encode_string_descriptor_payload(value)
+    return struct.pack('<BB', len(payload) + 2, DescriptorType.string) + payload
+
+
+class USBStringTable(object):
+    '''
+    String descriptors of a device.
+
+    Index 0 is reserved for the list of supported language IDs,
+    strings are numbered from 1 in the order they were added.
+    The first language ID is the default one, it is also used to answer
+    requests for unsupported language IDs.
+    '''
+
+    def __init__(self, strings=None, langids=(LANGID_EN_US,)):
+        '''
+        :param strings: initial strings, in the default language (default: None)
+        :param langids: supported language IDs (default: (0x0409,))
+        '''
+        self.langids = list(langids)
+        # strings in the default language, string id - 1
+        self.strings = []
+        self._ids = {}
+        # (string id, langid) -> descriptor
+        self._descriptors = {}
+        self._string0 = None
+        for s in strings or []:
+            self.get_id(s)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def get_id(self, s):
+        '''
+        Get the id of a string, adding it to the table if needed
+
+        :param s: the string
+        :return: id of the string
+        '''
+        s = _normalize_string_descriptor_value(s)
+        i = self._ids.get(s)
+        if i is None:
+            self.strings.append(s)
+            i = len(self.strings)
+            self._ids[s] = i
+            self._descriptors[(i, self.langids[0])] = build_string_descriptor(s)
+        return i
+
+    def add_langid(self, langid):
+        '''
+        :param langid: language ID to support
+        '''
+        if langid not in self.langids:
+            self.langids.append(langid)
+            self._string0 = None
+
+    def set_translation(self, str_id, langid, s):
+        '''
+        Set the string to return for a string id in a given language
+
+        :param str_id: id of the string (from get_id)
+        :param langid: language ID
+        :param s: the translated string
+        '''
+        if not 0 < str_id <= len(self.strings):
+            raise ValueError('unknown string id %d' % str_id)
+        self.add_langid(langid)
+        self._descriptors[(str_id, langid)] = build_string_descriptor(s)
+
+    def get_string0_descriptor(self):
+        '''
+        :return: string descriptor zero - list of supported language IDs
+        '''
+        if self._string0 is None:
+            count = len(self.langids)
+            self._string0 = struct.pack(
+                '<BB%dH' % count, 2 + 2 * count, DescriptorType.string, *self.langids
+            )
+        return self._string0
+
+    def get_descriptor(self, str_id, langid=None):
+        '''
+        :param str_id: id of the string
+        :param langid: language ID, use the default language if not supported (default: None)
+        :return: the string descriptor, or None if there is no such string
+        '''
+        if not 0 < str_id <= len(self.strings):
+            return None
+        default_langid = self.langids[0]
+        if langid is None or langid not in self.langids:
+            langid = default_langid
+        d = self._descriptors.get((str_id, langid))
+        if d is None:
+            d = self._descriptors.get((str_id, default_langid))
+            if d is None:
+                # string was added directly to the strings list
+                d = build_string_descriptor(self.strings[str_id - 1])
+                self._descriptors[(str_id, default_langid)] = d
+        return d
@@ -127,7 +127,7 @@ class AudioStreaming(object):
             self.phy.send_on_endpoint(self.tx_ep, self.txq.get())
 
     def data_available(self, data):
-        self.app.logger.info('[AudioStreaming] Got %#x bytes on streaming endpoint' % (len(data)))
+        self.app.logger.info('[AudioStreaming] Got %#x bytes on streaming endpoint', len(data))
 
 
 class USBAudioStreamingInterface(USBInterface):
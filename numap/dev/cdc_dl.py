@@ -83,7 +83,7 @@ class USBCdcDlDevice(USBCDCDevice):
             lines = self.receive_buffer.split(b'\r')
             self.receive_buffer = lines[-1]
             for l in lines[:-1]:
-                self.info('received line: %s' % l)
+                self.info('received line: %s', l)
 
     def handle_ep2_buffer_available(self):
         # send some junk
@@ -0,0 +1,406 @@
+'''
+Composite probe device.
+
+Combines the interfaces of several class devices into a single device,
+so the host support of all of them is tested in a single enumeration.
+
+Each function is the unmodified device of its class, its interfaces and
+endpoints are renumbered to fit in the composite configuration:
+
+- the endpoint numbers that the function uses when sending data are
+  translated by the PHY of the function
+- class and vendor requests reach the function with its own interface
+  and endpoint numbers in wIndex
+- class specific descriptors that refer to interface numbers (CDC union
+  and call management, audio control header) are updated
+- functions with more than one interface are grouped by an interface
+  association descriptor (IAD)
+
+Support is attributed to each function separately: a function is
+supported when it receives a class request, data on one of its
+endpoints, or when its own code reports it.
+'''
+import importlib
+import struct
+from numap.core.usb import DescriptorType, Request
+from numap.core.usb_class import USBClass
+from numap.core.usb_configuration import USBConfiguration
+from numap.core.usb_device import USBDevice
+from numap.core.usb_endpoint import USBEndpoint
+from numap.dev.cdc import FunctionalDescriptor
+
+#: highest endpoint number of the composite device
+MAX_ENDPOINT = 15
+
+#: number of endpoints of each class that can be part of a composite device,
+#: the other classes are bound by VID:PID, or need the whole device
+FUNCTION_ENDPOINTS = {
+    'audio': 2,
+    'cdc_acm': 3,
+    'cdc_dl': 3,
+    'keyboard': 1,
+    'mass_storage': 2,
+    'printer': 2,
+    'smartcard': 3,
+}
+
+# class specific interface descriptors with interface numbers
+AUDIO_SUBCLASS_AUDIOCONTROL = 0x01
+AUDIO_AC_HEADER = 0x01
+
+
+def probe_groups(classes, max_endpoint=MAX_ENDPOINT):
+    '''
+    Split the classes into composite devices
+
+    :param classes: names of the classes to test
+    :param max_endpoint: highest endpoint number of a composite device (default: MAX_ENDPOINT)
+    :return: tuple of (list of tuples of class names, one per composite device,
+        list of the classes that must be tested on their own)
+    '''
+    groups = []
+    group = []
+    endpoints = 0
+    single = []
+    for name in classes:
+        count = FUNCTION_ENDPOINTS.get(name)
+        if count is None or count > max_endpoint:
+            single.append(name)
+            continue
+        if endpoints + count > max_endpoint:
+            groups.append(tuple(group))
+            group = []
+            endpoints = 0
+        group.append(name)
+        endpoints += count
+    if group:
+        groups.append(tuple(group))
+    return groups, single
+
+
+class _FunctionApp(object):
+    '''
+    Application of a function: support is attributed to the function,
+    everything else is forwarded to the nümap application
+    '''
+
+    def __init__(self, app, function):
+        self._app = app
+        self._function = function
+
+    def usb_function_supported(self, reason=None):
+        self._function.supported(reason)
+
+    def __getattr__(self, name):
+        return getattr(self._app, name)
+
+
+class _FunctionPhy(object):
+    '''
+    PHY of a function: translates the IN endpoint numbers that the
+    function sends on, everything else is forwarded to the PHY
+    '''
+
+    def __init__(self, phy, function):
+        self._phy = phy
+        self._function = function
+
+    def send_on_endpoint(self, ep_num, data):
+        self._phy.send_on_endpoint(self._function.in_endpoints.get(ep_num, ep_num), data)
+
+    def disconnect(self):
+        # the composite device owns the connection
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._phy, name)
+
+
+class ProbeFunction(object):
+    '''
+    A class device, as a function of the composite device
+    '''
+
+    def __init__(self, app, phy, name):
+        '''
+        :param app: nümap application
+        :param phy: physical connection
+        :param name: name of the class (see NumapApp.umap_class_dict)
+        '''
+        self.name = name
+        self.logger = app.logger
+        self.reason = None
+        self.composite = None
+        # original IN endpoint number -> composite endpoint number
+        self.in_endpoints = {}
+        # composite interface number -> original one
+        self.interface_numbers = {}
+        # composite endpoint address -> original one
+        self.endpoint_addresses = {}
+        module = importlib.import_module('numap.dev.%s' % app.umap_class_dict[name][0])
+        self.device = module.usb_device(_FunctionApp(app, self), _FunctionPhy(phy, self))
+        self.interfaces = list(self.device.configurations[0].interfaces)
+
+    def supported(self, reason=None):
+        '''
+        Mark the function as supported by the host
+
+        :param reason: reason why we decided it is supported (default: None)
+        '''
+        if self.reason is not None:
+            return
+        self.reason = reason or 'supported'
+        self.logger.info('[ProbeFunction] %s is supported: %s', self.name, self.reason)
+        if self.composite is not None:
+            self.composite.function_supported(self)
+
+    def renumber(self, first_interface, first_endpoint):
+        '''
+        Move the interfaces and endpoints of the function
+
+        :param first_interface: composite number of the first interface
+        :param first_endpoint: composite number of the first endpoint
+        :return: tuple of (next free interface number, next free endpoint number)
+        '''
+        interfaces = {}
+        endpoints = {}
+        for interface in self.interfaces:
+            # alternate settings share the interface number
+            if interface.number not in interfaces:
+                interfaces[interface.number] = first_interface + len(interfaces)
+            for endpoint in interface.endpoints:
+                if endpoint.address not in endpoints:
+                    endpoints[endpoint.address] = first_endpoint + len(endpoints)
+        for interface in self.interfaces:
+            for cs in interface.cs_interfaces:
+                self._renumber_cs_interface(interface, cs, interfaces)
+            for endpoint in interface.endpoints:
+                number = endpoints[endpoint.address]
+                self.endpoint_addresses[number | (endpoint.direction << 7)] = endpoint.address
+                if endpoint.direction == USBEndpoint.direction_in:
+                    self.in_endpoints[endpoint.number] = number
+                endpoint.number = number
+                endpoint.address = number | (endpoint.direction << 7)
+            interface.number = interfaces[interface.number]
+        self.interface_numbers = {new: old for old, new in interfaces.items()}
+        return first_interface + len(interfaces), first_endpoint + len(endpoints)
+
+    def _renumber_cs_interface(self, interface, cs, interfaces):
+        config = bytearray(cs.cs_config)
+        if not config:
+            return
+        positions = []
+        if interface.iclass == USBClass.CDC:
+            if config[0] == FunctionalDescriptor.UN:
+                # master and slave interfaces
+                positions = range(1, len(config))
+            elif config[0] == FunctionalDescriptor.CM:
+                positions = [2]
+        elif interface.iclass == USBClass.Audio and interface.subclass == AUDIO_SUBCLASS_AUDIOCONTROL:
+            if config[0] == AUDIO_AC_HEADER:
+                # baInterfaceNr of the streaming interfaces
+                positions = range(6, len(config))
+        for i in positions:
+            if i < len(config) and config[i] in interfaces:
+                config[i] = interfaces[config[i]]
+        if positions:
+            cs.cs_config = bytes(config)
+
+    def original_index(self, recipient, index):
+        '''
+        :param recipient: recipient of the request
+        :param index: wIndex of the request, with composite numbers
+        :return: wIndex with the numbers of the function
+        '''
+        if recipient == Request.recipient_interface:
+            number = self.interface_numbers.get(index & 0xff, index & 0xff)
+            return (index & 0xff00) | number
+        if recipient == Request.recipient_endpoint:
+            address = self.endpoint_addresses.get(index & 0xff, index & 0xff)
+            return (index & 0xff00) | address
+        return index
+
+    def get_association_descriptor(self):
+        '''
+        :return: interface association descriptor, empty for single interface functions
+        '''
+        numbers = sorted(self.interface_numbers)
+        if len(numbers) < 2:
+            return b''
+        first = self.interfaces[0]
+        return struct.pack(
+            '<BBBBBBBB',
+            8,
+            DescriptorType.interface_association,
+            numbers[0],
+            len(numbers),
+            first.iclass,
+            first.subclass,
+            first.protocol,
+            0,
+        )
+
+    def disconnect(self):
+        try:
+            self.device.disconnect()
+        except Exception as e:
+            self.logger.error('[ProbeFunction] failed to disconnect %s: %s', self.name, e)
+
+
+class USBProbeConfiguration(USBConfiguration):
+    '''
+    Configuration with the interfaces of all the functions,
+    preceded by an IAD where needed
+    '''
+
+    def __init__(self, app, phy, functions):
+        self.functions = functions
+        super(USBProbeConfiguration, self).__init__(
+            app=app,
+            phy=phy,
+            index=1,
+            string='Probe configuration',
+            interfaces=[i for f in functions for i in f.interfaces],
+            attributes=USBConfiguration.ATTR_BASE,
+        )
+
+    def get_descriptor(self, usb_type='fullspeed', valid=False):
+        body = b''
+        for function in self.functions:
+            body += function.get_association_descriptor()
+            for interface in function.interfaces:
+                body += interface.get_descriptor(usb_type, valid)
+        descriptor = struct.pack(
+            '<BBHBBBBB',
+            9,
+            DescriptorType.configuration,
+            9 + len(body),
+            len(set(i.number for i in self.interfaces)),
+            self.index,
+            self.configuration_string_index,
+            self._get_configuration_attributes(),
+            self.max_power,
+        )
+        return descriptor + body
+
+
+class USBProbeDevice(USBDevice):
+    '''
+    Composite device that tests several classes at once
+    '''
+    name = 'ProbeDevice'
+
+    # miscellaneous device class, common class, interface association
+    DEVICE_CLASS = 0xef
+    DEVICE_SUBCLASS = 0x02
+    DEVICE_PROTOCOL = 0x01
+
+    def __init__(self, app, phy, classes, vid=0x1d6b, pid=0x0104, rev=0x0100, max_endpoint=MAX_ENDPOINT):
+        '''
+        :param app: nümap application
+        :param phy: physical connection
+        :param classes: names of the classes to combine (see probe_groups)
+        :param vid: vendor id (default: 0x1d6b)
+        :param pid: product id (default: 0x0104, multifunction composite gadget)
+        :param rev: device revision (default: 0x0100)
+        :param max_endpoint: highest endpoint number (default: MAX_ENDPOINT)
+        '''
+        self.functions = []
+        # classes whose device could not be created, to be tested on their own
+        self.failed_classes = []
+        for name in classes:
+            try:
+                self.functions.append(ProbeFunction(app, phy, name))
+            except Exception as e:
+                app.logger.error('Could not add %s to the probe device: %s' % (name, e))
+                self.failed_classes.append(name)
+        next_interface, next_endpoint = 0, 1
+        for function in self.functions:
+            next_interface, next_endpoint = function.renumber(next_interface, next_endpoint)
+        if next_endpoint - 1 > max_endpoint:
+            self._disconnect_functions()
+            raise ValueError('%d endpoints needed, the maximum is %d' % (next_endpoint - 1, max_endpoint))
+        # endpoint number -> function
+        self.endpoint_functions = [None] * 16
+        # interface number -> function
+        self.interface_functions = {}
+        for function in self.functions:
+            function.composite = self
+            for number in function.interface_numbers:
+                self.interface_functions[number] = function
+            for address in function.endpoint_addresses:
+                self.endpoint_functions[address & 0x0f] = function
+        self.was_configured = False
+        super(USBProbeDevice, self).__init__(
+            app=app,
+            phy=phy,
+            device_class=self.DEVICE_CLASS,
+            device_subclass=self.DEVICE_SUBCLASS,
+            protocol_rel_num=self.DEVICE_PROTOCOL,
+            max_packet_size_ep0=64,
+            vendor_id=vid,
+            product_id=pid,
+            device_rev=rev,
+            manufacturer_string='UMAP2',
+            product_string='UMAP2 Probe',
+            serial_number_string='UMAP2-PROBE',
+            configurations=[USBProbeConfiguration(app, phy, self.functions)],
+        )
+
+    def function_supported(self, function):
+        '''
+        Called when a function is supported, the test ends when all of them are
+        '''
+        if all(f.reason is not None for f in self.functions):
+            self.usb_function_supported('all functions supported')
+
+    def supported_functions(self):
+        '''
+        :return: dictionary of class name to the reason it is supported, None if it was not
+        '''
+        return {f.name: f.reason for f in self.functions}
+
+    def _resolve_request_handler(self, request_type, request, index):
+        handler, handled = super(USBProbeDevice, self)._resolve_request_handler(request_type, request, index)
+        recipient = request_type & 0x1f
+        req_type = (request_type >> 5) & 0x03
+        if handler is None or req_type == Request.type_standard:
+            return handler, handled
+        if recipient == Request.recipient_interface:
+            function = self.interface_functions.get(index & 0xff)
+        elif recipient == Request.recipient_endpoint:
+            function = self.endpoint_functions[index & 0x0f]
+        else:
+            function = None
+        if function is None or function.original_index(recipient, index) == index:
+            return handler, handled
+
+        def function_handler(req):
+            # the handler is shared by all the requests with the same interface / endpoint,
+            # the rest of wIndex comes from the request
+            req.index = function.original_index(recipient, req.index)
+            handler(req)
+        return function_handler, handled
+
+    def handle_set_configuration_request(self, req):
+        self.was_configured = True
+        super(USBProbeDevice, self).handle_set_configuration_request(req)
+
+    def handle_data_available(self, ep_num, data):
+        handler = self._endpoint_handlers[ep_num & 0x0f]
+        if handler is not None:
+            function = self.endpoint_functions[ep_num & 0x0f]
+            if function is not None:
+                function.supported('data received on endpoint %#x' % (ep_num))
+            handler(data)
+
+    def disconnect(self):
+        try:
+            super(USBProbeDevice, self).disconnect()
+        finally:
+            self._disconnect_functions()
+
+    def _disconnect_functions(self):
+        for function in self.functions:
+            function.disconnect()
+
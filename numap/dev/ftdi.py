@@ -52,9 +52,9 @@ class USBFtdiVendor(USBVendor):
         self.dtren = (req.value & 0x0100) >> 8
         self.rtsen = (req.value & 0x0200) >> 9
         if self.dtren:
-            self.info('DTR is enabled, value %d' % self.dtr)
+            self.info('DTR is enabled, value %d', self.dtr)
         if self.rtsen:
-            self.info('RTS is enabled, value %d' % self.rts)
+            self.info('RTS is enabled, value %d', self.rts)
         return b''
 
     @mutable('ftdi_set_flow_ctrl_response')
@@ -74,7 +74,7 @@ class USBFtdiVendor(USBVendor):
     def handle_set_baud_rate(self, req):
         self.dtr = req.value & 0x0001
         self.baudrate = req.value
-        self.info('baudrate set to: %#x dtr set to: %#x' % (self.baudrate, self.dtr))
+        self.info('baudrate set to: %#x dtr set to: %#x', self.baudrate, self.dtr)
         return b''
 
     @mutable('ftdi_set_data_response')
@@ -151,7 +151,7 @@ class USBFtdiInterface(USBInterface):
         self.txq = Queue()
 
     def handle_data_available(self, data):
-        self.debug('received string (%d): %s' % (len(data), data))
+        self.debug('received string (%d): %s', len(data), data)
         reply = b'\x01\x00' + data
         self.txq.put(reply)
 
@@ -24,6 +24,7 @@ from numap.core.usb_endpoint import USBEndpoint
 from numap.core.usb_class import USBClass
 from numap.core.usb_base import USBBaseActor
 from numap.fuzz.helpers import mutable
+from numap.utils.ulogger import LazyHex
 
 
 class ScsiCmds(object):
@@ -217,7 +218,7 @@ class ScsiDevice(USBBaseActor):
 
     def handle_write_data(self, data):
         self.write_data += data
-        self.debug('Got %#x bytes of SCSI write data, written so far: %#x' % (len(data), len(self.write_data)))
+        self.debug('Got %#x bytes of SCSI write data, written so far: %#x', len(data), len(self.write_data))
         if len(self.write_data) >= self.write_length:
             self.info('Got all write data')
             # done writing
@@ -228,7 +229,7 @@ class ScsiDevice(USBBaseActor):
 
     @mutable('scsi_inquiry_response')
     def handle_inquiry(self, cbw):
-        self.debug('SCSI Inquiry, data: %s' % cbw.cb[1:].hex())
+        self.debug('SCSI Inquiry, data: %s', LazyHex(cbw.cb[1:]))
         peripheral = 0x00  # SBC
         RMB = 0x80  # Removable
         version = 0x00
@@ -245,7 +246,7 @@ class ScsiDevice(USBBaseActor):
 
     @mutable('scsi_request_sense_response')
     def handle_request_sense(self, cbw):
-        self.debug('SCSI Request Sense, data: %s' % cbw.cb[1:].hex())
+        self.debug('SCSI Request Sense, data: %s', LazyHex(cbw.cb[1:]))
         response_code = 0x70
         valid = 0x00
         filemark = 0x06
@@ -271,12 +272,12 @@ class ScsiDevice(USBBaseActor):
 
     @mutable('scsi_test_unit_ready_response')
     def handle_test_unit_ready(self, cbw):
-        self.debug('SCSI Test Unit Ready, logical unit number: %02x' % (cbw.cb[1]))
+        self.debug('SCSI Test Unit Ready, logical unit number: %02x', cbw.cb[1])
 
     @mutable('scsi_read_capacity_10_response')
     def handle_read_capacity_10(self, cbw):
         # .. todo: is the length correct?
-        self.debug('SCSI Read Capacity(10), data: %s' % cbw.cb[1:].hex())
+        self.debug('SCSI Read Capacity(10), data: %s', LazyHex(cbw.cb[1:]))
         lastlba = self.disk_image.get_sector_count()
         length = self.disk_image.block_size
         response = struct.pack('>II', lastlba, length)
@@ -285,7 +286,7 @@ class ScsiDevice(USBBaseActor):
     @mutable('scsi_read_capacity_16_response')
     def handle_read_capacity_16(self, cbw):
         # .. todo: is the length correct?
-        self.debug('SCSI Read Capacity(16), data: %s' % cbw.cb[1:].hex())
+        self.debug('SCSI Read Capacity(16), data: %s', LazyHex(cbw.cb[1:]))
         lastlba = self.disk_image.get_sector_count()
         length = self.disk_image.block_size
         response = struct.pack('>BBQIBB', 0x9e, 0x10, lastlba, length, 0x00, 0x00)
@@ -301,23 +302,23 @@ class ScsiDevice(USBBaseActor):
 
     @mutable('scsi_write_10_response')
     def handle_write_10(self, cbw):
-        self.debug('SCSI Write (10), data: %s' % cbw.cb[1:].hex())
+        self.debug('SCSI Write (10), data: %s', LazyHex(cbw.cb[1:]))
 
         base_lba = struct.unpack('>I', cbw.cb[2:6])[0]
         num_blocks = struct.unpack('>H', cbw.cb[7:9])[0]
 
-        self.debug('SCSI Write (10), lba %#x + %#x block(s)' % (base_lba, num_blocks))
+        self.debug('SCSI Write (10), lba %#x + %#x block(s)', base_lba, num_blocks)
 
         # save for later
         self.write_cbw = cbw
         self.write_base_lba = base_lba
         self.write_length = num_blocks * self.disk_image.block_size
-        self.debug('SCSI Write (10) total expected length: %#x' % (self.write_length))
+        self.debug('SCSI Write (10) total expected length: %#x', self.write_length)
         self.is_write_in_progress = True
 
     def handle_read_10(self, cbw):
         base_lba, group, num_blocks = struct.unpack('>IBH', cbw.cb[2:9])
-        self.debug('SCSI Read (10), lba %#x + %#x block(s)' % (base_lba, num_blocks))
+        self.debug('SCSI Read (10), lba %#x + %#x block(s)', base_lba, num_blocks)
         for block_num in range(num_blocks):
             data = self.disk_image.get_sector_data(base_lba + block_num)
             self.tx.put(data)
@@ -367,7 +368,7 @@ class ScsiDevice(USBBaseActor):
 
     def handle_scsi_mode_sense(self, mode_type, page, subpage, alloc_len, ctrl, with_header=True):
         # .. todo: implement response for unsupported pages
-        self.debug('SCSI Mode Sense(%d), page %#x subpage %#x' % (mode_type, page, subpage))
+        self.debug('SCSI Mode Sense(%d), page %#x subpage %#x', mode_type, page, subpage)
         report = None
         # wish there was a switch :(
         if page == 0x1c:
@@ -391,7 +392,7 @@ class ScsiDevice(USBBaseActor):
             # this should probably be changed ...
             report = b'\x07\x00\x00\x00\x00\x00\x00\x00'
         if with_header:
-            self.debug('SCSI mode sense (%d) - adding header' % (mode_type))
+            self.debug('SCSI mode sense (%d) - adding header', mode_type)
             report = self._report_header(mode_type, len(report)) + report
         return report
 
@@ -501,7 +502,7 @@ class USBMassStorageInterface(USBInterface):
             self.send_on_endpoint(3, data)
 
     def handle_data_available(self, data):
-        self.debug('handling %d bytes of SCSI data' % (len(data)))
+        self.debug('handling %d bytes of SCSI data', len(data))
         self.scsi_device.rx.put(data)
 
 
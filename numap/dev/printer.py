@@ -124,9 +124,9 @@ class USBPrinterInterface(USBInterface):
     @mutable('handle_data_available')
     def handle_data_available(self, data):
         if not self.writing:
-            self.info('Writing PCL file: %s' % self.filename)
+            self.info('Writing PCL file: %s', self.filename)
 
-        with open(self.filename, b'ab') as out_file:
+        with open(self.filename, 'ab') as out_file:
             self.writing = True
             out_file.write(data)
 
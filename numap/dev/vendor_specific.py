@@ -38,6 +38,8 @@ class USBVendorSpecificClass(USBClass):
 class USBVendorSpecificInterface(USBInterface):
     name = 'VendorSpecificInterface'
 
+    descriptor_attributes = USBInterface.descriptor_attributes | frozenset(['virtual_endpoints'])
+
     def __init__(self, app, phy, num=0, interface_alternate=0, endpoints=[]):
         # TODO: un-hardcode string index
         super(USBVendorSpecificInterface, self).__init__(
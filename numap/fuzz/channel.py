@@ -0,0 +1,314 @@
+'''
+Control channel between numapkitty (the fuzzer) and numapfuzz (the
+emulated device), over a Unix domain socket.
+
+The fuzzer side (ControlServer) listens on the socket and sends
+commands, the device side (ControlClient) connects to it, executes the
+commands and acknowledges them. Messages are text lines:
+
+- ``connect <seq>`` / ``disconnect <seq>``: server to client, the
+  client connects / disconnects the device
+- ``ack <seq>``: client to server, command <seq> was executed
+- ``heartbeat``: client to server, the device side is alive
+
+Both sides read the socket in a background thread, so they can wait
+for a message without polling.
+'''
+import collections
+import logging
+import os
+import socket
+import threading
+import time
+
+DEFAULT_SOCKET_PATH = '/tmp/umap_kitty/control.sock'
+
+CONNECT = 'connect'
+DISCONNECT = 'disconnect'
+ACK = 'ack'
+HEARTBEAT = 'heartbeat'
+
+# seconds between warnings while waiting for the other side
+WARNING_INTERVAL = 10.0
+
+
+def _read_messages(conn):
+    '''
+    :param conn: connected socket
+    :return: generator of the messages (lines) received, ends when the connection is closed
+    '''
+    with conn.makefile('rb') as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line.decode('ascii', 'replace')
+        except (OSError, ValueError):
+            # closed while reading
+            return
+
+
+class ControlServer(object):
+    '''
+    Fuzzer side of the control channel
+    '''
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, logger=None):
+        '''
+        :param path: path of the socket (default: DEFAULT_SOCKET_PATH)
+        :param logger: logger (default: numap logger)
+        '''
+        self.path = path
+        self.logger = logger or logging.getLogger('numap')
+        #: time (time.time()) of the last heartbeat, 0 if none was received
+        self.last_heartbeat = 0
+        self._sock = None
+        self._conn = None
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._acked = 0
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        if os.path.exists(self.path):
+            # left by a previous run
+            os.remove(self.path)
+        self._stopped = False
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        self._sock.listen(1)
+        self._thread = threading.Thread(target=self._serve, name='numap-control')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        with self._cond:
+            conn, self._conn = self._conn, None
+            self._cond.notify_all()
+        for sock in (conn, self._sock):
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                sock.close()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def is_connected(self):
+        return self._conn is not None
+
+    def _serve(self):
+        while not self._stopped:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            self.logger.info('[ControlServer] device side connected')
+            with self._cond:
+                if self._conn is not None:
+                    self._conn.close()
+                self._conn = conn
+                self._cond.notify_all()
+            for message in _read_messages(conn):
+                if message == HEARTBEAT:
+                    self.last_heartbeat = time.time()
+                    continue
+                fields = message.split()
+                if len(fields) == 2 and fields[0] == ACK and fields[1].isdigit():
+                    with self._cond:
+                        self._acked = max(self._acked, int(fields[1]))
+                        self._cond.notify_all()
+                else:
+                    self.logger.warning('[ControlServer] unexpected message: %r', message)
+            with self._cond:
+                if self._conn is conn:
+                    self._conn = None
+                    self._cond.notify_all()
+            conn.close()
+            if not self._stopped:
+                self.logger.warning('[ControlServer] device side disconnected')
+
+    def send_command(self, command, timeout=None):
+        '''
+        Send a command and wait until it is acknowledged.
+        If the device side is not connected, or reconnects before
+        acknowledging, the command is sent when it connects.
+
+        :param command: CONNECT or DISCONNECT
+        :param timeout: seconds to wait for the acknowledgement, None to wait forever (default: None)
+        :return: whether the command was acknowledged
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        next_warning = time.monotonic() + WARNING_INTERVAL
+        with self._cond:
+            self._seq += 1
+            seq = self._seq
+            sent_on = None
+            while self._acked < seq and not self._stopped:
+                conn = self._conn
+                if conn is not None and conn is not sent_on:
+                    try:
+                        conn.sendall(('%s %d\n' % (command, seq)).encode('ascii'))
+                        sent_on = conn
+                    except OSError:
+                        self._conn = None
+                        continue
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    return False
+                if now >= next_warning:
+                    self.logger.warning('[ControlServer] still waiting for the device side to %s', command)
+                    next_warning = now + WARNING_INTERVAL
+                wait = next_warning - now
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                self._cond.wait(wait)
+            return self._acked >= seq
+
+
+class ControlClient(object):
+    '''
+    Device side of the control channel
+    '''
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, logger=None):
+        '''
+        :param path: path of the socket (default: DEFAULT_SOCKET_PATH)
+        :param logger: logger (default: numap logger)
+        '''
+        self.path = path
+        self.logger = logger or logging.getLogger('numap')
+        self._sock = None
+        self._send_lock = threading.Lock()
+        # (command, seq) tuples, appended by the reader thread
+        self._commands = collections.deque()
+        self._event = threading.Event()
+        self._closed = True
+        self._thread = None
+
+    def connect(self, timeout=None, retry_interval=0.1):
+        '''
+        Connect to the fuzzer side, retrying until it listens
+
+        :param timeout: seconds to keep trying, None to try forever (default: None)
+        :param retry_interval: seconds between attempts (default: 0.1)
+        :return: whether connected
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        next_warning = time.monotonic() + WARNING_INTERVAL
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                break
+            except OSError:
+                sock.close()
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return False
+            if now >= next_warning:
+                self.logger.warning('[ControlClient] waiting for the fuzzer control socket %s', self.path)
+                next_warning = now + WARNING_INTERVAL
+            time.sleep(retry_interval)
+        self._sock = sock
+        self._closed = False
+        self._thread = threading.Thread(target=self._read, name='numap-control')
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def reconnect(self, timeout=None):
+        '''
+        Connect again, after the fuzzer side exited or restarted.
+        Commands that were not acknowledged are dropped, the fuzzer side
+        sends them again when the client connects.
+
+        :param timeout: seconds to keep trying, None to try forever (default: None)
+        :return: whether connected
+        '''
+        self.close()
+        self._commands.clear()
+        return self.connect(timeout)
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _read(self):
+        for message in _read_messages(self._sock):
+            fields = message.split()
+            if len(fields) == 2 and fields[0] in (CONNECT, DISCONNECT) and fields[1].isdigit():
+                self._commands.append((fields[0], int(fields[1])))
+                self._event.set()
+            else:
+                self.logger.warning('[ControlClient] unexpected message: %r', message)
+        self._closed = True
+        # release the waiters
+        self._event.set()
+        self.logger.warning('[ControlClient] fuzzer side disconnected')
+
+    def poll(self):
+        '''
+        :return: the next command as a (command, seq) tuple, None if there is none
+        '''
+        if self._commands:
+            return self._commands.popleft()
+        return None
+
+    def wait_command(self, timeout=None):
+        '''
+        Wait for the next command
+
+        :param timeout: seconds to wait, None to wait forever (default: None)
+        :return: the next command as a (command, seq) tuple,
+            None on timeout or if the channel was closed
+        '''
+        while True:
+            if self._commands:
+                return self._commands.popleft()
+            self._event.clear()
+            # a command may have arrived before the event was cleared
+            if self._commands:
+                return self._commands.popleft()
+            if self._closed or not self._event.wait(timeout):
+                return None
+
+    def ack(self, seq):
+        '''
+        :param seq: sequence number of the executed command
+        '''
+        self._send('%s %d\n' % (ACK, seq))
+
+    def heartbeat(self):
+        self._send(HEARTBEAT + '\n')
+
+    def _send(self, message):
+        sock = self._sock
+        if sock is None or self._closed:
+            return
+        with self._send_lock:
+            try:
+                sock.sendall(message.encode('ascii'))
+            except OSError:
+                self._closed = True
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 '''
 Usage:
-    numapkitty -s <stage-file> [-d <pre,post>] [-c <count>] [-k <options>]
+    numapkitty -s <stage-file> [-d <pre,post>] [-c <count>] [-k <options>] [--control=<socket>]
 
 Options:
     -c --count <count>                  stage count (e.g. how many times a stage might repeat
@@ -10,7 +10,10 @@ Options:
                                         disconnecting the device (might be necessary in order for
                                         failures to be matched with the correct test) [default: 0.0,0.0]
     -k --kitty-options <options>        options for the kitty fuzzer, use -k -h to get a full list
+    --control <socket>                  control socket, numapfuzz connects to it
+                                        [default: /tmp/umap_kitty/control.sock]
     -s --stage-file <stage-file>        path to stage trace from umap emulation run
+                                        (plain or run-length encoded, see numap.fuzz.stages)
 '''
 import docopt
 from kitty.remote.rpc import RpcServer
@@ -23,7 +26,9 @@ from kitty.model import Template, Meta, String, UInt32
 from numap.fuzz.templates import audio, cdc, enum, generic, hid, hub, mass_storage
 from numap.fuzz.templates import smart_card
 
+from numap.fuzz.channel import DEFAULT_SOCKET_PATH
 from numap.fuzz.controller import UmapController
+from numap.fuzz.stages import get_stages
 
 
 def enumerate_templates(module):
@@ -47,21 +52,6 @@ def enumerate_templates(module):
     return templates
 
 
-def get_stages(stage_file):
-    '''
-    Get a dictionary (stage:count) from a stage file
-
-    :param stage_file: filename with stage list (generated by numapstages)
-    :return: dictionary of stage:count
-    '''
-    with open(stage_file, 'r') as f:
-        stages = [l.rstrip() for l in f.readlines()]
-    stage_count = {}
-    for stage in stages:
-        stage_count[stage] = stages.count(stage)
-    return stage_count
-
-
 def add_stage(g, stage, template, count):
     '''
     Add a stage to the session graph
@@ -131,6 +121,28 @@ def get_model(options):
     return g
 
 
+class NumapFuzzer(ClientFuzzer):
+    '''
+    Client fuzzer that also tells numapfuzz which stages it may mutate
+    in the current test, so it does not need an RPC round trip for the
+    other stages while the host waits for a response
+    '''
+
+    def get_stage_plan(self):
+        '''
+        Called (over RPC) by numapfuzz when it connects the device for a test.
+
+        :return: names of the stages on the fuzz path of the current test,
+            None if they are not known
+        '''
+        try:
+            sequence = self.model.get_sequence()
+        except Exception:
+            self.logger.warning('no stage plan for the current test')
+            return None
+        return sorted(set(edge.dst.get_name() for edge in sequence))
+
+
 def get_controller(options):
     '''
     Get the controller
@@ -144,7 +156,7 @@ def get_controller(options):
     except ValueError:
         msg = 'Please specify the --disconnect_delays as two comma-separated floats'
         raise Exception(msg)
-    return UmapController(pre_disconnect_delay, post_disconnect_delay)
+    return UmapController(pre_disconnect_delay, post_disconnect_delay, options['--control'])
 
 
 def get_fuzzer(options=None):
@@ -158,10 +170,11 @@ def get_fuzzer(options=None):
         '--kitty-options': None,
         '--stage-file': None,
         '--count': '2',
-        '--disconnect-delays': '0.0,0.0'
+        '--disconnect-delays': '0.0,0.0',
+        '--control': DEFAULT_SOCKET_PATH,
     }
     local_options.update(options)
-    fuzzer = ClientFuzzer(name='numap', option_line=local_options['--kitty-options'])
+    fuzzer = NumapFuzzer(name='numap', option_line=local_options['--kitty-options'])
     fuzzer.set_interface(WebInterface())
 
     target = ClientTarget(name='USBTarget')
@@ -2,28 +2,120 @@
 This module contains helpers for fuzzing
 '''
 
+import collections
 import traceback
 import binascii
 import inspect
+import threading
+import time
+from numap.utils.ulogger import LazyHex
 
 
 class StageLogger(object):
+    '''
+    Record the stages that are reached during an emulation (see numapstages).
+
+    Stages are buffered in memory and written to the file by a background
+    thread (and when the recording stops), so recording does not slow down
+    the responses. Each line of the file is::
+
+        <stage> <time> [<bmRequestType> <bRequest> <wValue> <wLength>]
 
-    def __init__(self, filename):
+    time is in seconds from the start of the recording (monotonic clock),
+    the request fields (hex) are those of the control request that the stage
+    responds to, they are omitted for stages outside of control requests.
+    Lines that start with '#' mark the start of an attach cycle (see new_cycle).
+    '''
+
+    def __init__(self, filename, flush_interval=0.5):
+        '''
+        :param filename: stage file name
+        :param flush_interval: seconds between writes of the buffered stages (default: 0.5)
+        '''
         self.filename = filename
+        self.flush_interval = flush_interval
         self.fd = None
+        # control request that is currently handled (see set_stage_request)
+        self.request = None
+        # stage:count of the current cycle
+        self.counts = {}
+        # monotonic time of the last stage of the current cycle
+        self.last_stage_time = None
+        self._pending = collections.deque()
+        self._start = None
+        self._write_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
 
     def start(self):
         self.fd = open(self.filename, 'wb')
+        self._start = time.monotonic()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name='numap-stages')
+        self._thread.daemon = True
+        self._thread.start()
 
     def stop(self):
-        if self.fd:
-            self.fd.close()
+        '''
+        Write the buffered stages and close the file
+        '''
+        if self.fd is None:
+            return
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.fd.close()
+        self.fd = None
 
     def log_stage(self, stage):
         if self.fd:
-            self.fd.write(stage + '\n')
-            self.fd.flush()
+            now = time.monotonic()
+            self._pending.append((stage, now, self.request))
+            self.last_stage_time = now
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def new_cycle(self, name):
+        '''
+        Start a new attach cycle
+
+        :param name: name of the cycle, written to the file
+        :return: stage:count of the previous cycle
+        '''
+        counts = self.counts
+        self.counts = {}
+        self.last_stage_time = None
+        if self.fd:
+            self._pending.append((None, time.monotonic(), name))
+        return counts
+
+    def flush(self):
+        '''
+        Write the buffered stages
+        '''
+        with self._write_lock:
+            lines = []
+            pending = self._pending
+            while pending:
+                stage, timestamp, request = pending.popleft()
+                if stage is None:
+                    # start of a cycle, request is its name
+                    lines.append('# %s %.6f\n' % (request, timestamp - self._start))
+                    continue
+                line = '%s %.6f' % (stage, timestamp - self._start)
+                if request is not None:
+                    line += ' %02x %02x %04x %04x' % (
+                        request.request_type, request.request, request.value, request.length
+                    )
+                lines.append(line + '\n')
+            if lines and self.fd:
+                self.fd.write(''.join(lines).encode('utf-8'))
+                self.fd.flush()
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
 
 
 stage_logger = StageLogger('dummy')
@@ -37,11 +129,48 @@ def set_stage_logger(logger):
     stage_logger = logger
 
 
+def set_stage_request(request):
+    '''
+    Set the control request that the next stages respond to
+
+    :param request: the control request, None when it was handled
+    '''
+    stage_logger.request = request
+
+
 def log_stage(stage):
     global stage_logger
     stage_logger.log_stage(stage)
 
 
+def fuzzing_active(app):
+    '''
+    Whether a fuzzer is attached to the application is resolved once,
+    on the first call, and stored in app.fuzz_path_enabled.
+    Use set_fuzz_path to change it at runtime.
+
+    :param app: nümap application
+    :return: whether responses may currently be mutated or recorded as stages
+    '''
+    if stage_logger.fd is not None:
+        return True
+    enabled = getattr(app, 'fuzz_path_enabled', None)
+    if enabled is None:
+        enabled = getattr(app, 'fuzzer', None) is not None
+        app.fuzz_path_enabled = enabled
+    return enabled
+
+
+def set_fuzz_path(app, enabled=True):
+    '''
+    Enable (or disable) the full fuzzing path of @mutable for an application.
+
+    :param app: nümap application
+    :param enabled: whether to query the application for mutations (default: True)
+    '''
+    app.fuzz_path_enabled = enabled
+
+
 def mutable(stage, silent=False):
     def wrap_f(func):
         func_self = None
@@ -56,6 +185,8 @@ def mutable(stage, silent=False):
                 args = tuple(args[1:])
             else:
                 self = func_self
+            if not fuzzing_active(self.app):
+                return func(self, *args, **kwargs)
             response = None
             valid_req = kwargs.get('valid', False)
             info = self.info if not silent else self.debug
@@ -68,19 +199,19 @@ def mutable(stage, silent=False):
             try:
                 if response is not None:
                     if not silent:
-                        info('Got mutation for stage %s' % stage)
+                        info('Got mutation for stage %s', stage)
                 else:
                     if valid_req:
-                        info('Calling %s' % (func.__name__))
+                        info('Calling %s', func.__name__)
                     else:
-                        info('Calling %s (stage: "%s")' % (func.__name__, stage))
+                        info('Calling %s (stage: "%s")', func.__name__, stage)
                     response = func(self, *args, **kwargs)
             except Exception as e:
                 self.logger.error(traceback.format_exc())
                 self.logger.error(''.join(traceback.format_stack()))
                 raise e
             if response is not None:
-                info('Response: %s' % response.hex())
+                info('Response: %s', LazyHex(response))
             return response
         return wrapper
     return wrap_f
@@ -0,0 +1,151 @@
+'''
+Stage files, written by numapstages and read by numapkitty.
+
+Both formats are text, with one entry per line:
+
+- plain: one stage name per line, in the order the stages were reached.
+  Anything after the stage name is ignored.
+- run-length encoded: starts with the line ``#numap-stages rle``,
+  followed by one run per line::
+
+    <stage> <count> [<time> [<gap>]]
+
+  count is the number of consecutive occurrences of the stage,
+  time is the time of the first one, in seconds from the start of the
+  recording, and gap is the time since the previous run ended.
+
+Empty lines, and lines that start with '#', are ignored.
+Files are read line by line, so big recordings are never held in memory.
+'''
+import collections
+
+RLE_HEADER = '#numap-stages rle'
+
+StageRun = collections.namedtuple('StageRun', ['stage', 'count', 'time', 'gap'])
+
+
+def _parse_run(fields):
+    count = int(fields[1])
+    if count < 1:
+        raise ValueError('stage count must be positive')
+    time = float(fields[2]) if len(fields) > 2 else None
+    gap = float(fields[3]) if len(fields) > 3 else None
+    return StageRun(fields[0], count, time, gap)
+
+
+def iter_stage_runs(lines, name='<stages>'):
+    '''
+    :param lines: iterable of the lines of a stage file (e.g. the open file)
+    :param name: name of the file, for error messages (default: '<stages>')
+    :raises ValueError: if a run of a run-length encoded file is invalid
+    :return: generator of StageRun, time and gap are None for plain files
+    '''
+    rle = None
+    stage = None
+    count = 0
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if rle is None and line:
+            rle = line == RLE_HEADER
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split()
+        if rle:
+            try:
+                yield _parse_run(fields)
+            except (IndexError, ValueError):
+                raise ValueError('invalid stage run in %s, line %d: %r' % (name, line_number, line))
+        elif fields[0] == stage:
+            count += 1
+        else:
+            if stage is not None:
+                yield StageRun(stage, count, None, None)
+            stage = fields[0]
+            count = 1
+    if stage is not None:
+        yield StageRun(stage, count, None, None)
+
+
+def count_stages(runs):
+    '''
+    :param runs: iterable of StageRun
+    :return: dictionary of stage:count, in the order the stages were first reached
+    '''
+    stage_count = {}
+    for run in runs:
+        stage_count[run.stage] = stage_count.get(run.stage, 0) + run.count
+    return stage_count
+
+
+def get_stages(stage_file):
+    '''
+    Get a dictionary (stage:count) from a stage file
+
+    :param stage_file: filename with stage list (generated by numapstages)
+    :return: dictionary of stage:count, in the order the stages were first reached
+    '''
+    with open(stage_file, 'r') as f:
+        return count_stages(iter_stage_runs(f, stage_file))
+
+
+def encode_runs(stages):
+    '''
+    :param stages: iterable of stage names, or of (stage, time) tuples
+    :return: generator of StageRun
+    '''
+    run = None
+    last_time = None
+    for stage in stages:
+        time = None
+        if isinstance(stage, tuple):
+            stage, time = stage
+        if run is not None and run.stage == stage:
+            run = run._replace(count=run.count + 1)
+        else:
+            if run is not None:
+                yield run
+            gap = None if time is None or last_time is None else time - last_time
+            run = StageRun(stage, 1, time, gap)
+        last_time = time
+    if run is not None:
+        yield run
+
+
+def write_stage_runs(f, runs):
+    '''
+    Write a run-length encoded stage file
+
+    :param f: file object, opened for writing text
+    :param runs: iterable of StageRun
+    '''
+    f.write(RLE_HEADER + '\n')
+    for run in runs:
+        line = '%s %d' % (run.stage, run.count)
+        if run.time is not None:
+            line += ' %.6f' % run.time
+            if run.gap is not None:
+                line += ' %.6f' % run.gap
+        f.write(line + '\n')
+
+
+class StagePlan(object):
+    '''
+    Stages that the fuzzer may mutate in the current test (see
+    NumapFuzzer.get_stage_plan). The fuzzer only mutates a stage that
+    is on the fuzz path of the test, so the device side does not need
+    to ask it about the other stages.
+    '''
+
+    def __init__(self, stages=None):
+        '''
+        :param stages: names of the stages that may be mutated,
+            None if they are not known (default: None)
+        '''
+        self.stages = None if stages is None else frozenset(stages)
+
+    def may_mutate(self, stage):
+        '''
+        :param stage: stage name
+        :return: whether the fuzzer may return a mutation for the stage
+        '''
+        return self.stages is None or stage in self.stages
@@ -0,0 +1,338 @@
+"""In-process virtual USB host, used to exercise nümap devices without hardware."""
+
+from __future__ import annotations
+
+import collections
+import struct
+import time
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from numap.core.usb import DescriptorType, State
+from numap.core.usb_class import USBClass
+from numap.core.usb_endpoint import USBEndpoint
+from numap.phy.iphy import PhyInterface
+
+
+class HostOS(object):
+    """Enumeration styles of the simulated host."""
+
+    linux = 'linux'
+    windows = 'windows'
+
+
+class VirtualHostPhy(PhyInterface):
+    """
+    Physical layer that plays the role of the USB host.
+
+    Each call to :meth:`service_irqs` performs a single host transaction
+    (a control transfer, a bulk/interrupt packet or a poll of an IN endpoint).
+    The sequence is a full enumeration, in the style of the selected host OS,
+    followed by class specific traffic (SCSI over bulk-only transport for
+    mass storage, CCID for smartcards) and polling of the IN endpoints.
+
+    Counters of the traffic are kept in :attr:`stats`.
+    """
+
+    # bulk-only transport signatures
+    CBW_SIGNATURE = 0x43425355
+    CSW_SIGNATURE = b'USBS'
+
+    def __init__(
+        self, app: Any, host_os: str = HostOS.linux, poll_count: int = 4,
+        read_blocks: int = 8, response_timeout: float = 1.0,
+    ) -> None:
+        """
+        :param app: nümap application
+        :param host_os: enumeration style, ``linux`` or ``windows`` (default: linux)
+        :param poll_count: number of polls of each IN endpoint after class traffic (default: 4)
+        :param read_blocks: number of blocks to read from mass storage devices (default: 8)
+        :param response_timeout: seconds to wait for bulk responses (default: 1.0)
+        """
+        super(VirtualHostPhy, self).__init__(app, 'VirtualHost')
+        if host_os not in (HostOS.linux, HostOS.windows):
+            raise ValueError('unsupported host os: %s' % host_os)
+        self.host_os = host_os
+        self.poll_count = poll_count
+        self.read_blocks = read_blocks
+        self.response_timeout = response_timeout
+        self.device = None
+        self.connected = False
+        self.done = False
+        self.stats: Dict[str, int] = collections.Counter()
+        self.device_descriptor: Optional[bytes] = None
+        self.configuration_descriptor: Optional[bytes] = None
+        self.strings: Dict[int, bytes] = {}
+        self._received: Dict[int, Deque[bytes]] = collections.defaultdict(collections.deque)
+        self._stalled = False
+        self._steps: Optional[Iterator[None]] = None
+        self._cbw_tag = 0
+
+    # facedancer-like interface, used by USBDevice
+
+    def connect(self, device: Any, *args: Any, **kwargs: Any) -> None:
+        """Attach *device* to the virtual host and restart the host sequence."""
+        self.device = device
+        self.connected = True
+        self.done = False
+        self._received.clear()
+        self._steps = self.host_sequence()
+
+    def disconnect(self) -> None:
+        """Detach the device."""
+        self.connected = False
+        self._steps = None
+
+    def send_on_endpoint(self, ep_num: int, data: bytes) -> None:
+        """Receive *data* sent by the device on endpoint ``ep_num``."""
+        data = bytes(data)
+        self._received[ep_num].append(data)
+        self.stats['packets_in'] += 1
+        self.stats['bytes_in'] += len(data)
+
+    def stall_ep0(self) -> None:
+        """Record a stall of the current control transfer."""
+        self._stalled = True
+        self.stats['stalls'] += 1
+
+    def ack_status_stage(self, *args: Any, **kwargs: Any) -> None:
+        """Status stages need no handling in the virtual host."""
+
+    def service_irqs(self) -> bool:
+        """
+        Perform the next host transaction.
+
+        :return: False when the host sequence is over
+        """
+        if self._steps is None or self.done:
+            return False
+        try:
+            next(self._steps)
+        except StopIteration:
+            self.done = True
+            return False
+        return True
+
+    def run(self) -> None:
+        """Run the host sequence until it is over or the application stops it."""
+        while self.connected and not self.app.should_stop_phy():
+            if not self.service_irqs():
+                break
+
+    # host transactions
+
+    def control_transfer(
+        self, request_type: int, request: int, value: int = 0, index: int = 0,
+        length: int = 0, data: bytes = b'',
+    ) -> Optional[bytes]:
+        """
+        Send a setup packet (and OUT data stage) to the device.
+
+        :return: data of the IN stage, or None if the device stalled
+        """
+        ep0 = self._received[0]
+        ep0.clear()
+        self._stalled = False
+        setup = struct.pack('<BBHHH', request_type, request, value, index, length or len(data))
+        self.stats['control_requests'] += 1
+        self.device.handle_request(setup + data)
+        if self._stalled:
+            ep0.clear()
+            return None
+        response = b''.join(ep0)
+        ep0.clear()
+        return response
+
+    def get_descriptor(
+        self, dtype: int, dindex: int, length: int, index: int = 0, recipient: int = 0,
+    ) -> Optional[bytes]:
+        return self.control_transfer(0x80 | recipient, 0x06, (dtype << 8) | dindex, index, length)
+
+    def bulk_out(self, ep_num: int, data: bytes) -> None:
+        """Send *data* to OUT endpoint ``ep_num``."""
+        self.stats['packets_out'] += 1
+        self.stats['bytes_out'] += len(data)
+        self.device.handle_data_available(ep_num, data)
+
+    def poll_in(self, ep_num: int) -> Optional[bytes]:
+        """
+        Give the device a chance to send on IN endpoint ``ep_num``.
+
+        :return: the oldest packet received on the endpoint, or None
+        """
+        received = self._received[ep_num]
+        if not received:
+            self.stats['polls'] += 1
+            self.device.handle_buffer_available(ep_num)
+        if received:
+            return received.popleft()
+        return None
+
+    def wait_in(self, ep_num: int) -> Optional[bytes]:
+        """
+        Poll IN endpoint ``ep_num`` until the device sends a packet
+        or the response timeout expires.
+        """
+        deadline = time.monotonic() + self.response_timeout
+        while True:
+            data = self.poll_in(ep_num)
+            if data is not None or time.monotonic() > deadline:
+                return data
+            time.sleep(0)
+
+    # host sequences
+
+    def host_sequence(self) -> Iterator[None]:
+        """Generator of the host transactions, one per step."""
+        if self.host_os == HostOS.windows:
+            yield from self.enumerate_windows()
+        else:
+            yield from self.enumerate_linux()
+        if self.device.state != State.configured:
+            return
+        for interface in self.active_interfaces():
+            if interface.iclass == USBClass.MassStorage and interface.protocol == 0x50:
+                yield from self.mass_storage_traffic(interface)
+            elif interface.iclass == USBClass.SmartCard:
+                yield from self.ccid_traffic(interface)
+            yield from self.poll_endpoints(interface)
+
+    def enumerate_linux(self) -> Iterator[None]:
+        """Enumeration as done by the Linux hub driver."""
+        # first read of the device descriptor uses the 64 bytes default
+        yield self.get_descriptor(DescriptorType.device, 0, 64)
+        yield self.control_transfer(0x00, 0x05, 1)
+        self.device_descriptor = self.get_descriptor(DescriptorType.device, 0, 18)
+        yield
+        yield from self._read_configuration(9)
+        yield from self._read_strings(0xff)
+        yield from self._set_configuration()
+
+    def enumerate_windows(self) -> Iterator[None]:
+        """Enumeration as done by the Windows USB stack."""
+        yield self.get_descriptor(DescriptorType.device, 0, 64)
+        yield self.control_transfer(0x00, 0x05, 1)
+        self.device_descriptor = self.get_descriptor(DescriptorType.device, 0, 18)
+        yield
+        yield from self._read_configuration(0xff)
+        yield self.get_descriptor(DescriptorType.device_qualifier, 0, 10)
+        yield from self._read_strings(0xff)
+        # Microsoft OS string descriptor
+        yield self.get_descriptor(DescriptorType.string, 0xee, 0x12)
+        yield from self._read_configuration(9)
+        yield from self._set_configuration()
+
+    def _read_configuration(self, first_length: int) -> Iterator[None]:
+        config = self.get_descriptor(DescriptorType.configuration, 0, first_length)
+        yield
+        if config and len(config) >= 4:
+            total_length = struct.unpack('<H', config[2:4])[0]
+            if total_length > len(config):
+                config = self.get_descriptor(DescriptorType.configuration, 0, total_length)
+                yield
+        self.configuration_descriptor = config
+
+    def _read_strings(self, length: int) -> Iterator[None]:
+        string0 = self.get_descriptor(DescriptorType.string, 0, length)
+        yield
+        if not string0 or len(string0) < 4:
+            return
+        langid = struct.unpack('<H', string0[2:4])[0]
+        device_descriptor = self.device_descriptor or b''
+        string_ids = device_descriptor[14:17] if len(device_descriptor) >= 17 else b''
+        for string_id in string_ids:
+            if string_id and string_id not in self.strings:
+                self.strings[string_id] = self.get_descriptor(DescriptorType.string, string_id, length, langid)
+                yield
+
+    def _set_configuration(self) -> Iterator[None]:
+        config = self.configuration_descriptor
+        value = config[5] if config and len(config) > 5 else 1
+        yield self.control_transfer(0x00, 0x09, value)
+
+    def active_interfaces(self) -> List[Any]:
+        """:return: interfaces of the current configuration, in their default alternate setting"""
+        configuration = self.device.configuration
+        if configuration is None:
+            return []
+        return [i for i in configuration.interfaces if i.alternate == 0]
+
+    def find_endpoint(self, interface: Any, direction: int, transfer_type: int) -> Optional[Any]:
+        """:return: first endpoint of *interface* with the given direction and type, or None"""
+        for e in interface.endpoints:
+            if e.direction == direction and e.transfer_type == transfer_type:
+                return e
+        return None
+
+    def poll_endpoints(self, interface: Any) -> Iterator[None]:
+        """Poll bulk and interrupt IN endpoints of *interface*."""
+        for e in interface.endpoints:
+            if e.direction != USBEndpoint.direction_in:
+                continue
+            if e.transfer_type not in (USBEndpoint.transfer_type_bulk, USBEndpoint.transfer_type_interrupt):
+                continue
+            for _ in range(self.poll_count):
+                yield self.poll_in(e.number)
+
+    def mass_storage_traffic(self, interface: Any) -> Iterator[None]:
+        """SCSI commands over bulk-only transport, as sent when a disk is mounted."""
+        ep_out = self.find_endpoint(interface, USBEndpoint.direction_out, USBEndpoint.transfer_type_bulk)
+        ep_in = self.find_endpoint(interface, USBEndpoint.direction_in, USBEndpoint.transfer_type_bulk)
+        if ep_out is None or ep_in is None:
+            return
+        # GET MAX LUN
+        yield self.control_transfer(0xa1, 0xfe, 0, interface.number, 1)
+        commands = [
+            (36, b'\x12\x00\x00\x00\x24\x00'),                          # INQUIRY
+            (0, b'\x00\x00\x00\x00\x00\x00'),                           # TEST UNIT READY
+            (8, b'\x25' + b'\x00' * 9),                                 # READ CAPACITY (10)
+            (18, b'\x03\x00\x00\x00\x12\x00'),                          # REQUEST SENSE
+            (192, b'\x1a\x00\x3f\x00\xc0\x00'),                         # MODE SENSE (6)
+        ]
+        if self.read_blocks:
+            block_size = 0x200
+            read_10 = struct.pack('>BBIBHB', 0x28, 0, 0, 0, self.read_blocks, 0)
+            commands.append((self.read_blocks * block_size, read_10))
+        for transfer_length, cb in commands:
+            yield from self.scsi_command(ep_out.number, ep_in.number, cb, transfer_length)
+
+    def scsi_command(self, ep_out: int, ep_in: int, cb: bytes, transfer_length: int) -> Iterator[None]:
+        """Send a command block wrapper and read data and status."""
+        self._cbw_tag = (self._cbw_tag + 1) & 0xffffffff
+        cbw = struct.pack(
+            '<IIIBBB', self.CBW_SIGNATURE, self._cbw_tag, transfer_length,
+            0x80 if transfer_length else 0x00, 0, len(cb)
+        ) + cb.ljust(16, b'\x00')
+        self.bulk_out(ep_out, cbw)
+        yield
+        while True:
+            data = self.wait_in(ep_in)
+            yield
+            if data is None:
+                self.stats['timeouts'] += 1
+                return
+            if len(data) == 13 and data[:4] == self.CSW_SIGNATURE:
+                self.stats['scsi_commands'] += 1
+                return
+
+    def ccid_traffic(self, interface: Any) -> Iterator[None]:
+        """CCID messages, as sent by pcscd when a reader is plugged."""
+        ep_out = self.find_endpoint(interface, USBEndpoint.direction_out, USBEndpoint.transfer_type_bulk)
+        ep_in = self.find_endpoint(interface, USBEndpoint.direction_in, USBEndpoint.transfer_type_bulk)
+        if ep_out is None or ep_in is None:
+            return
+        messages = [
+            (0x65, b''),                                    # GetSlotStatus
+            (0x62, b''),                                    # IccPowerOn
+            (0x6c, b''),                                    # GetParameters
+            (0x6f, b'\x00\xa4\x04\x00\x07\xa0\x00\x00\x00\x03\x10\x10'),  # XfrBlock: SELECT
+            (0x63, b''),                                    # IccPowerOff
+        ]
+        for seq, (opcode, data) in enumerate(messages):
+            message = struct.pack('<BIBB3s', opcode, len(data), 0, seq, b'\x00\x00\x00') + data
+            self.bulk_out(ep_out.number, message)
+            yield
+            if self.wait_in(ep_in.number) is None:
+                self.stats['timeouts'] += 1
+            else:
+                self.stats['ccid_messages'] += 1
+            yield
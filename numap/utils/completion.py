@@ -0,0 +1,163 @@
+'''
+Completion signal of a single scan test.
+
+A test is complete when one of these happens:
+
+- supported: the device reported that the host uses its function
+- host-idle: the device was configured, and no SETUP packet arrived
+  for idle_timeout seconds since the last one
+- host-gone: the host did not send any SETUP packet before the timeout,
+  or a PHY reported that the host went away
+- timeout: the test timeout expired
+
+The signal is a threading.Event, so it can be set from the PHY thread
+and waited for in another one (or in an executor, from asyncio code).
+'''
+import asyncio
+import threading
+import time
+
+# seconds between checks whether a test that is waited for was started
+UNSTARTED_POLL_INTERVAL = 0.1
+
+
+class Reason(object):
+    SUPPORTED = 'supported'
+    HOST_IDLE = 'host-idle'
+    HOST_GONE = 'host-gone'
+    TIMEOUT = 'timeout'
+    CANCELLED = 'cancelled'
+
+
+class TestCompletion(object):
+
+    def __init__(self, timeout=5.0, idle_timeout=1.0):
+        '''
+        :param timeout: seconds to wait for a test to complete (default: 5.0)
+        :param idle_timeout: seconds without SETUP packets, after SET_CONFIGURATION,
+            after which the host is considered idle (default: 1.0)
+        '''
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._start = None
+        self._last_setup = None
+        self._first_setup = None
+        self._configured = False
+
+    def start(self):
+        '''
+        Start a new test
+        '''
+        with self._lock:
+            self._event.clear()
+            self.reason = None
+            self._start = time.monotonic()
+            self._last_setup = None
+            self._first_setup = None
+            self._configured = False
+
+    def setup_received(self):
+        self._last_setup = time.monotonic()
+        if self._first_setup is None:
+            self._first_setup = self._last_setup
+
+    @property
+    def last_setup(self):
+        '''
+        monotonic time of the last SETUP packet (or configuration) of the test, None if there was none.
+        SETUP packets that arrive after the test completed are included.
+        '''
+        return self._last_setup
+
+    def response_latency(self):
+        '''
+        :return: seconds from the start of the test to the first SETUP packet, None if there was none
+        '''
+        if self._first_setup is None or self._start is None:
+            return None
+        return self._first_setup - self._start
+
+    def configured(self):
+        self._last_setup = time.monotonic()
+        self._configured = True
+
+    def function_supported(self):
+        self._complete(Reason.SUPPORTED)
+
+    def host_gone(self):
+        self._complete(Reason.HOST_GONE)
+
+    def cancel(self):
+        '''
+        Release the waiters of a test that ended without a completion reason
+        '''
+        self._complete(Reason.CANCELLED)
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def _complete(self, reason):
+        with self._lock:
+            if not self._event.is_set():
+                self.reason = reason
+                self._event.set()
+
+    def _next_deadline(self):
+        '''
+        :return: tuple of (deadline, reason it expires with),
+            (None, None) if the test was not started
+        '''
+        if self._start is None:
+            return None, None
+        deadline = self._start + self.timeout
+        reason = Reason.TIMEOUT if self._last_setup is not None else Reason.HOST_GONE
+        if self._configured and self.idle_timeout is not None:
+            idle_deadline = self._last_setup + self.idle_timeout
+            if idle_deadline < deadline:
+                return idle_deadline, Reason.HOST_IDLE
+        return deadline, reason
+
+    def check(self):
+        '''
+        Check whether the test is complete, without waiting
+
+        :return: True if the test is complete
+        '''
+        if self._event.is_set():
+            return True
+        deadline, reason = self._next_deadline()
+        if deadline is not None and time.monotonic() >= deadline:
+            self._complete(reason)
+            return True
+        return False
+
+    def wait(self):
+        '''
+        Wait for the test to complete
+
+        :return: completion reason
+        '''
+        while not self.check():
+            deadline, _ = self._next_deadline()
+            if deadline is None:
+                # not started, only a completion ends the wait (look again once started)
+                self._event.wait(UNSTARTED_POLL_INTERVAL)
+            else:
+                self._event.wait(max(deadline - time.monotonic(), 0))
+        return self.reason
+
+    async def wait_async(self):
+        '''
+        Wait for the test to complete, from asyncio code
+
+        :return: completion reason
+        '''
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, self.wait)
+        finally:
+            # let the executor thread return if we are cancelled
+            self.cancel()
@@ -0,0 +1,118 @@
+'''
+Append-only journal of a scan session.
+
+The journal is a text file with one JSON object per line.
+The first line is a header that describes the scan (where the entries
+come from, scan parameters), every other line is a record appended when
+an entry is tested. Each record is flushed and fsync'd, so at most the
+record that was being written is lost on a crash.
+
+Periodically, the journal is compacted: the records are replaced by a
+(smaller) list of records that produce the same state when replayed.
+The compacted journal is written to a temporary file which then replaces
+the journal, so the journal is never left half written.
+'''
+import json
+import os
+
+JOURNAL_VERSION = 1
+
+
+class JournalError(Exception):
+    pass
+
+
+class ScanJournal(object):
+
+    def __init__(self, path, compact_every=1000):
+        '''
+        :param path: path of the journal file
+        :param compact_every: number of appended records between compactions (default: 1000)
+        '''
+        self.path = path
+        self.compact_every = compact_every
+        self.header = None
+        self.appended = 0
+        self._fd = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def create(self, header):
+        '''
+        Start a new journal, overwriting any existing file
+
+        :param header: dictionary that describes the scan
+        '''
+        self.close()
+        header = dict(header, version=JOURNAL_VERSION)
+        self._write_file([header])
+        self.header = header
+        self.appended = 0
+
+    def load(self):
+        '''
+        Read the journal.
+        A truncated last line (interrupted write) is ignored.
+
+        :return: tuple of (header, list of records)
+        '''
+        with open(self.path, 'r') as f:
+            lines = f.read().split('\n')
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            raise JournalError('%s is not a scan journal' % self.path)
+        if not isinstance(header, dict) or header.get('version') != JOURNAL_VERSION:
+            raise JournalError('unsupported journal version in %s' % self.path)
+        records = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+        self.header = header
+        self.appended = 0
+        return header, records
+
+    def append(self, record):
+        '''
+        Append a record and sync it to disk
+
+        :param record: dictionary, must be JSON serializable
+        '''
+        if self._fd is None:
+            self._fd = open(self.path, 'a')
+        self._fd.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._fd.flush()
+        os.fsync(self._fd.fileno())
+        self.appended += 1
+
+    def should_compact(self):
+        return self.compact_every and self.appended >= self.compact_every
+
+    def compact(self, records):
+        '''
+        Replace the journal records
+
+        :param records: records that reproduce the current state when replayed
+        '''
+        self.close()
+        self._write_file([self.header] + list(records))
+        self.appended = 0
+
+    def close(self):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def _write_file(self, lines):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for line in lines:
+                f.write(json.dumps(line, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,96 @@
+'''
+Driver-aware order of the entries of a vendor specific scan.
+
+In non-exhaustive mode, an entry is skipped when its driver was already
+found to be supported. To find the supported drivers as early as
+possible, the entries are tested in this order:
+
+1. one representative entry per driver, drivers with more prior hits
+   first, then drivers with more entries (more entries to skip)
+2. entries without a driver for the scanned OS
+3. the other entries of each driver (skipped if the driver is supported)
+
+Within each group, entries keep their db order.
+'''
+import json
+import os
+from array import array
+
+
+def driver_schedule(db, os_name, hits=None):
+    '''
+    :param db: sequence of DBEntry
+    :param os_name: the scanned OS
+    :param hits: dictionary of driver name to number of prior hits (default: None)
+    :return: array of db indexes, in test order
+    '''
+    hits = hits or {}
+    # driver -> index of its first entry
+    first = {}
+    counts = {}
+    driverless = array('l')
+    for index, db_entry in enumerate(db):
+        driver = db_entry.drivers.get(os_name)
+        if not driver:
+            driverless.append(index)
+        elif driver in first:
+            counts[driver] += 1
+        else:
+            first[driver] = index
+            counts[driver] = 1
+    drivers = sorted(first, key=lambda d: (-hits.get(d, 0), -counts[d], first[d]))
+    representatives = set(first.values())
+    order = array('l', (first[driver] for driver in drivers))
+    order.extend(driverless)
+    order.extend(
+        index for index, db_entry in enumerate(db)
+        if db_entry.drivers.get(os_name) and index not in representatives
+    )
+    return order
+
+
+class ScheduledDB(object):
+    '''
+    Read only sequence of the db entries in a given order
+    '''
+
+    def __init__(self, db, order):
+        self.db = db
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        return self.db[self.order[index]]
+
+    def __iter__(self):
+        for index in self.order:
+            yield self.db[index]
+
+
+def load_hits(filename):
+    '''
+    :param filename: JSON hit table, driver name to number of hosts that supported it
+    :return: hit table, empty if the file does not exist
+    '''
+    if not filename or not os.path.exists(filename):
+        return {}
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def update_hits(filename, drivers):
+    '''
+    Count a hit for each of the drivers
+
+    :param filename: JSON hit table
+    :param drivers: drivers that were supported by the scanned host
+    '''
+    hits = load_hits(filename)
+    for driver in drivers:
+        hits[driver] = hits.get(driver, 0) + 1
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(hits, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, filename)
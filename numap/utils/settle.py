@@ -0,0 +1,207 @@
+'''
+Delay between scan tests.
+
+After a device is disconnected, the host needs some time before it
+handles a new attach. Settle waits a fixed delay, AdaptiveSettle measures
+the time the host needs from two things it can observe:
+
+- quiet time: how long the host keeps sending requests after the
+  device was disconnected (for PHYs that still deliver them)
+- attach latency: the time from connection to the first SETUP packet.
+  The fastest latency of the host is its baseline. A host that was
+  attached before it was ready answers late, so the extra latency,
+  added to the delay that was waited, is when it became ready.
+
+The delay is set from these measurements, with a margin, between the
+minimum and the maximum (the fixed delay). A test that got no response
+after a shortened delay is not a result: the scan apps test it again
+after the maximum delay (see shortened and missed), and only a miss at
+the maximum delay can mean that the host is dead.
+
+The measurements are kept per host in a JSON profile file, so the next
+scan of the same host starts from them. Several processes (the scan
+workers) may save their profiles at the same time, so the file is
+updated under a lock.
+'''
+import fcntl
+import json
+import os
+import tempfile
+import time
+
+DEFAULT_PROFILE_FILE = os.path.join(os.path.expanduser('~'), '.numap', 'settle_profiles.json')
+
+
+class Settle(object):
+    '''
+    Wait a fixed delay between tests
+    '''
+
+    def __init__(self, delay):
+        '''
+        :param delay: seconds to wait after a disconnection
+        '''
+        self.delay = delay
+        self._disconnect_time = None
+
+    def disconnected(self):
+        '''
+        Mark the time the device was disconnected
+        '''
+        self._disconnect_time = time.monotonic()
+
+    def wait(self):
+        '''
+        Wait until the host is expected to be ready for a new device
+        '''
+        elapsed = 0
+        if self._disconnect_time is not None:
+            elapsed = time.monotonic() - self._disconnect_time
+        if self.delay > elapsed:
+            time.sleep(self.delay - elapsed)
+
+    def test_done(self, latency):
+        '''
+        :param latency: seconds from connection to the first SETUP packet, None if there was none
+        '''
+        pass
+
+    def shortened(self):
+        '''
+        :return: whether the last wait was shorter than the maximum delay,
+            so a host that did not respond may just not have been ready
+        '''
+        return False
+
+    def missed(self):
+        '''
+        The host did not respond after a shortened wait (see shortened),
+        wait the maximum delay before the next test
+        '''
+        pass
+
+    def save(self):
+        pass
+
+
+class AdaptiveSettle(Settle):
+    '''
+    Measure the delay that the host needs between tests
+    '''
+
+    # latency above the baseline that is still not a late response:
+    # this factor of the baseline, and at least late_tolerance seconds
+    slow_factor = 2.0
+    late_tolerance = 0.05
+    # the delay is the measured ready time times this margin
+    margin = 1.2
+    # after a miss, the host needs at least this factor of the delay that was waited
+    grow = 2.0
+
+    def __init__(self, maximum, host_id='default', minimum=0.05, profile_file=DEFAULT_PROFILE_FILE, completion=None):
+        '''
+        :param maximum: upper bound of the delay, in seconds
+        :param host_id: name of the host profile (default: 'default')
+        :param minimum: lower bound of the delay, in seconds (default: 0.05)
+        :param profile_file: JSON file with the host profiles (default: ~/.numap/settle_profiles.json)
+        :param completion: TestCompletion of the scan, its SETUP times give the quiet time (default: None)
+        '''
+        super(AdaptiveSettle, self).__init__(maximum)
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.host_id = host_id
+        self.profile_file = profile_file
+        self.completion = completion
+        #: fastest attach latency of the host
+        self.latency = None
+        #: seconds from a disconnection until the host is ready, None until it was measured
+        self.ready = None
+        #: longest time the host kept sending requests after a disconnection
+        self.quiet = 0.0
+        # seconds from the previous disconnection to the last connection, None if unknown
+        self._waited = None
+        self.load()
+
+    def load(self):
+        '''
+        Load the measurements of the host from the profile file, if it has one
+        '''
+        profile = self._read_profiles().get(self.host_id)
+        if profile:
+            self.latency = profile.get('latency')
+            self.ready = profile.get('ready')
+            self.quiet = profile.get('quiet') or 0.0
+            self._update_delay()
+
+    def wait(self):
+        super(AdaptiveSettle, self).wait()
+        if self._disconnect_time is None:
+            self._waited = None
+            return
+        now = time.monotonic()
+        self._waited = now - self._disconnect_time
+        last_setup = self.completion.last_setup if self.completion is not None else None
+        if last_setup is not None and last_setup > self._disconnect_time:
+            self.quiet = max(self.quiet, last_setup - self._disconnect_time)
+            self._update_delay()
+
+    def test_done(self, latency):
+        if latency is None:
+            return
+        if self.latency is None or latency < self.latency:
+            self.latency = latency
+        if self._waited is None:
+            return
+        late = latency - self.latency
+        if late > max(self.latency * (self.slow_factor - 1), self.late_tolerance):
+            # attached before the host was ready, it answered once it was
+            self.ready = max(self.ready or 0.0, self._waited + late)
+        elif self.ready is None:
+            # ready within the wait, the quiet time is what it needs (until a late response says otherwise)
+            self.ready = self.quiet
+        self._update_delay()
+
+    def shortened(self):
+        return self._waited is not None and self._waited < self.maximum
+
+    def missed(self):
+        if self._waited is not None:
+            self.ready = max(self.ready or 0.0, self._waited * self.grow)
+        self.delay = self.maximum
+
+    def _update_delay(self):
+        ready = max(self.ready if self.ready is not None else self.maximum, self.quiet)
+        self.delay = min(self.maximum, max(self.minimum, ready * self.margin))
+
+    def save(self):
+        '''
+        Store the delay of the host in the profile file
+        '''
+        if not self.profile_file:
+            return
+        dirname = os.path.dirname(os.path.abspath(self.profile_file))
+        os.makedirs(dirname, exist_ok=True)
+        with open(self.profile_file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            profiles = self._read_profiles()
+            profiles[self.host_id] = {
+                'delay': self.delay, 'latency': self.latency, 'ready': self.ready, 'quiet': self.quiet,
+            }
+            fd, tmp_file = tempfile.mkstemp(dir=dirname, prefix='.settle_profiles.')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(profiles, f, indent=2, sort_keys=True)
+                os.replace(tmp_file, self.profile_file)
+            except BaseException:
+                os.remove(tmp_file)
+                raise
+
+    def _read_profiles(self):
+        if not self.profile_file or not os.path.exists(self.profile_file):
+            return {}
+        try:
+            with open(self.profile_file, 'r') as f:
+                profiles = json.load(f)
+        except ValueError:
+            return {}
+        return profiles if isinstance(profiles, dict) else {}
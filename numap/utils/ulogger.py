@@ -1,7 +1,23 @@
+import atexit
+import copy
 import logging
+import logging.handlers
+import queue
+
+VERBOSE = 5
+ALWAYS = 100
+
+FORMAT = '[%(levelname)-6s] %(message)s'
+FILE_FORMAT = '[%(asctime)s] [%(levelname)-6s] %(message)s'
+
+DEFAULT_LOG_QUEUE_SIZE = 10000
+DEFAULT_LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_LOG_FILE_BACKUP_COUNT = 5
 
 stdio_handler = None
 numap_logger = None
+queue_handler = None
+queue_listener = None
 
 
 def prepare_logging():
@@ -16,20 +32,152 @@ def prepare_logging():
             setattr(logging, name, num)
             return fn
 
-        logging.Logger.verbose = add_debug_level(5, 'VERBOSE')
-        logging.Logger.always = add_debug_level(100, 'ALWAYS')
+        logging.Logger.verbose = add_debug_level(VERBOSE, 'VERBOSE')
+        logging.Logger.always = add_debug_level(ALWAYS, 'ALWAYS')
 
-        FORMAT = '[%(levelname)-6s] %(message)s'
         stdio_handler = logging.StreamHandler()
         stdio_handler.setLevel(logging.INFO)
         formatter = logging.Formatter(FORMAT)
         stdio_handler.setFormatter(formatter)
         numap_logger = logging.getLogger('numap')
         numap_logger.addHandler(stdio_handler)
-        numap_logger.setLevel(logging.VERBOSE)
+        numap_logger.setLevel(VERBOSE)
     return numap_logger
 
 
 def set_default_handler_level(level):
     global stdio_handler
     stdio_handler.setLevel(level)
+    sync_logger_level()
+
+
+def sync_logger_level():
+    '''
+    Set the level of the numap logger to the lowest level of its handlers,
+    so records that no handler would emit are dropped (by isEnabledFor)
+    before any message formatting is done.
+    '''
+    if queue_listener is not None:
+        queue_handler.setLevel(_lowest_level(queue_listener.handlers))
+    numap_logger.setLevel(_lowest_level(numap_logger.handlers))
+
+
+def _lowest_level(handlers):
+    levels = [handler.level or VERBOSE for handler in handlers]
+    return max(min(levels), VERBOSE) if levels else VERBOSE
+
+
+def _snapshot(arg):
+    if isinstance(arg, LazyHex):
+        return LazyHex(bytes(arg.data))
+    if isinstance(arg, (bytearray, memoryview)):
+        return bytes(arg)
+    return arg
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Queue handler for a bounded queue.
+    When the queue is full, new records are dropped and counted
+    instead of blocking the caller.
+    Formatting is left to the listener thread. The arguments that refer to
+    buffers the caller may change (bytearray, memoryview, LazyHex) are
+    copied when the record is queued.
+    Records of disabled levels are dropped by the logger before they get here
+    (see sync_logger_level).
+    '''
+
+    def __init__(self, record_queue):
+        super(DroppingQueueHandler, self).__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if isinstance(record.args, tuple) and any(isinstance(arg, _MUTABLE_ARGS) for arg in record.args):
+            record = copy.copy(record)
+            record.args = tuple(_snapshot(arg) for arg in record.args)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def start_background_logging(
+    max_records=DEFAULT_LOG_QUEUE_SIZE, log_file=None,
+    max_bytes=DEFAULT_LOG_FILE_MAX_BYTES, backup_count=DEFAULT_LOG_FILE_BACKUP_COUNT
+):
+    '''
+    Move formatting and writing of numap log records to a background thread,
+    so logging does not block the PHY service loop.
+
+    :param max_records: maximum number of pending records, newer records are dropped (default: 10000)
+    :param log_file: also write the log to this (rotating) file (default: None)
+    :param max_bytes: size of log file before it is rotated (default: 10MB)
+    :param backup_count: number of rotated log files to keep (default: 5)
+    '''
+    global queue_handler
+    global queue_listener
+    if queue_listener is not None:
+        return
+    handlers = [stdio_handler]
+    if log_file:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count
+        )
+        file_handler.setLevel(stdio_handler.level)
+        file_handler.setFormatter(logging.Formatter(FILE_FORMAT))
+        handlers.append(file_handler)
+    queue_handler = DroppingQueueHandler(queue.Queue(max_records))
+    queue_listener = logging.handlers.QueueListener(
+        queue_handler.queue, *handlers, respect_handler_level=True
+    )
+    numap_logger.removeHandler(stdio_handler)
+    numap_logger.addHandler(queue_handler)
+    sync_logger_level()
+    queue_listener.start()
+    atexit.register(stop_background_logging)
+
+
+def stop_background_logging():
+    '''
+    Flush pending records and go back to logging from the calling thread.
+
+    :return: number of records that were dropped because the queue was full
+    '''
+    global queue_handler
+    global queue_listener
+    if queue_listener is None:
+        return 0
+    queue_listener.stop()
+    numap_logger.removeHandler(queue_handler)
+    numap_logger.addHandler(stdio_handler)
+    for handler in queue_listener.handlers:
+        if handler is not stdio_handler:
+            handler.close()
+    dropped = queue_handler.dropped
+    queue_handler = None
+    queue_listener = None
+    sync_logger_level()
+    if dropped:
+        numap_logger.warning('Dropped %d log records, log queue was full', dropped)
+    return dropped
+
+
+class LazyHex(object):
+    '''
+    Hex representation of binary data,
+    only computed if the log record is actually emitted.
+    '''
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return self.data.hex()
+
+
+_MUTABLE_ARGS = (LazyHex, bytearray, memoryview)
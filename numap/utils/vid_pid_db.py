@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+'''
+Compile a VID:PID database for numapvsscan
+
+Usage:
+    numapmkdb <OUTPUT> [--python=FILE ...] [--usb-ids=FILE ...]
+
+Options:
+    --python FILE       python file with a db member which is a list of DBEntry() objects
+    --usb-ids FILE      usb.ids file (http://www.linux-usb.org/usb.ids)
+
+The compiled database is an SQLite file, indexed by VID, PID and driver
+per OS. It is loaded lazily by numapvsscan, so large databases do not
+slow down the start of the scan, nor grow its memory.
+When an entry appears in several inputs, the first one is kept.
+
+Example:
+    numapmkdb vid_pid.db --python data/vid_pid_db.py --usb-ids /usr/share/hwdata/usb.ids
+'''
+import bisect
+import json
+import math
+import os
+import sqlite3
+import sys
+from types import MappingProxyType
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+DB_FORMAT_VERSION = 1
+
+
+class OS(object):
+    LINUX = 'Linux'
+    WINDOWS = 'Windows'
+    OSX = 'OSX'
+    QNX = 'QNX'
+
+
+# shared driver tables, entries with the same drivers use the same table
+_driver_tables = {}
+
+
+def _driver_table(drivers):
+    '''
+    :param drivers: mapping of OS to driver name
+    :return: shared, read only, mapping with the same content
+    '''
+    if not drivers:
+        return _EMPTY_DRIVERS
+    key = tuple(sorted((sys.intern(os_name), sys.intern(driver)) for os_name, driver in drivers.items()))
+    table = _driver_tables.get(key)
+    if table is None:
+        table = _driver_tables[key] = MappingProxyType(dict(key))
+    return table
+
+
+_EMPTY_DRIVERS = MappingProxyType({})
+
+
+class DBEntry(object):
+    '''
+    DBEnrty describes a vid, pid.
+    Entries are frozen, use with_info to get an entry with test info.
+    '''
+
+    __slots__ = ('vid', 'pid', 'vendor_name', 'product_name', 'drivers', 'constraints', 'info')
+
+    def __init__(self, vid, pid, vendor_name='', product_name='', drivers=None, constraints=(), info=None):
+        setattr_ = object.__setattr__
+        setattr_(self, 'vid', vid)
+        setattr_(self, 'pid', pid)
+        setattr_(self, 'vendor_name', sys.intern(vendor_name) if vendor_name else '')
+        setattr_(self, 'product_name', sys.intern(product_name) if product_name else '')
+        setattr_(self, 'drivers', _driver_table(drivers))
+        setattr_(self, 'constraints', tuple(constraints))
+        setattr_(self, 'info', info)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('DBEntry is frozen')
+
+    def __reduce__(self):
+        return (DBEntry, (
+            self.vid, self.pid, self.vendor_name, self.product_name,
+            dict(self.drivers), self.constraints, self.info
+        ))
+
+    def __eq__(self, other):
+        if not isinstance(other, DBEntry):
+            return NotImplemented
+        return self.__reduce__()[1] == other.__reduce__()[1]
+
+    def __hash__(self):
+        return hash((self.vid, self.pid))
+
+    def with_info(self, info):
+        '''
+        :param info: information gathered when testing the entry
+        :return: copy of the entry with the info
+        '''
+        return DBEntry(
+            self.vid, self.pid, self.vendor_name, self.product_name,
+            self.drivers, self.constraints, info
+        )
+
+    def describe(self, os_name=None):
+        '''
+        :param os_name: only show the driver for this OS, if the entry has one (default: None)
+        :return: description of the entry
+        '''
+        s = 'vid:pid %04x:%04x' % (self.vid, self.pid)
+        if self.vendor_name:
+            s += ', vendor: %s' % self.vendor_name
+        if self.product_name:
+            s += ', product: %s' % self.product_name
+        if self.drivers:
+            if os_name and os_name in self.drivers:
+                s += ', driver: %s' % self.drivers[os_name]
+            else:
+                s += ', drivers: %s' % dict(self.drivers)
+        if self.constraints:
+            s += ', constraints: %s' % list(self.constraints)
+        if self.info:
+            s += ', info: %s' % self.info
+        return s
+
+    def __str__(self):
+        return self.describe()
+
+    def vidpid(self):
+        return '%04x:%04x' % (self.vid, self.pid)
+
+
+def is_compiled_db(filename):
+    '''
+    :return: True if filename is a compiled (SQLite) database
+    '''
+    with open(filename, 'rb') as f:
+        return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+def load_python_db(filename):
+    '''
+    Import a python db file
+
+    :param filename: python file with a db member
+    :return: list of DBEntry
+    '''
+    dirpath, modulename = os.path.split(os.path.abspath(filename))
+    modulename = modulename[:-3]
+    if dirpath in sys.path:
+        sys.path.remove(dirpath)
+    sys.path.insert(0, dirpath)
+    module = __import__(modulename, globals(), locals(), [], 0)
+    return module.db
+
+
+def parse_usb_ids(filename):
+    '''
+    Parse the vendors and products of a usb.ids file
+
+    :param filename: path to usb.ids
+    :return: generator of DBEntry
+    '''
+    vid = None
+    vendor_name = ''
+    with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('\t\t'):
+                # interface lines
+                continue
+            if line.startswith('\t'):
+                if vid is not None:
+                    pid, _, product_name = line.strip().partition(' ')
+                    yield DBEntry(vid, int(pid, 16), vendor_name, product_name.strip())
+                continue
+            ident, _, name = line.partition(' ')
+            if len(ident) != 4:
+                # device classes and other lists follow the vendors
+                vid = None
+                if ident in ('C', 'AT', 'HID', 'R', 'BIAS', 'PHY', 'HUT', 'L', 'HCC', 'VT'):
+                    break
+                continue
+            vid = int(ident, 16)
+            vendor_name = name.strip()
+
+
+def compile_db(entries, filename):
+    '''
+    Write entries to a compiled database
+
+    :param entries: iterable of DBEntry
+    :param filename: output file, overwritten if it exists
+    :return: number of entries written
+    '''
+    if os.path.exists(filename):
+        os.remove(filename)
+    conn = sqlite3.connect(filename)
+    try:
+        conn.executescript('''
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE entries (
+                id INTEGER PRIMARY KEY,
+                vid INTEGER NOT NULL,
+                pid INTEGER NOT NULL,
+                vendor_name TEXT,
+                product_name TEXT,
+                constraints TEXT,
+                info TEXT
+            );
+            CREATE TABLE drivers (
+                entry_id INTEGER NOT NULL REFERENCES entries(id),
+                os TEXT NOT NULL,
+                driver TEXT NOT NULL
+            );
+        ''')
+        seen = set()
+        count = 0
+        for entry in entries:
+            key = (entry.vid, entry.pid)
+            if key in seen:
+                continue
+            seen.add(key)
+            count += 1
+            conn.execute(
+                'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    count, entry.vid, entry.pid, entry.vendor_name, entry.product_name,
+                    json.dumps(list(entry.constraints)) if entry.constraints else None,
+                    json.dumps(entry.info) if entry.info else None,
+                )
+            )
+            conn.executemany(
+                'INSERT INTO drivers VALUES (?, ?, ?)',
+                [(count, os_name, driver) for os_name, driver in entry.drivers.items()]
+            )
+        conn.executescript('''
+            CREATE INDEX entries_vid_pid ON entries (vid, pid);
+            CREATE INDEX entries_pid ON entries (pid);
+            CREATE INDEX drivers_entry ON drivers (entry_id);
+            CREATE INDEX drivers_os_driver ON drivers (os, driver);
+        ''')
+        conn.execute('INSERT INTO meta VALUES (?, ?)', ('version', str(DB_FORMAT_VERSION)))
+        conn.commit()
+    finally:
+        conn.close()
+    return count
+
+
+class CompiledDB(object):
+    '''
+    Read only sequence of DBEntry, backed by a compiled database.
+    Entries are read on demand, in chunks, so sequential access
+    (as done by the scan) costs one query per chunk.
+    '''
+
+    chunk_size = 256
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        version = self.conn.execute('SELECT value FROM meta WHERE key = ?', ('version',)).fetchone()
+        if version is None or int(version[0]) != DB_FORMAT_VERSION:
+            raise Exception('unsupported db format in %s' % filename)
+        self._len = self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        self._chunk_start = None
+        self._chunk = []
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('db index out of range')
+        start = self._chunk_start
+        if start is None or not start <= index < start + len(self._chunk):
+            self._load_chunk(index)
+            start = index
+        return self._chunk[index - start]
+
+    def __iter__(self):
+        for index in range(self._len):
+            yield self[index]
+
+    def close(self):
+        self.conn.close()
+
+    def _load_chunk(self, index):
+        first_id = index + 1
+        last_id = index + self.chunk_size
+        drivers = {}
+        for entry_id, os_name, driver in self.conn.execute(
+            'SELECT entry_id, os, driver FROM drivers WHERE entry_id BETWEEN ? AND ?', (first_id, last_id)
+        ):
+            drivers.setdefault(entry_id, {})[os_name] = driver
+        self._chunk = [
+            self._make_entry(row, drivers.get(row[0], {}))
+            for row in self.conn.execute(
+                'SELECT * FROM entries WHERE id BETWEEN ? AND ? ORDER BY id', (first_id, last_id)
+            )
+        ]
+        self._chunk_start = index
+
+    def _make_entry(self, row, drivers):
+        _, vid, pid, vendor_name, product_name, constraints, info = row
+        return DBEntry(
+            vid, pid, vendor_name or '', product_name or '', drivers=drivers,
+            constraints=json.loads(constraints) if constraints else (),
+            info=json.loads(info) if info else None,
+        )
+
+    def _query(self, where, args):
+        rows = self.conn.execute('SELECT * FROM entries WHERE %s ORDER BY id' % where, args).fetchall()
+        return [self._make_entry(row, self._entry_drivers(row[0])) for row in rows]
+
+    def _entry_drivers(self, entry_id):
+        return dict(self.conn.execute('SELECT os, driver FROM drivers WHERE entry_id = ?', (entry_id,)))
+
+    def find(self, vid, pid=None):
+        '''
+        :return: list of entries with the vid (and pid)
+        '''
+        if pid is None:
+            return self._query('vid = ?', (vid,))
+        return self._query('vid = ? AND pid = ?', (vid, pid))
+
+    def find_by_driver(self, os_name, driver):
+        '''
+        :return: list of entries handled by driver on os_name
+        '''
+        return self._query(
+            'id IN (SELECT entry_id FROM drivers WHERE os = ? AND driver = ?)', (os_name, driver)
+        )
+
+
+class VidPidSweep(object):
+    '''
+    Read only sequence of DBEntry for VID:PID ranges.
+    Entries are created on demand, so a sweep takes constant memory
+    regardless of the size of the ranges.
+
+    The spec is a comma separated list of VID:PID ranges,
+    each of VID and PID is either a single value or a start-end range
+    (end is excluded), all in hex. For example: 1001-1004:0000-ffff,2000:0001
+
+    The sweep can be thinned out by taking every stride-th combination,
+    and/or by taking a sample of the combinations in a (deterministic)
+    scattered order.
+    '''
+
+    def __init__(self, spec, stride=1, sample=None):
+        '''
+        :param spec: VID:PID ranges
+        :param stride: take every stride-th combination (default: 1)
+        :param sample: number of combinations to sample (default: None, take all)
+        '''
+        if stride < 1:
+            raise ValueError('stride must be a positive number')
+        self.spec = spec
+        self.stride = stride
+        self.sample = sample
+        self.ranges = [self._parse_range(part) for part in spec.split(',') if part.strip()]
+        # index of the first combination of each range
+        self.offsets = []
+        total = 0
+        for vids, pids in self.ranges:
+            self.offsets.append(total)
+            total += len(vids) * len(pids)
+        self.combinations = total
+        self._strided_len = (total + stride - 1) // stride
+        if sample is None:
+            self._len = self._strided_len
+        else:
+            self._len = min(sample, self._strided_len)
+        # affine permutation i -> (a * i) % n, a coprime to n
+        n = self._strided_len
+        self._multiplier = (int(n * 0.6180339887) | 1) if n > 2 else 1
+        while n and math.gcd(self._multiplier, n) != 1:
+            self._multiplier += 2
+
+    @staticmethod
+    def _parse_values(values):
+        if '-' in values:
+            start, end = values.split('-')
+            return range(int(start, 16), int(end, 16))
+        value = int(values, 16)
+        return range(value, value + 1)
+
+    def _parse_range(self, part):
+        try:
+            vids, pids = part.strip().split(':')
+            return self._parse_values(vids), self._parse_values(pids)
+        except ValueError:
+            raise ValueError('invalid VID:PID range: %s' % part)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('sweep index out of range')
+        if self.sample is not None:
+            index = (self._multiplier * index) % self._strided_len
+        index *= self.stride
+        range_index = bisect.bisect_right(self.offsets, index) - 1
+        vids, pids = self.ranges[range_index]
+        offset = index - self.offsets[range_index]
+        return DBEntry(vids[offset // len(pids)], pids[offset % len(pids)])
+
+    def __iter__(self):
+        for index in range(self._len):
+            yield self[index]
+
+
+def main():
+    from docopt import docopt
+    opts = docopt(__doc__)
+    sources = []
+    for filename in opts['--python']:
+        sources.append(load_python_db(filename))
+    for filename in opts['--usb-ids']:
+        sources.append(parse_usb_ids(filename))
+    if not sources:
+        print('No input, use --python and/or --usb-ids')
+        sys.exit(1)
+
+    def all_entries():
+        for source in sources:
+            for entry in source:
+                yield entry
+
+    count = compile_db(all_entries(), opts['<OUTPUT>'])
+    print('Wrote %d entries to %s' % (count, opts['<OUTPUT>']))
+
+
+if __name__ == '__main__':
+    main()
@@ -34,6 +34,8 @@ setup(
             'numap-scan=numap.apps.scan:main',
             'numap-vsscan=numap.apps.vsscan:main',
             'numap-stages=numap.apps.makestages:main',
+            'numap-bench=numap.apps.bench:main',
+            'numap-mkdb=numap.utils.vid_pid_db:main',
         ]
     },
     package_data={}
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+'''
+Per-SETUP parsing cost of USBDeviceRequest, before and after it was
+made slotted and lazy (see the history of numap/core/usb_device.py).
+
+The previous implementation is kept here as LegacyUSBDeviceRequest,
+so both are timed in the same interpreter. Not collected by pytest,
+run it from the repository root:
+
+    python tests/bench_request_parsing.py [-n NUMBER] [-r REPEAT]
+
+Prints the best time of REPEAT runs of NUMBER parses, per parse.
+'''
+import argparse
+import struct
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from numap.core.usb_device import USBDeviceRequest  # noqa: E402
+
+
+class LegacyUSBDeviceRequest(object):
+    '''
+    USBDeviceRequest.__init__ before the change
+    '''
+
+    def __init__(self, obj):
+        if isinstance(obj, bytes):
+            raw_bytes = obj
+        else:
+            raw_bytes = struct.pack(
+                '<BBHHH',
+                obj.request_type,
+                obj.request,
+                obj.value,
+                obj.index,
+                obj.length
+            )
+            raw_bytes += obj.data
+
+        header = raw_bytes[:8]
+        self.request_type, self.request, self.value, self.index, self.length = struct.unpack('<BBHHH', header)
+        self.data = raw_bytes[8:]
+        self.raw_bytes = raw_bytes
+
+
+class PhyRequest(object):
+    '''
+    A request as parsed by the facedancer backends
+    '''
+
+    def __init__(self, request_type, request, value, index, length, data=b''):
+        self.request_type = request_type
+        self.request = request
+        self.value = value
+        self.index = index
+        self.length = length
+        self.data = data
+
+
+CASES = [
+    ('8-byte setup packet', struct.pack('<BBHHH', 0x80, 0x06, 0x0100, 0, 0x40)),
+    ('setup + 7-byte data stage', struct.pack('<BBHHH', 0x21, 0x20, 0, 0, 7) + b'\x80\x25\x00\x00\x00\x00\x08'),
+    ('request object from PHY', PhyRequest(0x21, 0x20, 0, 0, 7, b'\x80\x25\x00\x00\x00\x00\x08')),
+]
+
+
+def best_ns(request_class, packet, number, repeat):
+    '''
+    :return: best time of a single parse, in nanoseconds
+    '''
+    times = timeit.repeat(lambda: request_class(packet), number=number, repeat=repeat)
+    return min(times) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description='per-SETUP parsing cost of USBDeviceRequest')
+    parser.add_argument('-n', '--number', type=int, default=200000, help='parses per run (default: 200000)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='number of runs (default: 5)')
+    args = parser.parse_args()
+    print('best of %d x %d, Python %s' % (args.repeat, args.number, sys.version.split()[0]))
+    for name, packet in CASES:
+        before = best_ns(LegacyUSBDeviceRequest, packet, args.number, args.repeat)
+        after = best_ns(USBDeviceRequest, packet, args.number, args.repeat)
+        print('    %-26s %5.0f ns -> %5.0f ns' % (name, before, after))
+
+
+if __name__ == '__main__':
+    main()
@@ -17,3 +17,6 @@ class EventHandler(object):
 
     def handle_event(self, event):
         self.events.append(event)
+
+    def signal_setup_packet_received(self, app):
+        pass
@@ -0,0 +1,23 @@
+import json
+
+from numap.apps.bench import NumapBenchApp
+
+
+def test_bench_reports_json_per_class(tmp_path):
+    output = tmp_path / 'bench.json'
+    app = NumapBenchApp(None)
+    app.options = {'--class': ['keyboard', 'smartcard', 'mass_storage', 'no_such_class'], '--output': str(output)}
+    app.num_requests = 50
+    app.num_enumerations = 2
+    app.bulk_bytes = 0x1000
+
+    app.run()
+
+    classes = json.loads(output.read_text())['classes']
+    for name in ('keyboard', 'smartcard', 'mass_storage'):
+        assert classes[name]['control_requests_per_sec'] > 0
+        assert classes[name]['enumeration_ms'] > 0
+    assert classes['keyboard']['bulk_out_bytes_per_sec'] is None
+    assert classes['smartcard']['bulk_out_bytes_per_sec'] > 0
+    assert classes['mass_storage']['bulk_in_bytes_per_sec'] > 0
+    assert 'error' in classes['no_such_class']
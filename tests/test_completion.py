@@ -0,0 +1,140 @@
+import asyncio
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from numap.utils import completion
+from numap.utils.completion import Reason
+from numap.utils import settle
+from numap.utils.settle import AdaptiveSettle
+
+
+def test_completion_supported_wakes_waiter():
+    signal = completion.TestCompletion(timeout=10)
+    signal.start()
+    threading.Timer(0.05, signal.function_supported).start()
+
+    start = time.monotonic()
+    assert signal.wait() == Reason.SUPPORTED
+    assert time.monotonic() - start < 1
+
+
+def test_completion_host_idle_after_configuration():
+    signal = completion.TestCompletion(timeout=10, idle_timeout=0.05)
+    signal.start()
+    signal.setup_received()
+    assert not signal.check()
+    signal.configured()
+
+    assert signal.wait() == Reason.HOST_IDLE
+
+
+def test_completion_host_gone_and_timeout():
+    signal = completion.TestCompletion(timeout=0.05)
+    signal.start()
+    assert signal.wait() == Reason.HOST_GONE
+
+    # setup packets, but the device is never configured
+    signal.start()
+    signal.setup_received()
+    assert signal.wait() == Reason.TIMEOUT
+
+
+def test_completion_wait_before_start():
+    signal = completion.TestCompletion(timeout=0.01, idle_timeout=0.01)
+    signal.configured()
+    assert not signal.check()
+    assert signal.response_latency() is None
+    threading.Timer(0.05, signal.function_supported).start()
+    # no deadline applies until the test is started
+    assert signal.wait() == Reason.SUPPORTED
+
+
+def test_completion_wait_async_before_start():
+    signal = completion.TestCompletion(timeout=0.01)
+    threading.Timer(0.05, signal.host_gone).start()
+    assert asyncio.run(signal.wait_async()) == Reason.HOST_GONE
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_adaptive_settle_measures_ready_time(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(settle.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(settle.time, 'sleep', clock.sleep)
+    completion = SimpleNamespace(last_setup=None)
+    profile_file = str(tmp_path / 'profiles.json')
+    adaptive = AdaptiveSettle(2.0, host_id='win10', profile_file=profile_file, completion=completion)
+    assert adaptive.delay == 2.0
+
+    # first test, the baseline latency
+    adaptive.wait()
+    adaptive.test_done(0.1)
+    adaptive.disconnected()
+    # the host kept sending requests for 0.3 seconds after the disconnection
+    completion.last_setup = clock.now + 0.3
+    adaptive.wait()
+    assert not adaptive.shortened()
+    adaptive.test_done(0.1)
+    assert adaptive.quiet == pytest.approx(0.3)
+    assert adaptive.delay == pytest.approx(0.36)
+
+    # attached before the host was ready: it answered 0.4 seconds late
+    adaptive.disconnected()
+    completion.last_setup = None
+    adaptive.wait()
+    assert adaptive.shortened()
+    adaptive.test_done(0.5)
+    assert adaptive.ready == pytest.approx(0.76)
+    assert adaptive.delay == pytest.approx(0.912)
+    # answering in time does not shorten it again
+    adaptive.disconnected()
+    adaptive.wait()
+    adaptive.test_done(0.1)
+    assert adaptive.delay == pytest.approx(0.912)
+    adaptive.save()
+
+    reloaded = AdaptiveSettle(2.0, host_id='win10', profile_file=profile_file)
+    assert reloaded.delay == pytest.approx(adaptive.delay)
+    assert AdaptiveSettle(2.0, host_id='other', profile_file=profile_file).delay == 2.0
+    # the upper bound still holds with a profile from a longer run
+    assert AdaptiveSettle(0.01, host_id='win10', profile_file=profile_file).delay == 0.01
+
+    # no response after a shortened delay: the next test waits the maximum
+    adaptive.disconnected()
+    adaptive.wait()
+    adaptive.test_done(None)
+    assert adaptive.shortened()
+    adaptive.missed()
+    assert adaptive.delay == 2.0
+    adaptive.disconnected()
+    adaptive.wait()
+    assert not adaptive.shortened()
+
+
+def test_adaptive_settle_concurrent_saves_keep_every_profile(tmp_path):
+    profile_file = str(tmp_path / 'profiles.json')
+    settles = [AdaptiveSettle(1.0, host_id='lab@board-%d' % i, profile_file=profile_file) for i in range(8)]
+    for i, adaptive in enumerate(settles):
+        adaptive.ready = 0.1 * (i + 1)
+    savers = [threading.Thread(target=adaptive.save) for adaptive in settles]
+    for saver in savers:
+        saver.start()
+    for saver in savers:
+        saver.join()
+    for i in range(8):
+        reloaded = AdaptiveSettle(1.0, host_id='lab@board-%d' % i, profile_file=profile_file)
+        assert reloaded.ready == settles[i].ready
+    assert sorted(os.listdir(str(tmp_path))) == ['profiles.json', 'profiles.json.lock']
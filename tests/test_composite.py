@@ -0,0 +1,109 @@
+import struct
+
+import pytest
+
+from numap.apps.base import NumapApp
+from numap.core.usb import DescriptorType
+from numap.dev.composite import FUNCTION_ENDPOINTS, USBProbeDevice, probe_groups
+from numap.phy.vhost import VirtualHostPhy
+
+
+class ProbeApp(NumapApp):
+    def __init__(self):
+        super(ProbeApp, self).__init__(docstring=None)
+        self.supported = []
+
+    def usb_function_supported(self, reason=None):
+        self.supported.append(reason)
+
+
+@pytest.fixture
+def disk_dir(tmp_path, monkeypatch):
+    # mass storage opens stick.img in the working directory
+    (tmp_path / 'stick.img').write_bytes(b'\x00' * 0x200 * 64)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def _descriptors(config):
+    i = 0
+    while i < len(config):
+        yield config[i:i + config[i]]
+        i += config[i]
+
+
+def _probe(classes, **kwargs):
+    app = ProbeApp()
+    phy = VirtualHostPhy(app, **kwargs)
+    dev = USBProbeDevice(app, phy, classes)
+    try:
+        dev.connect()
+        phy.run()
+    finally:
+        dev.disconnect()
+    return app, phy, dev
+
+
+def test_probe_groups_respect_endpoint_budget():
+    groups, single = probe_groups(['audio', 'hub', 'keyboard', 'mass_storage', 'smartcard'], max_endpoint=5)
+    assert groups == [('audio', 'keyboard', 'mass_storage'), ('smartcard',)]
+    assert single == ['hub']
+
+
+def test_function_endpoint_counts(disk_dir):
+    app = ProbeApp()
+    phy = VirtualHostPhy(app)
+    total = sum(FUNCTION_ENDPOINTS.values())
+    dev = USBProbeDevice(app, phy, sorted(FUNCTION_ENDPOINTS), max_endpoint=total)
+    try:
+        for function in dev.functions:
+            assert len(function.endpoint_addresses) == FUNCTION_ENDPOINTS[function.name]
+    finally:
+        dev.disconnect()
+    with pytest.raises(ValueError):
+        USBProbeDevice(app, phy, sorted(FUNCTION_ENDPOINTS), max_endpoint=total - 1)
+
+
+def test_probe_attributes_support_per_function(disk_dir):
+    app, phy, dev = _probe(('keyboard', 'cdc_acm', 'mass_storage', 'smartcard'))
+    assert dev.was_configured
+    functions = dev.supported_functions()
+    assert functions['mass_storage']
+    assert functions['smartcard']
+    assert functions['keyboard'] is None
+    assert phy.stats['scsi_commands'] == 6
+    assert phy.stats['ccid_messages'] == 5
+    # not all functions are supported, the test is not ended early
+    assert app.supported == []
+
+
+def test_probe_configuration_descriptor(disk_dir):
+    app, phy, dev = _probe(('keyboard', 'cdc_acm'))
+    assert phy.device_descriptor[4:7] == b'\xef\x02\x01'
+    descriptors = list(_descriptors(phy.configuration_descriptor))
+    assert descriptors[0][4] == 3
+    interfaces = [d for d in descriptors if d[1] == DescriptorType.interface]
+    assert [d[2] for d in interfaces] == [0, 1, 2]
+    iads = [d for d in descriptors if d[1] == DescriptorType.interface_association]
+    # only the CDC function has more than one interface
+    assert iads == [struct.pack('8B', 8, 0x0b, 1, 2, 0x02, 0x02, 0x01, 0)]
+    union = [d for d in descriptors if d[1] == DescriptorType.cs_interface and d[2] == 0x06]
+    assert union == [b'\x05\x24\x06\x01\x02']
+    endpoints = [d[2] & 0x0f for d in descriptors if d[1] == DescriptorType.endpoint]
+    assert sorted(endpoints) == [1, 2, 3, 4]
+
+
+def test_probe_translates_class_request_index(disk_dir):
+    app = ProbeApp()
+    phy = VirtualHostPhy(app)
+    dev = USBProbeDevice(app, phy, ('keyboard', 'audio'))
+    try:
+        dev.connect()
+        phy.control_transfer(0x00, 0x09, 1)
+        # GET_CUR of feature unit 9, on the audio control interface (now 1)
+        response = phy.control_transfer(0xa1, 0x81, 0x0100, 0x0901, 1)
+        assert response == b'\x00'
+        assert dev.supported_functions()['audio']
+        assert dev.supported_functions()['keyboard'] is None
+    finally:
+        dev.disconnect()
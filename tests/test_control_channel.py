@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from numap.fuzz.channel import CONNECT, DISCONNECT, ControlClient, ControlServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = ControlServer(str(tmp_path / 'control.sock'))
+    server.start()
+    yield server
+    server.stop()
+
+
+def _device_side(client, executed, count):
+    for _ in range(count):
+        name, seq = client.wait_command(timeout=5)
+        executed.append(name)
+        client.ack(seq)
+
+
+def test_commands_are_acknowledged(server):
+    client = ControlClient(server.path)
+    assert client.connect(timeout=5)
+    executed = []
+    device = threading.Thread(target=_device_side, args=(client, executed, 2))
+    device.start()
+    try:
+        assert server.send_command(DISCONNECT, timeout=5)
+        assert server.send_command(CONNECT, timeout=5)
+    finally:
+        device.join(5)
+        client.close()
+    assert executed == [DISCONNECT, CONNECT]
+
+
+def test_command_waits_for_the_device_side(server):
+    # sent when the device side connects
+    result = []
+    fuzzer = threading.Thread(target=lambda: result.append(server.send_command(CONNECT, timeout=5)))
+    fuzzer.start()
+    time.sleep(0.05)
+    client = ControlClient(server.path)
+    assert client.connect(timeout=5)
+    try:
+        name, seq = client.wait_command(timeout=5)
+        assert name == CONNECT
+        assert client.poll() is None
+        client.ack(seq)
+        fuzzer.join(5)
+    finally:
+        client.close()
+    assert result == [True]
+
+
+def test_unacknowledged_command_times_out(server):
+    client = ControlClient(server.path)
+    assert client.connect(timeout=5)
+    try:
+        assert not server.send_command(DISCONNECT, timeout=0.1)
+    finally:
+        client.close()
+
+
+def test_heartbeat(server):
+    assert server.last_heartbeat == 0
+    client = ControlClient(server.path)
+    assert client.connect(timeout=5)
+    try:
+        client.heartbeat()
+        deadline = time.monotonic() + 5
+        while not server.last_heartbeat and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        client.close()
+    assert server.last_heartbeat > 0
+
+
+def test_client_connect_timeout(tmp_path):
+    client = ControlClient(str(tmp_path / 'missing.sock'))
+    assert not client.connect(timeout=0.05, retry_interval=0.01)
+
+
+def test_wait_returns_when_server_stops(server):
+    client = ControlClient(server.path)
+    assert client.connect(timeout=5)
+    server.stop()
+    assert client.wait_command(timeout=5) is None
+    assert client.closed
+    client.close()
+
+
+def test_client_reconnects_to_restarted_server(server):
+    client = ControlClient(server.path)
+    assert client.connect(timeout=5)
+    try:
+        server.stop()
+        assert client.wait_command(timeout=5) is None
+        assert not client.reconnect(timeout=0)
+        # numapkitty restarts and sends its first command before the device side is back
+        restarted = ControlServer(server.path)
+        restarted.start()
+        result = []
+        fuzzer = threading.Thread(target=lambda: result.append(restarted.send_command(DISCONNECT, timeout=5)))
+        fuzzer.start()
+        try:
+            assert client.reconnect(timeout=5)
+            assert not client.closed
+            name, seq = client.wait_command(timeout=5)
+            assert name == DISCONNECT
+            client.ack(seq)
+            fuzzer.join(5)
+        finally:
+            restarted.stop()
+    finally:
+        client.close()
+    assert result == [True]
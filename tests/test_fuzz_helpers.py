@@ -0,0 +1,126 @@
+"""Tests for :mod:`numap.fuzz.helpers`."""
+
+from __future__ import annotations
+
+import logging
+
+from numap.fuzz import helpers
+from numap.fuzz.helpers import mutable, set_fuzz_path
+
+
+class DummyApp:
+    def __init__(self, fuzzer=None):
+        self.fuzzer = fuzzer
+        self.stages = []
+
+    def get_mutation(self, stage, data=None):
+        self.stages.append(stage)
+        return b'mutated' if self.fuzzer else None
+
+
+class DummyActor:
+    session_data = {}
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger('numap')
+
+    def get_mutation(self, stage, data=None):
+        return self.app.get_mutation(stage, data)
+
+    def get_session_data(self, stage):
+        return self.session_data
+
+    def info(self, msg, *args):
+        pass
+
+    def debug(self, msg, *args):
+        pass
+
+    @mutable('dummy_response')
+    def get_response(self):
+        return b'valid'
+
+
+def test_mutable_skips_fuzzer_without_fuzzer():
+    app = DummyApp()
+    actor = DummyActor(app)
+
+    assert actor.get_response() == b'valid'
+    assert app.stages == []
+    assert app.fuzz_path_enabled is False
+
+
+def test_mutable_queries_attached_fuzzer():
+    app = DummyApp(fuzzer=object())
+    actor = DummyActor(app)
+
+    assert actor.get_response() == b'mutated'
+    assert app.stages == ['dummy_response']
+
+
+def test_set_fuzz_path_reenables_full_path():
+    app = DummyApp()
+    actor = DummyActor(app)
+    actor.get_response()
+
+    set_fuzz_path(app)
+    actor.get_response()
+
+    assert app.stages == ['dummy_response']
+
+
+def test_mutable_full_path_while_recording_stages(monkeypatch, tmp_path):
+    logger = helpers.StageLogger(str(tmp_path / 'stages'))
+    logger.fd = object()
+    logger.log_stage = lambda stage: None
+    monkeypatch.setattr(helpers, 'stage_logger', logger)
+    app = DummyApp()
+
+    DummyActor(app).get_response()
+
+    assert app.stages == ['dummy_response']
+
+
+def test_stage_logger_records_time_and_request(monkeypatch, tmp_path):
+    from numap.apps.base import NumapApp
+    from numap.fuzz.stages import get_stages
+    from numap.phy.vhost import VirtualHostPhy
+
+    stage_file = tmp_path / 'stages'
+    logger = helpers.StageLogger(str(stage_file), flush_interval=60)
+    monkeypatch.setattr(helpers, 'stage_logger', logger)
+    logger.start()
+    app = NumapApp()
+    phy = VirtualHostPhy(app)
+    dev = app.load_device('keyboard', phy)
+    dev.connect()
+    phy.run()
+    dev.disconnect()
+    # nothing is written until the buffer is flushed
+    assert stage_file.read_bytes() == b''
+    logger.stop()
+    assert logger.fd is None
+
+    lines = [line.split() for line in stage_file.read_text().splitlines()]
+    assert lines[0] == ['device_descriptor', lines[0][1], '80', '06', '0100', '0040']
+    times = [float(line[1]) for line in lines]
+    assert times == sorted(times)
+    assert all(len(line) == 6 for line in lines)
+    stages = get_stages(str(stage_file))
+    assert stages['device_descriptor'] >= 1
+    assert 'configuration_descriptor' in stages
+
+
+def test_stage_logger_idle_time_follows_repeated_stages(monkeypatch, tmp_path):
+    now = [10.0]
+    monkeypatch.setattr(helpers.time, 'monotonic', lambda: now[0])
+    logger = helpers.StageLogger(str(tmp_path / 'stages'))
+    logger.fd = object()
+    logger.log_stage('scsi_read_10_response')
+    now[0] = 12.0
+    # a known stage, e.g. the polling of the host, keeps the recording going
+    logger.log_stage('scsi_read_10_response')
+    assert logger.last_stage_time == 12.0
+    assert logger.new_cycle('cycle 2') == {'scsi_read_10_response': 2}
+    assert logger.last_stage_time is None
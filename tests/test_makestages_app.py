@@ -0,0 +1,66 @@
+import numap.utils.settle as settle
+from numap.apps.makestages import NumapMakeStagesApp
+from numap.fuzz.stages import RLE_HEADER, get_stages
+
+
+class VhostMakeStagesApp(NumapMakeStagesApp):
+    def load_device(self, dev_name, phy):
+        dev = super(VhostMakeStagesApp, self).load_device(dev_name, phy)
+        # the virtual host drives the device
+        dev.run = phy.run
+        return dev
+
+
+def _options(stage_file, **kwargs):
+    options = {
+        '--phy': 'vhost',
+        '--class': 'keyboard',
+        '--stage-file': str(stage_file),
+        '--timeout': '5',
+        '--idle': '1000',
+        '--cycles': '1',
+    }
+    options.update(kwargs)
+    return options
+
+
+def test_single_cycle_writes_trace(tmp_path):
+    stage_file = tmp_path / 'stages'
+    app = VhostMakeStagesApp(_options(stage_file))
+    app.run()
+    lines = stage_file.read_text().splitlines()
+    assert lines[0].startswith('# cycle 1 ')
+    assert lines[-1].startswith('# end of cycle 1 ')
+    assert get_stages(str(stage_file))['device_descriptor'] >= 1
+
+
+def test_cycles_merge_highest_counts(monkeypatch, tmp_path):
+    monkeypatch.setattr(settle.time, 'sleep', lambda _seconds: None)
+    stage_file = tmp_path / 'stages'
+    single_file = tmp_path / 'single'
+    VhostMakeStagesApp(_options(single_file)).run()
+    app = VhostMakeStagesApp(_options(stage_file, **{'--cycles': '3'}))
+    app.run()
+    assert stage_file.read_text().startswith(RLE_HEADER + '\n')
+    # counts of a single cycle, not the sum of the cycles
+    assert get_stages(str(stage_file)) == get_stages(str(single_file))
+    trace = (tmp_path / 'stages.trace').read_text()
+    assert trace.count('# cycle ') == 3
+
+
+def test_idle_stops_recording(monkeypatch, tmp_path):
+    app = NumapMakeStagesApp(_options(tmp_path / 'stages', **{'--idle': '100'}))
+    now = [100.0]
+    monkeypatch.setattr('numap.apps.makestages.time.monotonic', lambda: now[0])
+    app.start_time = 100.0
+    app.stage_logger = type('Logger', (), {'last_stage_time': None})()
+    now[0] = 102.0
+    # no stage yet, wait for the host up to the timeout
+    assert not app.should_stop_phy()
+    app.stage_logger.last_stage_time = 101.95
+    assert not app.should_stop_phy()
+    app.stage_logger.last_stage_time = 101.5
+    assert app.should_stop_phy()
+    app.stage_logger.last_stage_time = None
+    now[0] = 106.0
+    assert app.should_stop_phy()
@@ -1,7 +1,8 @@
 import asyncio
+import time
 from types import SimpleNamespace
 
-import numap.apps.scan as scan
+import numap.utils.settle as settle
 from numap.apps.scan import NumapScanApp
 
 
@@ -55,10 +56,82 @@ class TimeoutScanApp(NumapScanApp):
 
 def test_scan_app_times_out_and_disconnects(monkeypatch):
     app = TimeoutScanApp()
-    monkeypatch.setattr(scan.time, 'sleep', lambda _seconds: None)
+    monkeypatch.setattr(settle.time, 'sleep', lambda _seconds: None)
 
     app.run()
 
     assert app.device.disconnect_called
     assert getattr(app, 'phy_disconnected', False)
     assert any('Timed out' in message for message in app.logger.error_messages)
+
+
+class SupportedDevice(TimeoutDevice):
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+
+    async def run(self):
+        self.app.signal_setup_packet_received()
+        self.app.usb_function_supported('test')
+        await asyncio.sleep(10)
+
+
+def test_scan_app_stops_when_supported(monkeypatch):
+    app = TimeoutScanApp()
+    app.timeout_seconds = 10
+    app.load_device = lambda device_name, phy: SupportedDevice(app)
+    monkeypatch.setattr(settle.time, 'sleep', lambda _seconds: None)
+
+    start = time.monotonic()
+    app.run()
+
+    assert time.monotonic() - start < 2
+    assert app.test_completion.reason == 'supported'
+    assert app.logger.error_messages == []
+
+
+def test_probe_falls_back_to_single_classes():
+    app = TimeoutScanApp()
+    app.options['--probe'] = True
+    app.umap_classes = ['hub', 'keyboard', 'printer']
+    tested = []
+
+    def test_item(runner, phy, item):
+        tested.append(item)
+        if isinstance(item, tuple):
+            # the host did not configure the composite device
+            return {'supported': False, 'configured': False, 'functions': {}, 'failed': []}
+        return {'supported': item == 'printer'}
+
+    app.test_item = test_item
+    assert app.scan_classes(None, None) == ['printer']
+    assert tested == [('keyboard', 'printer'), 'hub', 'keyboard', 'printer']
+
+
+class ShortenedSettle(settle.Settle):
+
+    def __init__(self):
+        super().__init__(2.0)
+        self.missed_count = 0
+
+    def shortened(self):
+        return not self.missed_count
+
+    def missed(self):
+        self.missed_count += 1
+
+
+def test_miss_after_shortened_settle_is_tested_again():
+    app = TimeoutScanApp()
+    app.logger.warning = lambda *args: None
+    app.settle = ShortenedSettle()
+    attempts = []
+
+    def test_item_once(runner, phy, item):
+        attempts.append(item)
+        return {'supported': len(attempts) == 2, 'responded': len(attempts) == 2}
+
+    app.test_item_once = test_item_once
+    assert app.test_item(None, None, 'keyboard') == {'supported': True, 'responded': True}
+    assert attempts == ['keyboard', 'keyboard']
+    assert app.settle.missed_count == 1
@@ -0,0 +1,70 @@
+import pytest
+
+from numap.apps.vsscan import DBEntry, _ScanSession
+from numap.utils.scan_journal import JournalError, ScanJournal
+
+
+def _session(entries=10):
+    session = _ScanSession()
+    session.db = [DBEntry(0x1234, pid, drivers={'Linux': 'drv%d' % (pid % 3)}) for pid in range(entries)]
+    return session
+
+
+def _scan(session, journal, results):
+    for index, result in enumerate(results):
+        record = {'type': 'entry', 'index': index, 'result': result}
+        if result == 'supported':
+            record['info'] = 'num_endpoints = 2'
+            record['driver'] = session.db[index].drivers['Linux']
+        session.apply(record)
+        journal.append(record)
+        if journal.should_compact():
+            journal.compact(session.snapshot())
+
+
+def test_journal_replay_restores_session(tmp_path):
+    path = str(tmp_path / 'scan.journal')
+    journal = ScanJournal(path, compact_every=4)
+    journal.create({'db': None, 'vid_pid': '1234:0000-000a', 'timeout': 5, 'entries': 10})
+    session = _session()
+    _scan(session, journal, ['unsupported', 'supported', 'skipped', 'unsupported', 'unsupported', 'supported'])
+    record = {'type': 'no_response', 'index': 6, 'prev': 5}
+    session.apply(record)
+    journal.append(record)
+    journal.close()
+
+    header, records = ScanJournal(path).load()
+    resumed = _session()
+    for record in records:
+        resumed.apply(record)
+
+    assert header['vid_pid'] == '1234:0000-000a'
+    assert resumed.current == 6
+    assert resumed.supported_indexes == [1, 5]
+    assert resumed.supported_drivers == {'drv1', 'drv2'}
+    assert resumed.supported[0].info == 'num_endpoints = 2'
+    assert resumed.no_response == {6: 5}
+    # compaction kept the journal short
+    assert len(records) < 7
+
+
+def test_journal_ignores_truncated_record(tmp_path):
+    path = str(tmp_path / 'scan.journal')
+    journal = ScanJournal(path)
+    journal.create({'db': None, 'vid_pid': '1:2', 'timeout': 5, 'entries': 1})
+    journal.append({'type': 'entry', 'index': 0, 'result': 'unsupported'})
+    journal.close()
+    with open(path, 'a') as f:
+        f.write('{"type": "entr')
+
+    _, records = ScanJournal(path).load()
+
+    assert records == [{'type': 'entry', 'index': 0, 'result': 'unsupported'}]
+
+
+def test_journal_rejects_other_files(tmp_path):
+    path = tmp_path / 'scan.journal'
+    path.write_text('not a journal\n')
+
+    with pytest.raises(JournalError):
+        ScanJournal(str(path)).load()
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from numap.apps.base import NumapApp
+from numap.apps.scan_runner import ScanRunner
+
+
+class PollingDevice:
+    '''
+    Device with a synchronous run, like the PHYs that poll should_stop_phy
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self.threads = set()
+
+    def connect(self):
+        self.threads.add(threading.current_thread())
+
+    def run(self):
+        self.threads.add(threading.current_thread())
+        while not self.app.should_stop_phy():
+            time.sleep(0.001)
+
+
+class ScanApp(NumapApp):
+
+    def should_stop_phy(self):
+        return self.test_completion.check()
+
+
+class HangingDevice:
+
+    def __init__(self):
+        self.cancelled = False
+
+    def connect(self):
+        pass
+
+    async def run(self):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+def test_runner_uses_one_loop_and_executor():
+    app = ScanApp()
+    app.test_completion.timeout = 0.02
+    runner = ScanRunner(app)
+    device = PollingDevice(app)
+    try:
+        for _ in range(3):
+            app.test_completion.start()
+            assert runner.run_test(device, timeout=5) == 'host-gone'
+        loop = runner.loop
+        assert not loop.is_closed()
+    finally:
+        runner.close()
+    assert loop.is_closed()
+    assert threading.main_thread() not in device.threads
+
+
+def test_runner_timeout_cancels_test():
+    app = ScanApp()
+    app.test_completion.timeout = 10
+    app.test_completion.start()
+    runner = ScanRunner(app)
+    device = HangingDevice()
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            runner.run_test(device, timeout=0.05)
+    finally:
+        runner.close()
+    assert device.cancelled
+    assert app.test_completion.is_set()
@@ -0,0 +1,38 @@
+import json
+
+from numap.utils.scan_schedule import ScheduledDB, driver_schedule, load_hits, update_hits
+from numap.utils.vid_pid_db import OS, DBEntry
+
+
+def _db():
+    drivers = ['a', 'a', None, 'b', 'c', 'c', 'c', None, 'b', 'a']
+    return [
+        DBEntry(0x1234, pid, drivers={OS.LINUX: driver} if driver else None)
+        for pid, driver in enumerate(drivers)
+    ]
+
+
+def test_driver_schedule_tests_one_entry_per_driver_first():
+    db = _db()
+
+    order = driver_schedule(db, OS.LINUX)
+
+    # representatives: 'a' and 'c' have 3 entries, 'b' has 2
+    assert list(order[:3]) == [0, 4, 3]
+    assert list(order[3:5]) == [2, 7]
+    assert sorted(order) == list(range(len(db)))
+    scheduled = ScheduledDB(db, order)
+    assert [e.pid for e in scheduled][:3] == [0, 4, 3]
+    assert scheduled[3].pid == 2
+
+
+def test_driver_schedule_uses_prior_hits(tmp_path):
+    hits_file = str(tmp_path / 'hits.json')
+    update_hits(hits_file, {'b'})
+    update_hits(hits_file, {'b', 'c'})
+
+    assert load_hits(hits_file) == {'b': 2, 'c': 1}
+    order = driver_schedule(_db(), OS.LINUX, load_hits(hits_file))
+    assert list(order[:3]) == [3, 4, 0]
+    with open(hits_file) as f:
+        assert json.load(f) == {'b': 2, 'c': 1}
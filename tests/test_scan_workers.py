@@ -0,0 +1,126 @@
+import os
+import queue
+import time
+
+from numap.apps.scan_workers import _worker_main, worker_options
+from numap.apps.vsscan import NumapVSScanApp
+from numap.utils.scan_journal import ScanJournal
+
+
+class FakeVSScanApp(NumapVSScanApp):
+    '''
+    Tests entries without a device: pid % 3 == 0 is supported,
+    the first board to test pid 5 dies.
+    '''
+
+    def load_phy(self, phy_string):
+        return phy_string
+
+    def test_item(self, runner, phy, index):
+        db_entry = self.scan_session.db[index]
+        time.sleep(0.01)
+        if db_entry.pid == 5:
+            marker = os.environ['NUMAP_TEST_MARKER']
+            if not os.path.exists(marker):
+                open(marker, 'w').close()
+                return {'supported': False, 'setup_packet_received': False, 'timed_out': False, 'host_dead': True}
+        return {
+            'supported': db_entry.pid % 3 == 0,
+            'info': 'tested on %s' % phy,
+            'setup_packet_received': True,
+            'timed_out': False,
+            'host_dead': False,
+        }
+
+
+def _options(tmp_path, phys):
+    return {
+        '--phy': phys, '--quiet': True, '--verbose': 0, '--db': None, '--vid_pid': '1234:0000-0010',
+        '--timeout': None, '--test_timeout': None, '--idle': None, '--single_step': False, '--between': '0',
+        '--adaptive': False, '--host-id': None, '--resume': str(tmp_path / 'scan.journal'), '--os': None,
+        '--exhaustive': False, '--stride': None, '--sample': None,
+    }
+
+
+def test_parallel_vsscan_merges_results(tmp_path, monkeypatch):
+    monkeypatch.setenv('NUMAP_TEST_MARKER', str(tmp_path / 'died'))
+    app = FakeVSScanApp(_options(tmp_path, ['board-a', 'board-b']))
+
+    app.run()
+
+    session = app.scan_session
+    assert session.current == 16
+    assert session.supported_indexes == [0, 3, 6, 9, 12, 15]
+    assert {e.info for e in session.supported} <= {'tested on board-a', 'tested on board-b'}
+    # the board that died is recorded, the entry was tested on the other one
+    assert list(session.no_response) == [5]
+    assert session.no_response_phys[5] in ('board-a', 'board-b')
+
+    # the journal has the results in db order
+    _, records = ScanJournal(str(tmp_path / 'scan.journal')).load()
+    indexes = [r['index'] for r in records if r['type'] == 'entry']
+    assert indexes == list(range(16))
+
+
+def test_worker_options_give_each_board_its_own_log_file():
+    options = {'--phy': ['greatfet:a1', 'greatfet:b2'], '--host-id': 'lab', '--log-file': 'scan.log'}
+    options_a = worker_options(options, 'greatfet:a1')
+    assert options_a['--phy'] == 'greatfet:a1'
+    assert options_a['--host-id'] == 'lab@greatfet:a1'
+    assert options_a['--log-file'] == 'scan.log.greatfet_a1'
+    assert worker_options(options, 'greatfet:b2')['--log-file'] == 'scan.log.greatfet_b2'
+    assert options['--log-file'] == 'scan.log'
+
+
+class BrokenSaveSettle(object):
+
+    def save(self):
+        raise OSError('read-only profile file')
+
+
+class BrokenSaveApp(object):
+
+    def __init__(self, options):
+        self.stop_signal_received = False
+        self.settle = BrokenSaveSettle()
+
+    def prepare_worker(self):
+        pass
+
+    def load_phy(self, phy_info):
+        return phy_info
+
+    def test_item(self, runner, phy, item):
+        return {'supported': True}
+
+
+def test_worker_reports_exit_when_settle_save_fails():
+    tasks = queue.Queue()
+    results = queue.Queue()
+    tasks.put(1)
+    tasks.put(None)
+    _worker_main(BrokenSaveApp, {}, 'board-a', tasks, results)
+    messages = [results.get_nowait() for _ in range(results.qsize())]
+    assert messages[1] == ('board-a', 1, {'supported': True})
+    phy_info, item, error = messages[-1]
+    assert (phy_info, item) == ('board-a', None)
+    assert 'read-only profile file' in error['error']
+
+
+def test_vsscan_miss_after_shortened_settle_is_not_a_dead_host(tmp_path):
+    app = NumapVSScanApp(_options(tmp_path, None))
+    app.settle.shortened = lambda: app.settle.delay < 5
+    app.settle.missed = lambda: setattr(app.settle, 'delay', 5)
+    app.settle.delay = 0.5
+    attempts = []
+
+    def test_entry(runner, phy, index):
+        attempts.append(app.settle.delay)
+        return {'supported': False, 'setup_packet_received': len(attempts) == 2, 'timed_out': False}
+
+    app.test_entry = test_entry
+    assert not app.test_item(None, None, 0)['host_dead']
+    assert attempts == [0.5, 5]
+    # a miss at the maximum delay is
+    assert app.test_item(None, None, 0)['host_dead']
+    assert attempts == [0.5, 5, 5]
@@ -0,0 +1,59 @@
+import io
+
+import pytest
+
+from numap.fuzz.stages import (
+    RLE_HEADER, StagePlan, StageRun, count_stages, encode_runs, get_stages, iter_stage_runs, write_stage_runs,
+)
+
+
+def test_plain_stage_file_counts_in_first_seen_order(tmp_path):
+    stage_file = tmp_path / 'stages'
+    stage_file.write_text(
+        'device_descriptor\nconfiguration_descriptor\nconfiguration_descriptor\n'
+        '\nscsi_inquiry_response\ndevice_descriptor\nscsi_inquiry_response 0.5 extra\n'
+    )
+    stages = get_stages(str(stage_file))
+    assert list(stages.items()) == [
+        ('device_descriptor', 2),
+        ('configuration_descriptor', 2),
+        ('scsi_inquiry_response', 2),
+    ]
+
+
+def test_plain_lines_are_collapsed_to_runs():
+    runs = list(iter_stage_runs(['a\n', 'a\n', 'b\n', 'a\n']))
+    assert runs == [StageRun('a', 2, None, None), StageRun('b', 1, None, None), StageRun('a', 1, None, None)]
+
+
+def test_rle_round_trip(tmp_path):
+    recorded = [('a', 0.0), ('a', 0.1), ('b', 0.25), ('a', 1.0)]
+    runs = list(encode_runs(recorded))
+    assert runs[1] == StageRun('b', 1, 0.25, pytest.approx(0.15))
+    stage_file = tmp_path / 'stages.rle'
+    with open(str(stage_file), 'w') as f:
+        write_stage_runs(f, runs)
+    assert stage_file.read_text().startswith(RLE_HEADER + '\n')
+    with open(str(stage_file), 'r') as f:
+        loaded = list(iter_stage_runs(f))
+    assert [(r.stage, r.count) for r in loaded] == [('a', 2), ('b', 1), ('a', 1)]
+    assert loaded[2].gap == pytest.approx(0.75)
+    assert get_stages(str(stage_file)) == {'a': 3, 'b': 1}
+
+
+def test_rle_without_timestamps():
+    lines = io.StringIO(RLE_HEADER + '\nscsi_read_10_response 40000\nscsi_csw 40000\n')
+    assert count_stages(iter_stage_runs(lines)) == {'scsi_read_10_response': 40000, 'scsi_csw': 40000}
+
+
+def test_invalid_rle_run():
+    with pytest.raises(ValueError):
+        list(iter_stage_runs([RLE_HEADER, 'device_descriptor two'], 'bad.rle'))
+
+
+def test_stage_plan():
+    assert StagePlan().may_mutate('device_descriptor')
+    plan = StagePlan(['device_descriptor', 'configuration_descriptor'])
+    assert plan.may_mutate('configuration_descriptor')
+    assert not plan.may_mutate('string_descriptor')
+    assert not StagePlan([]).may_mutate('device_descriptor')
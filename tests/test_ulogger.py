@@ -0,0 +1,82 @@
+"""Tests for :mod:`numap.utils.ulogger`."""
+
+from __future__ import annotations
+
+import logging
+import queue
+
+from numap.core.usb_base import USBBaseActor
+from numap.utils import ulogger
+from numap.utils.ulogger import set_default_handler_level
+
+
+class FormatCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count += 1
+        return 'formatted'
+
+
+def test_quiet_level_skips_message_formatting():
+    actor = USBBaseActor(app=None, phy=None)
+    counter = FormatCounter()
+    logger = logging.getLogger('numap')
+    handlers = logger.handlers
+    previous = ulogger.stdio_handler.level
+    logger.handlers = [ulogger.stdio_handler]
+    try:
+        set_default_handler_level(logging.WARNING)
+        actor.debug('request: %s', counter)
+        actor.verbose('request: %s', counter)
+        assert counter.count == 0
+    finally:
+        logger.handlers = handlers
+        set_default_handler_level(previous)
+
+
+def test_background_logging_writes_log_file(tmp_path):
+    log_file = tmp_path / 'numap.log'
+    logger = logging.getLogger('numap')
+    handlers = logger.handlers
+    previous = ulogger.stdio_handler.level
+    logger.handlers = [ulogger.stdio_handler]
+    try:
+        set_default_handler_level(logging.INFO)
+        ulogger.start_background_logging(log_file=str(log_file))
+        assert logger.handlers == [ulogger.queue_handler]
+        assert ulogger.queue_handler.level == logging.INFO
+        logger.info('hello %s', 'world')
+        logger.debug('not written')
+        assert ulogger.stop_background_logging() == 0
+        assert logger.handlers == [ulogger.stdio_handler]
+        content = log_file.read_text()
+        assert 'hello world' in content
+        assert 'not written' not in content
+    finally:
+        ulogger.stop_background_logging()
+        logger.handlers = handlers
+        set_default_handler_level(previous)
+
+
+def test_dropping_queue_handler_counts_overflow():
+    handler = ulogger.DroppingQueueHandler(queue.Queue(1))
+    record = logging.LogRecord('numap', logging.INFO, __file__, 1, 'msg %s', ('arg',), None)
+    for _ in range(3):
+        handler.handle(record)
+    assert handler.dropped == 2
+    assert handler.queue.get_nowait().args == ('arg',)
+
+
+def test_queued_buffers_are_copied_when_logged():
+    handler = ulogger.DroppingQueueHandler(queue.Queue())
+    buf = bytearray(b'\x01\x02')
+    record = logging.LogRecord('numap', logging.DEBUG, __file__, 1, 'data: %s', (ulogger.LazyHex(buf),), None)
+    handler.handle(record)
+    buf[:] = b'\xff\xff'
+    queued = handler.queue.get_nowait()
+    # formatted on the listener thread, from the copy
+    assert queued.msg == 'data: %s'
+    assert queued.getMessage() == 'data: 0102'
+    assert record.getMessage() == 'data: ffff'
@@ -1,3 +1,5 @@
+import struct
+
 import numap.core.usb_device as usb_device
 from numap.core.usb import DescriptorType
 
@@ -6,6 +8,12 @@ class DummyApp:
     def get_mutation(self, stage, data=None):
         return None
 
+    def signal_setup_packet_received(self):
+        pass
+
+    def signal_device_configured(self):
+        pass
+
     def usb_function_supported(self, reason=None):
         pass
 
@@ -14,6 +22,7 @@ class DummyPhy:
     def __init__(self):
         self.connected_device = None
         self.disconnected = False
+        self.sent = []
 
     def connect(self, device):
         self.connected_device = device
@@ -22,7 +31,10 @@ class DummyPhy:
         self.disconnected = True
 
     def send_on_endpoint(self, ep, data):
-        pass
+        self.sent.append((ep, data))
+
+    def stall_ep0(self):
+        self.sent.append((0, None))
 
     def ack_status_stage(self):
         pass
@@ -118,3 +130,211 @@ def test_get_string_descriptor_supports_byte_values(monkeypatch):
     assert descriptor[0] == len(descriptor)
     assert descriptor[1] == DescriptorType.string
     assert descriptor[2:] == '00001'.encode('utf-16-le')
+
+
+def test_string_table_interns_strings_and_languages(monkeypatch):
+    dev, _ = _make_device(monkeypatch, manufacturer_string='m', product_string='p')
+    assert dev.get_string_id('p') == dev.product_string_id
+    assert dev.strings == ['m', 'p', 'n']
+
+    dev.set_string_translation(dev.product_string_id, 0x0407, 'Produkt')
+    assert dev.get_string0_descriptor() == struct.pack('<BBHH', 6, DescriptorType.string, 0x0409, 0x0407)
+    german = dev.handle_get_string_descriptor_request(dev.product_string_id, 0x0407)
+    assert german[2:] == 'Produkt'.encode('utf-16-le')
+    # unsupported language falls back to the default one
+    other = dev.handle_get_string_descriptor_request(dev.product_string_id, 0x0403)
+    assert other[2:] == 'p'.encode('utf-16-le')
+
+
+def _get_device_descriptor_request():
+    return struct.pack('<BBHHH', 0x80, 0x06, DescriptorType.device << 8, 0, 0x12)
+
+
+def _count_descriptor_builds(dev, dtype):
+    builds = []
+    build = dev.descriptors[dtype]
+
+    def counting_build(*args, **kwargs):
+        builds.append(args)
+        return build(*args, **kwargs)
+
+    dev.descriptors[dtype] = counting_build
+    return builds
+
+
+def test_device_descriptor_is_cached(monkeypatch):
+    dev, phy = _make_device(monkeypatch)
+    builds = _count_descriptor_builds(dev, DescriptorType.device)
+
+    dev.handle_request(_get_device_descriptor_request())
+    dev.handle_request(_get_device_descriptor_request())
+
+    assert len(builds) == 1
+    assert phy.sent[0] == phy.sent[1]
+
+
+def test_descriptor_cache_ignores_wIndex_of_non_string_descriptors(monkeypatch):
+    dev, phy = _make_device(monkeypatch)
+    builds = _count_descriptor_builds(dev, DescriptorType.device)
+
+    for index in range(100):
+        dev.handle_request(struct.pack('<BBHHH', 0x80, 0x06, 0x0100, index, 0x40))
+
+    assert len(builds) == 1
+    assert len(dev._descriptor_cache) == 1
+
+
+def test_descriptor_cache_invalidated_on_attribute_change(monkeypatch):
+    dev, phy = _make_device(monkeypatch)
+    builds = _count_descriptor_builds(dev, DescriptorType.device)
+
+    dev.handle_request(_get_device_descriptor_request())
+    dev.vendor_id = 0x1234
+    dev.handle_request(_get_device_descriptor_request())
+
+    assert len(builds) == 2
+    assert struct.unpack('<H', phy.sent[1][1][8:10])[0] == 0x1234
+
+
+def test_only_descriptor_actors_hook_attribute_assignment():
+    from numap.core.usb_base import USBBaseActor
+    from numap.core.usb_interface import USBInterface
+    from numap.dev.mass_storage import ScsiDevice
+
+    assert USBBaseActor.__setattr__ is object.__setattr__
+    assert ScsiDevice.__setattr__ is object.__setattr__
+    assert usb_device.USBDevice.__setattr__ is not object.__setattr__
+    assert USBInterface.__setattr__ is not object.__setattr__
+
+
+def test_descriptor_cache_bypassed_when_fuzzing(monkeypatch):
+    dev, _ = _make_device(monkeypatch)
+    dev.app.fuzzer = object()
+    builds = _count_descriptor_builds(dev, DescriptorType.device)
+
+    dev.handle_request(_get_device_descriptor_request())
+    dev.handle_request(_get_device_descriptor_request())
+
+    assert len(builds) == 2
+
+
+def test_request_dispatch_built_on_connect(monkeypatch):
+    dev, _ = _make_device(monkeypatch)
+    monkeypatch.setattr(usb_device.BaseUSBDevice, 'connect', lambda self, backend=None: None, raising=False)
+
+    dev.connect()
+
+    assert (0x80, 0x06, 0) in dev._request_dispatch
+    assert (0x00, 0x05, 0) in dev._request_dispatch
+
+
+def test_unhandled_requests_are_counted(monkeypatch):
+    dev, phy = _make_device(monkeypatch)
+    request = struct.pack('<BBHHH', 0x80, 0x42, 0, 0, 0)
+
+    dev.handle_request(request)
+    dev.handle_request(request)
+
+    assert dev.unhandled_requests[(0x80, 0x42)] == 2
+    assert phy.sent == [(0, b''), (0, b'')]
+
+
+def test_request_dispatch_is_bounded_by_wIndex(monkeypatch):
+    dev, phy = _make_device(monkeypatch)
+    monkeypatch.setattr(usb_device.BaseUSBDevice, 'connect', lambda self, backend=None: None, raising=False)
+    dev.connect()
+    size = len(dev._request_dispatch)
+
+    for index in range(5000):
+        dev.handle_request(struct.pack('<BBHHH', 0xc0, 0x42, 0, index, 0))
+        dev.handle_request(struct.pack('<BBHHH', 0x81, 0x06, 0x2200, index, 0))
+    # a string descriptor with a LANGID uses the prebuilt entry
+    dev.handle_request(struct.pack('<BBHHH', 0x80, 0x06, 0x0301, 0x0409, 0xff))
+
+    assert (0xc0, 0x42, 0) in dev._request_dispatch
+    assert len(dev._request_dispatch) <= size + 1 + 256
+
+
+def test_request_to_unknown_interface_stalls(monkeypatch):
+    dev, phy = _make_device(monkeypatch)
+
+    dev.handle_request(struct.pack('<BBHHH', 0x81, 0x06, 0x2200, 3, 0x40))
+
+    assert phy.sent == [(0, None)]
+
+
+def test_device_request_parses_setup_and_data_stage():
+    raw = struct.pack('<BBHHH', 0x21, 0x20, 0x0100, 2, 7) + b'\x80\x25\x00\x00\x00\x00\x08'
+
+    req = usb_device.USBDeviceRequest(raw)
+
+    assert (req.request_type, req.request, req.value, req.index, req.length) == (0x21, 0x20, 0x0100, 2, 7)
+    assert req.data_view.tobytes() == raw[8:]
+    assert req.data == raw[8:]
+    assert req.raw_bytes is raw
+    assert req.raw() == raw[:8]
+    assert not hasattr(req, '__dict__')
+
+
+def test_device_request_copies_a_reused_phy_buffer():
+    buf = bytearray(struct.pack('<BBHHH', 0x21, 0x20, 0x0100, 2, 2) + b'\x80\x25')
+
+    req = usb_device.USBDeviceRequest(memoryview(buf))
+    view = req.data_view
+    buf[:] = bytes(len(buf))
+
+    assert type(req.raw_bytes) is bytes
+    assert req.raw_bytes[:2] == b'\x21\x20'
+    assert view.tobytes() == b'\x80\x25'
+    assert view.readonly
+
+
+def _make_configured_device(monkeypatch, received, supported):
+    from numap.core.usb_configuration import USBConfiguration
+    from numap.core.usb_endpoint import USBEndpoint
+    from numap.core.usb_interface import USBInterface
+
+    app = DummyApp()
+    app.usb_function_supported = supported.append
+    phy = DummyPhy()
+
+    def endpoint(number, direction, handler):
+        return USBEndpoint(
+            app=app, phy=phy, number=number, direction=direction,
+            transfer_type=USBEndpoint.transfer_type_bulk,
+            sync_type=USBEndpoint.sync_type_none,
+            usage_type=USBEndpoint.usage_type_data,
+            max_packet_size=64, interval=0, handler=handler,
+        )
+
+    interface = USBInterface(
+        app=app, phy=phy, interface_number=0, interface_alternate=0,
+        interface_class=0xff, interface_subclass=0, interface_protocol=0,
+        interface_string_index=0,
+        endpoints=[
+            endpoint(1, USBEndpoint.direction_out, received.append),
+            endpoint(1, USBEndpoint.direction_in, lambda: received.append('in')),
+        ],
+    )
+    config = USBConfiguration(app=app, phy=phy, index=1, string='cfg', interfaces=[interface])
+    dev, phy = _make_device(monkeypatch, app=app, phy=phy, configurations=[config])
+    dev.handle_request(struct.pack('<BBHHH', 0x00, 0x09, 1, 0, 0))
+    return dev
+
+
+def test_endpoint_table_dispatches_by_direction(monkeypatch):
+    received = []
+    supported = []
+    dev = _make_configured_device(monkeypatch, received, supported)
+
+    dev.handle_data_available(1, b'a')
+    dev.handle_data_available(1, b'b')
+    dev.handle_buffer_available(1)
+    dev.handle_data_available(2, b'c')
+
+    assert received == [b'a', b'b', 'in']
+    assert supported == ['data received on endpoint 0x1']
+
+    dev.disconnect()
+    dev.handle_data_available(1, b'd')
+    assert received == [b'a', b'b', 'in']
@@ -0,0 +1,70 @@
+import struct
+
+from numap.apps.base import NumapApp
+from numap.core.usb import DescriptorType
+from numap.phy.vhost import VirtualHostPhy
+
+
+class VhostApp(NumapApp):
+    def __init__(self):
+        super(VhostApp, self).__init__(docstring=None)
+        self.supported = []
+
+    def usb_function_supported(self, reason=None):
+        self.supported.append(reason)
+
+
+def _run(dev_name, host_os='linux', **kwargs):
+    app = VhostApp()
+    phy = VirtualHostPhy(app, host_os=host_os, **kwargs)
+    dev = app.load_device(dev_name, phy)
+    dev.connect()
+    phy.run()
+    dev.disconnect()
+    return app, phy, dev
+
+
+def test_linux_enumeration_configures_device():
+    app, phy, dev = _run('keyboard')
+    assert phy.done
+    assert dev.address == 1
+    assert dev.config_num == 0
+    assert phy.device_descriptor[1] == DescriptorType.device
+    total_length = struct.unpack('<H', phy.configuration_descriptor[2:4])[0]
+    assert len(phy.configuration_descriptor) == total_length
+    assert phy.strings
+    assert phy.stats['polls'] > 0
+
+
+def test_windows_enumeration_and_ccid_traffic():
+    app, phy, dev = _run('smartcard', host_os='windows')
+    assert phy.done
+    assert phy.stats['ccid_messages'] == 5
+    assert phy.stats['timeouts'] == 0
+    assert app.supported
+
+
+def test_mass_storage_scsi_traffic(tmp_path):
+    from numap.dev.mass_storage import USBMassStorageDevice
+
+    image = tmp_path / 'stick.img'
+    image.write_bytes(b'\x00' * 0x200 * 64)
+    app = VhostApp()
+    phy = VirtualHostPhy(app, read_blocks=4)
+    dev = USBMassStorageDevice(app, phy, disk_image_filename=str(image))
+    try:
+        dev.connect()
+        phy.run()
+        dev.disconnect()
+    finally:
+        dev.scsi_device.stop()
+    assert phy.stats['scsi_commands'] == 6
+    assert phy.stats['timeouts'] == 0
+    assert phy.stats['bytes_in'] >= 4 * 0x200
+
+
+def test_load_phy_selects_virtual_host():
+    app = VhostApp()
+    phy = app.load_phy('vhost:windows')
+    assert isinstance(phy, VirtualHostPhy)
+    assert phy.host_os == 'windows'
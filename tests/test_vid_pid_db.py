@@ -0,0 +1,95 @@
+import pickle
+
+import pytest
+
+from numap.utils.vid_pid_db import (
+    OS, CompiledDB, DBEntry, VidPidSweep, compile_db, is_compiled_db, parse_usb_ids,
+)
+
+USB_IDS = '''# comment
+0001  Fry's Electronics
+\t7778  Counterfeit flash drive [Kingston]
+0002  Ingram
+\t0001  Product one
+\t\t01  some interface
+C 00  (Defined at Interface level)
+\t01  Audio
+'''
+
+
+def test_compiled_db_lookup(tmp_path):
+    path = str(tmp_path / 'vid_pid.db')
+    entries = [
+        DBEntry(0x1234, pid, 'vendor', 'product %d' % pid, drivers={OS.LINUX: 'drv%d' % (pid % 2)})
+        for pid in range(600)
+    ]
+    entries.append(DBEntry(0x1234, 0x0001, 'duplicate'))
+
+    assert compile_db(entries, path) == 600
+    assert is_compiled_db(path)
+    db = CompiledDB(path)
+    db.chunk_size = 100
+
+    assert len(db) == 600
+    assert db[0].pid == 0
+    assert db[599].product_name == 'product 599'
+    assert db[-1].pid == 599
+    assert db[250].drivers == {OS.LINUX: 'drv0'}
+    assert [e.pid for e in db.find(0x1234, 3)] == [3]
+    assert len(db.find_by_driver(OS.LINUX, 'drv1')) == 300
+    assert sum(1 for _ in db) == 600
+
+
+def test_parse_usb_ids(tmp_path):
+    path = tmp_path / 'usb.ids'
+    path.write_text(USB_IDS)
+
+    entries = list(parse_usb_ids(str(path)))
+
+    assert [(e.vid, e.pid) for e in entries] == [(0x0001, 0x7778), (0x0002, 0x0001)]
+    assert entries[0].vendor_name == "Fry's Electronics"
+    assert entries[1].product_name == 'Product one'
+
+
+def test_vid_pid_sweep_ranges():
+    sweep = VidPidSweep('1001-1003:0000-0004,2058:1005')
+
+    assert len(sweep) == 9
+    assert [e.vidpid() for e in sweep][:5] == ['1001:0000', '1001:0001', '1001:0002', '1001:0003', '1002:0000']
+    assert sweep[8].vidpid() == '2058:1005'
+    assert sweep[-2].vidpid() == '1002:0003'
+    with pytest.raises(IndexError):
+        sweep[9]
+
+
+def test_vid_pid_sweep_stride_and_sample():
+    strided = VidPidSweep('1234:0000-0010', stride=4)
+    assert [e.pid for e in strided] == [0, 4, 8, 12]
+
+    full = VidPidSweep('1000-1100:0000-ffff')
+    sample = VidPidSweep('1000-1100:0000-ffff', sample=1000)
+    assert full.combinations == 0x100 * 0xffff
+    assert len(sample) == 1000
+    picked = [(e.vid, e.pid) for e in sample]
+    assert len(set(picked)) == 1000
+    # spread over the whole range, not the first 1000 combinations
+    assert max(vid for vid, _ in picked) > 0x1080
+
+    with pytest.raises(ValueError):
+        VidPidSweep('1234')
+
+
+def test_db_entry_is_frozen_and_shares_driver_tables():
+    a = DBEntry(0x1234, 1, 'vendor', drivers={OS.LINUX: 'drivers/usb/serial/option.c'})
+    b = DBEntry(0x1234, 2, 'vendor', drivers={OS.LINUX: 'drivers/usb/serial/option.c'})
+
+    assert a.drivers is b.drivers
+    assert not hasattr(a, '__dict__')
+    with pytest.raises(AttributeError):
+        a.info = 'x'
+    with pytest.raises(TypeError):
+        a.drivers[OS.LINUX] = 'other'
+    tested = a.with_info('num_endpoints = 2')
+    assert tested.info == 'num_endpoints = 2' and a.info is None
+    assert a.describe(OS.LINUX) == 'vid:pid 1234:0001, vendor: vendor, driver: drivers/usb/serial/option.c'
+    assert pickle.loads(pickle.dumps(tested)) == tested